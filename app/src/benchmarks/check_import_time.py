@@ -0,0 +1,103 @@
+'''
+Import-time budget for the daily bot entry point.
+
+    python -m app.src.benchmarks.check_import_time [--budget 1.5] [--repeat 3]
+
+Run from the repository root. Imports app.src.telegram_bot.main in fresh interpreters with
+TRANSPORT_MODE=replay and no credentials, so any network call or config read at import time
+fails the check. Exits 1 when the best import time is over budget or when one of the heavy
+libraries that should load on first use (yfinance, gspread, pandas_ta, numba, and
+python-telegram-bot, which only bot.py needs) was imported.
+'''
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+
+MODULE_ENTRY_POINT = 'app.src.telegram_bot.main'
+
+# pandas and requests are needed by every run; these are only needed by some code paths
+LAZY_MODULES = ['yfinance', 'gspread', 'google.oauth2', 'pandas_ta', 'numba', 'telegram']
+
+IMPORT_BUDGET_SECONDS = 1.5
+N_REPEAT = 3
+N_SLOWEST = 10
+
+CHILD_CODE = f'''
+import sys, json, time
+start = time.perf_counter()
+import {MODULE_ENTRY_POINT}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': sorted(sys.modules)}}))
+'''
+
+ENV_REMOVED = ['URL_STANDIN', 'TELEGRAM_TOKEN', 'SERVICE_ACCOUNT_JSON', 'ID_SHEET_QT_PORTFOLIO', 'METRICS_ENABLED']
+
+
+def import_once():
+    '''({'seconds', 'modules'}, [(cumulative us, package)]) from one fresh interpreter.'''
+    env = {key: value for key, value in os.environ.items() if key not in ENV_REMOVED}
+    env['TRANSPORT_MODE'] = 'replay'
+
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD_CODE],
+        capture_output=True, text=True, env=env,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f'Importing {MODULE_ENTRY_POINT} failed:\n{process.stderr[-2000:]}')
+
+    return json.loads(process.stdout.strip().splitlines()[-1]), parse_importtime(process.stderr)
+
+
+def parse_importtime(stderr):
+    '''Cumulative microseconds of each top-level package from -X importtime output.'''
+    list_packages = list()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        if cumulative.isdigit() and not name.startswith(' ') and '.' not in name:
+            list_packages.append((int(cumulative), name))
+
+    return sorted(list_packages, reverse=True)
+
+
+def check_import_time(budget=IMPORT_BUDGET_SECONDS, n_repeat=N_REPEAT):
+    '''(passed, report lines); the first import also warms the bytecode cache, so the best run counts.'''
+    list_runs = [import_once() for _ in range(n_repeat)]
+    dict_best, list_packages = min(list_runs, key=lambda run: run[0]['seconds'])
+
+    set_modules = set(dict_best['modules'])
+    list_loaded = [name for name in LAZY_MODULES if name in set_modules]
+
+    list_lines = [f'{MODULE_ENTRY_POINT}: {dict_best["seconds"]:.3f}s (budget {budget:.3f}s, best of {n_repeat})']
+    list_lines += [f'  {name:<24} {cumulative / 1e3:>8.1f} ms' for cumulative, name in list_packages[:N_SLOWEST]]
+
+    passed = True
+    if dict_best['seconds'] > budget:
+        list_lines.append('Import time over budget')
+        passed = False
+    if list_loaded:
+        list_lines.append(f'Imported eagerly: {", ".join(list_loaded)}')
+        passed = False
+
+    return passed, list_lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget', type=float, default=IMPORT_BUDGET_SECONDS, help='seconds')
+    parser.add_argument('--repeat', type=int, default=N_REPEAT)
+    args = parser.parse_args()
+
+    passed, list_lines = check_import_time(args.budget, args.repeat)
+    print('\n'.join(list_lines))
+
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
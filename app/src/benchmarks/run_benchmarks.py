@@ -0,0 +1,364 @@
+'''
+Offline benchmarks for the strategy and ledger hot paths on synthetic data.
+
+    python -m app.src.benchmarks.run_benchmarks [--quick] [--save-baseline] [--tolerance 1.5]
+
+Run from the repository root. Each case reports the best-of-n wall time and the peak traced
+allocation (Python and NumPy; Arrow buffers are not traced) of one extra run. Results are
+compared with the saved baseline and the exit code is 1 when any case is slower (or larger)
+than tolerance x baseline. Everything runs in a scratch working directory with network
+connections refused; price downloads are served from the synthetic bars.
+
+Before timing each bar size, the numpy indicators are checked against pandas_ta, and the
+vectorized signals and position sizes against the per-row rules; the run fails on a mismatch.
+It also fails when reading the Parquet ledger is slower than reading the CSV it replaced at the
+ledger sizes the bot actually has (BOT_LEDGER_ROWS).
+'''
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import platform
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+
+from app.src.benchmarks.synthetic_data import (
+    N_BARS_PER_YEAR,
+    make_pair_bars,
+    make_trades_csv_frame,
+    make_activities_json,
+    make_positions_json,
+)
+from app.src.utils import cache_utils, fx_utils, market_data_utils, qt_utils
+from app.src.utils.strategy_utils import (
+    TICKERS,
+    calculate_indicators,
+    check_indicator_parity,
+    build_strategy_frame,
+    generate_signal,
+    generate_signals,
+    calculate_position_size,
+    calculate_position_sizes,
+    get_daily_delta,
+    RISK_PERCENTAGE_PER_TRADE,
+)
+
+
+PATH_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+BAR_YEARS = [1, 5, 10, 30]
+LEDGER_ROWS = [1_000, 10_000, 100_000, 1_000_000]
+N_POSITIONS = [10, 100, 1_000]
+
+QUICK_BAR_YEARS = [1, 5]
+QUICK_LEDGER_ROWS = [1_000, 10_000]
+QUICK_N_POSITIONS = [10, 100]
+
+# Per-row reference paths are only timed up to this many rows
+MAX_ROWS_PER_ROW_CASES = 10 * N_BARS_PER_YEAR
+
+N_ACTIVITIES_PER_UPDATE = 1_000
+N_REPEAT = 3
+TOLERANCE = 1.5
+# Slowdowns smaller than this are timer noise on sub-millisecond cases
+MIN_REGRESSION_SECONDS = 0.005
+
+# Ledger cases -> the CSV case they replace; the ledger must not be slower at the bot's sizes
+MAP_LEDGER_CSV_CASES = {'load_trades': 'load_trades_csv', 'load_trades_typed': 'load_trades_csv_typed'}
+BOT_LEDGER_ROWS = [1_000, 10_000]
+
+
+# --- Parity ---
+
+def check_indicator_backends(df_bars):
+    '''Fail the run when the numpy indicators drift from pandas_ta on these bars.'''
+    try:
+        import pandas_ta  # noqa: F401
+    except ImportError:
+        print('Indicator parity skipped: pandas_ta is not installed')
+        return
+
+    max_abs_diff = check_indicator_parity(df_bars)
+    print(f'Indicator parity ok on {len(df_bars)} bars (max abs diff {max_abs_diff.max():.2e})')
+
+
+def check_vectorized_engine(df_strategy, capital=10000.0):
+    '''Fail the run unless generate_signals and calculate_position_sizes match their per-row references.'''
+    labels = np.array(['CASH', 'TQQQ', 'SQQQ'])[generate_signals(df_strategy)]
+    reference_labels = df_strategy.apply(generate_signal, axis=1).to_numpy()
+    n_signal_diffs = int((labels != reference_labels).sum())
+
+    sizes = calculate_position_sizes(df_strategy, capital, generate_signals(df_strategy))
+    reference_sizes = np.array([
+        calculate_position_size(row, capital, RISK_PERCENTAGE_PER_TRADE, label)
+        for (_, row), label in zip(df_strategy.iterrows(), reference_labels)
+    ], dtype=float)
+    n_size_diffs = int((sizes != reference_sizes).sum())
+
+    if n_signal_diffs or n_size_diffs:
+        raise AssertionError(f'Vectorized engine disagrees with the per-row rules: {n_signal_diffs} signals, {n_size_diffs} sizes')
+
+    dict_counts = pd.Series(labels).value_counts().to_dict()
+    print(f'Vectorized engine parity ok on {len(df_strategy)} bars (signals: {dict_counts})')
+
+
+# --- Offline environment ---
+
+def block_network():
+    '''Refuse outbound connections so an accidental API call fails loudly instead of timing the network.'''
+    def refuse(*args, **kwargs):
+        raise ConnectionRefusedError('Network access is disabled while benchmarking')
+
+    socket.socket.connect = refuse
+    socket.create_connection = refuse
+
+
+def serve_bars(dict_bars):
+    '''Route market_data_utils downloads to in-memory bars, keeping the [start, end) convention.'''
+    def get_slice(ticker, start_date, end_date):
+        df = dict_bars[ticker]
+        return df[(df.index >= pd.Timestamp(start_date)) & (df.index < pd.Timestamp(end_date))].copy()
+
+    market_data_utils.download_ohlcv = get_slice
+    market_data_utils.download_ohlcv_batch = lambda tickers, start_date, end_date: {
+        ticker: get_slice(ticker, start_date, end_date) for ticker in tickers
+    }
+
+
+def seed_fx_cache(rate=1.37):
+    fx_utils.DICT_FX_LATEST[('USD', 'CAD')] = {'rate': rate, 'fetched_at': time.time()}
+
+
+# --- Measurement ---
+
+def measure(fn, n_repeat=N_REPEAT):
+    '''(best seconds over n_repeat runs, peak traced MB of one more run).'''
+    list_times = list()
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        fn()
+        list_times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(list_times), peak / 2 ** 20
+
+
+def get_strategy_cases(n_years):
+    n_bars = n_years * N_BARS_PER_YEAR
+    dict_bars = make_pair_bars(n_bars)
+    all_data = pd.concat(
+        [df.rename(columns=lambda col: f'{col}_{ticker}') for ticker, df in dict_bars.items()], axis=1,
+    )
+    df_qqq = dict_bars['QQQ'].copy()
+    check_indicator_backends(df_qqq)
+
+    df_strategy = build_strategy_frame(all_data)
+    signals = generate_signals(df_strategy)
+    labels = pd.Series(np.array(['CASH', 'TQQQ', 'SQQQ'])[signals], index=df_strategy.index)
+
+    dict_cases = {
+        'calculate_indicators': lambda: calculate_indicators(df_qqq.copy()),
+        'generate_signals': lambda: generate_signals(df_strategy),
+        'calculate_position_sizes': lambda: calculate_position_sizes(df_strategy, 10000.0, signals),
+    }
+
+    if n_bars <= MAX_ROWS_PER_ROW_CASES:
+        check_vectorized_engine(df_strategy)
+        dict_cases['generate_signal'] = lambda: df_strategy.apply(generate_signal, axis=1)
+        dict_cases['calculate_position_size'] = lambda: [
+            calculate_position_size(row, 10000.0, RISK_PERCENTAGE_PER_TRADE, label)
+            for (_, row), label in zip(df_strategy.iterrows(), labels)
+        ]
+
+    # Bars are served from memory; the first call builds the bar cache and indicator state
+    serve_bars(dict_bars)
+    start_date = df_qqq.index[0].strftime('%Y-%m-%d')
+    end_date = (df_qqq.index[-1] + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    portfolio = {'SQQQ_SHARES': 0, 'TQQQ_SHARES': 10, 'CASH_USD': 10000.0}
+    get_daily_delta(TICKERS, start_date, end_date, portfolio)
+    dict_cases['get_daily_delta'] = lambda: get_daily_delta(TICKERS, start_date, end_date, portfolio)
+
+    return dict_cases
+
+
+def get_csv_cases(n_rows):
+    make_trades_csv_frame(n_rows).to_csv(qt_utils.PATH_DATA_TRADES, index=False)
+
+    return {
+        'load_trades_csv': lambda: qt_utils.load_trades(),
+        'load_trades_csv_typed': lambda: qt_utils.load_trades(typed=True),
+    }
+
+
+def get_ledger_cases(n_rows):
+    make_trades_csv_frame(n_rows).to_csv(qt_utils.PATH_DATA_TRADES, index=False)
+    qt_utils.migrate_trades_to_ledger()
+    os.remove(qt_utils.PATH_DATA_TRADES)
+
+    df_trades, _ = qt_utils.load_trades()
+    df_typed, _ = qt_utils.load_trades(typed=True)
+    df_activities = qt_utils.preprocess_activities(make_activities_json(N_ACTIVITIES_PER_UPDATE, seed=1))
+
+    def get_trades_cold():
+        qt_utils.TRADE_INDEX = None
+        return qt_utils.get_trades('TQQQ', df_typed, account_type='TFSA')
+
+    return {
+        'load_trades': lambda: qt_utils.load_trades(),
+        'load_trades_typed': lambda: qt_utils.load_trades(typed=True),
+        'update_trades': lambda: qt_utils.update_trades(df_trades, df_activities),
+        'get_trades_cold': get_trades_cold,
+        'get_trades_warm': lambda: qt_utils.get_trades('TQQQ', df_typed, account_type='TFSA'),
+    }
+
+
+def get_position_cases(n_positions):
+    dict_acc_positions = make_positions_json(n_positions)
+
+    def preprocess():
+        # preprocess_acc_positions tags the position dicts in place, so each run gets a copy
+        dict_copy = {acc: {'positions': [dict(position) for position in positions['positions']]} for acc, positions in dict_acc_positions.items()}
+        return qt_utils.preprocess_acc_positions(dict_copy, combine_accounts=False)
+
+    return {'preprocess_acc_positions': preprocess}
+
+
+def run_benchmarks(quick=False, n_repeat=N_REPEAT):
+    '''[{'case', 'size', 'seconds', 'peak_mb'}] for every case at every size.'''
+    block_network()
+    seed_fx_cache()
+    cache_utils.REDIS_URL = None
+
+    list_groups = [
+        ('years', QUICK_BAR_YEARS if quick else BAR_YEARS, get_strategy_cases),
+        ('rows', QUICK_LEDGER_ROWS if quick else LEDGER_ROWS, get_csv_cases),
+        ('rows', QUICK_LEDGER_ROWS if quick else LEDGER_ROWS, get_ledger_cases),
+        ('positions', QUICK_N_POSITIONS if quick else N_POSITIONS, get_position_cases),
+    ]
+
+    path_cwd = os.getcwd()
+    list_results = list()
+    for unit, list_sizes, get_cases in list_groups:
+        for size in list_sizes:
+            with tempfile.TemporaryDirectory() as path_tmp:
+                os.chdir(path_tmp)
+                os.makedirs('data')
+                # Each size starts cold, like its scratch directory
+                cache_utils.reset_backend()
+
+                try:
+                    for case, fn in get_cases(size).items():
+                        seconds, peak_mb = measure(fn, n_repeat)
+                        list_results.append({'case': case, 'size': f'{size} {unit}', 'seconds': seconds, 'peak_mb': peak_mb})
+                        print(f'{case:<28} {size:>9} {unit:<9} {seconds * 1e3:>10.2f} ms {peak_mb:>10.2f} MB')
+                finally:
+                    os.chdir(path_cwd)
+
+    return list_results
+
+
+# --- Baseline ---
+
+def load_baseline(path=PATH_BASELINE):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_baseline(list_results, path=PATH_BASELINE):
+    dict_baseline = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': list_results,
+    }
+    with open(path, 'w') as file:
+        json.dump(dict_baseline, file, indent=2)
+
+
+def compare_to_baseline(list_results, dict_baseline, tolerance=TOLERANCE):
+    '''Results joined with the baseline; 'regressed' when time or peak memory exceeds tolerance x baseline.'''
+    df_results = pd.DataFrame(list_results)
+    df_baseline = pd.DataFrame(dict_baseline['results'])
+
+    df_comparison = df_results.merge(df_baseline, on=['case', 'size'], how='left', suffixes=('', '_baseline'))
+    df_comparison['time_ratio'] = df_comparison['seconds'] / df_comparison['seconds_baseline']
+    df_comparison['memory_ratio'] = df_comparison['peak_mb'] / df_comparison['peak_mb_baseline']
+    is_slower = (df_comparison['time_ratio'] > tolerance) & (df_comparison['seconds'] - df_comparison['seconds_baseline'] > MIN_REGRESSION_SECONDS)
+    df_comparison['regressed'] = is_slower | (df_comparison['memory_ratio'] > tolerance)
+
+    return df_comparison
+
+
+def compare_ledger_to_csv(list_results):
+    '''Ledger reads joined with the CSV reads they replace; 'slower' only counts at BOT_LEDGER_ROWS.'''
+    df_results = pd.DataFrame(list_results)
+    df_csv = df_results[['case', 'size', 'seconds']].rename(columns={'case': 'case_csv', 'seconds': 'seconds_csv'})
+
+    df_comparison = df_results[df_results['case'].isin(MAP_LEDGER_CSV_CASES.keys())][['case', 'size', 'seconds']]
+    df_comparison['case_csv'] = df_comparison['case'].map(MAP_LEDGER_CSV_CASES)
+    df_comparison = df_comparison.merge(df_csv, on=['case_csv', 'size'], how='inner')
+    df_comparison['ratio'] = df_comparison['seconds'] / df_comparison['seconds_csv']
+
+    n_rows = df_comparison['size'].str.split().str[0].astype(int)
+    is_slower = df_comparison['seconds'] - df_comparison['seconds_csv'] > MIN_REGRESSION_SECONDS
+    df_comparison['slower'] = n_rows.isin(BOT_LEDGER_ROWS) & is_slower
+
+    return df_comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='small sizes only')
+    parser.add_argument('--repeat', type=int, default=N_REPEAT)
+    parser.add_argument('--baseline', default=PATH_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='overwrite the baseline with this run')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    path_baseline = os.path.abspath(args.baseline)
+    list_results = run_benchmarks(quick=args.quick, n_repeat=args.repeat)
+
+    df_ledger_vs_csv = compare_ledger_to_csv(list_results)
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(df_ledger_vs_csv[['case', 'size', 'seconds', 'seconds_csv', 'ratio', 'slower']])
+    if df_ledger_vs_csv['slower'].any():
+        print('Ledger reads slower than the CSV at bot sizes')
+        return 1
+
+    if args.save_baseline:
+        save_baseline(list_results, path_baseline)
+        print(f'Saved baseline to {path_baseline}')
+        return 0
+
+    dict_baseline = load_baseline(path_baseline)
+    if dict_baseline is None:
+        print(f'No baseline at {path_baseline}; run with --save-baseline to create one')
+        return 0
+
+    df_comparison = compare_to_baseline(list_results, dict_baseline, args.tolerance)
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(df_comparison[['case', 'size', 'seconds', 'time_ratio', 'peak_mb', 'memory_ratio', 'regressed']])
+
+    if df_comparison['regressed'].any():
+        print(f'Regressions beyond {args.tolerance}x baseline')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
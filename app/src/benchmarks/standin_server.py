@@ -0,0 +1,400 @@
+'''
+Local stand-in for the Questrade, Frankfurter, Yahoo chart and Telegram Bot APIs.
+
+    python -m app.src.benchmarks.standin_server --port 8765 --latency-ms 80 --error-rate 0.02
+    URL_STANDIN=http://127.0.0.1:8765 python main.py
+
+The Bot API part is enough for a polling bot (getMe, deleteWebhook, long-polled getUpdates,
+sendMessage). Messages to the bot are injected with POST /standin/updates {"text": "/signal"}
+and everything the bot sent is listed by GET /standin/messages. Quotes (v1/markets/quotes)
+random-walk from the last bar; POST /standin/quotes {"symbol": "QQQ", "price": 400} pins one.
+
+Requests are answered from recorded cassettes (TRANSPORT_MODE=record) when one matches, else
+from synthetic data. Every response can be delayed (latency plus uniform jitter) and a fraction
+can fail with an HTTP error or a dropped connection.
+'''
+import json
+import time
+import random
+import zlib
+import argparse
+import threading
+
+import pandas as pd
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+from app.src.benchmarks.synthetic_data import (
+    N_BARS_PER_YEAR,
+    make_ohlcv,
+    make_activities_json,
+    make_positions_json,
+    make_balances_json,
+)
+from app.src.utils.qt_utils import LIST_ACC_TYPES
+from app.src.utils.transport_utils import (
+    get_cassette_key,
+    load_cassette,
+)
+
+
+ACC_NO_START = 51000000
+N_POSITIONS = 20
+N_ACTIVITIES_PER_DAY = 0.5
+FX_RATES = {('USD', 'CAD'): 1.37, ('CAD', 'USD'): 1 / 1.37}
+N_YEARS_OF_BARS = 35
+HELD_TICKERS = {'TQQQ': 25.0}
+STANDIN_CHAT_ID = 1
+MAX_POLL_SECONDS = 10
+QUOTE_VOLATILITY = 0.0005  # per quote request
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, error_status=503,
+                 path_cassettes=None, seed=0):
+        super().__init__(address, StandinHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.path_cassettes = path_cassettes
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.n_requests = 0
+        self.n_messages = 0
+        self.dict_bars = dict()
+        self.list_messages = list()
+        self.list_updates = list()
+        self.updates_ready = threading.Condition(self.lock)
+        self.dict_symbols = dict()
+        self.dict_quotes = dict()
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def push_update(self, text, chat_id=STANDIN_CHAT_ID):
+        '''Queue a user message to the bot for its next getUpdates.'''
+        with self.lock:
+            update_id = len(self.list_updates) + 1
+            dict_message = {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Stand-in'},
+                'text': text,
+            }
+            if text.startswith('/'):
+                dict_message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+
+            self.list_updates.append({'update_id': update_id, 'message': dict_message})
+            self.updates_ready.notify_all()
+
+        return update_id
+
+    def get_quote(self, symbol):
+        '''An L1 quote for today's session: a random walk from the last bar's close, or a price set with set_price.'''
+        df_bars = self.get_bars(symbol)
+        with self.lock:
+            dict_quote = self.dict_quotes.get(symbol)
+            if dict_quote is None:
+                open_price = float(df_bars['Close'].iloc[-2])
+                dict_quote = {'open': open_price, 'price': open_price, 'high': open_price, 'low': open_price, 'is_pinned': False}
+                self.dict_quotes[symbol] = dict_quote
+
+            if not dict_quote['is_pinned']:
+                dict_quote['price'] *= 1 + self.random.gauss(0, QUOTE_VOLATILITY)
+            dict_quote['high'] = max(dict_quote['high'], dict_quote['price'])
+            dict_quote['low'] = min(dict_quote['low'], dict_quote['price'])
+
+            return dict(dict_quote)
+
+    def set_price(self, symbol, price):
+        '''Pin a symbol's last price, e.g. to trigger a stop.'''
+        self.get_quote(symbol)
+        with self.lock:
+            self.dict_quotes[symbol].update(price=float(price), is_pinned=True)
+
+    def get_updates(self, offset, timeout):
+        '''Updates from offset on, waiting up to timeout seconds for one like Telegram's long polling.'''
+        deadline = time.time() + min(timeout, MAX_POLL_SECONDS)
+        with self.lock:
+            while len(self.list_updates) < offset and time.time() < deadline:
+                self.updates_ready.wait(deadline - time.time())
+            return self.list_updates[max(offset - 1, 0):]
+
+    def get_bars(self, ticker):
+        '''Synthetic daily history per ticker, ending today and stable across calls.'''
+        with self.lock:
+            if ticker not in self.dict_bars:
+                n_bars = N_YEARS_OF_BARS * N_BARS_PER_YEAR
+                start = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=n_bars)[0]
+                self.dict_bars[ticker] = make_ohlcv(n_bars, seed=zlib.crc32(ticker.encode()), start=start)
+            return self.dict_bars[ticker]
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        server = self.server
+        with server.lock:
+            server.n_requests += 1
+            delay = server.latency_ms + server.random.uniform(0, server.jitter_ms)
+            is_error = server.random.random() < server.error_rate
+
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(delay / 1e3)
+
+        if is_error:
+            if server.error_status == 0:
+                self.close_connection = True
+                return
+            return self.send_json(server.error_status, {'code': server.error_status, 'message': 'Injected error'})
+
+        key = get_cassette_key(method, self.path)
+        cassette = load_cassette(key, server.path_cassettes) if server.path_cassettes else None
+        if cassette is not None:
+            status_code, headers, content = cassette
+            return self.send_body(status_code, content, headers.get('Content-Type', 'application/json'))
+
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query))
+        try:
+            status_code, payload = route(server, method, parts.path, params, body)
+        except (KeyError, ValueError) as e:
+            status_code, payload = 400, {'code': 400, 'message': f'Bad request: {e}'}
+
+        self.send_json(status_code, payload)
+
+    def send_json(self, status_code, payload):
+        content = json.dumps(payload, default=lambda value: value.item() if hasattr(value, 'item') else str(value)).encode()
+        self.send_body(status_code, content, 'application/json')
+
+    def send_body(self, status_code, content, content_type):
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+# --- Synthetic routes ---
+
+def parse_body(body):
+    '''Bot API parameters from a JSON or form-encoded body (python-telegram-bot sends forms).'''
+    if not body:
+        return dict()
+
+    try:
+        return json.loads(body)
+    except ValueError:
+        return dict(parse_qsl(body.decode()))
+
+
+def get_acc_type(acc_no):
+    return LIST_ACC_TYPES[(int(acc_no) - ACC_NO_START) % len(LIST_ACC_TYPES)]
+
+
+def route(server, method, path, params, body):
+    list_parts = [part for part in path.split('/') if part]
+
+    if path == '/oauth2/token':
+        return 200, {
+            'access_token': 'standin-access',
+            'api_server': f'{server.url}/',
+            'refresh_token': f'standin-{params["refresh_token"]}',
+            'expires_in': 1800,
+            'token_type': 'Bearer',
+        }
+
+    if list_parts[:2] == ['v1', 'accounts']:
+        return route_accounts(list_parts[2:], params)
+
+    if list_parts[:3] == ['v1', 'symbols', 'search']:
+        prefix = params['prefix']
+        symbol_id = zlib.crc32(prefix.encode())
+        with server.lock:
+            server.dict_symbols[symbol_id] = prefix
+        return 200, {'symbols': [{'symbol': prefix, 'symbolId': symbol_id, 'description': f'{prefix} (stand-in)'}]}
+
+    if list_parts[:3] == ['v1', 'markets', 'quotes']:
+        return route_quotes(server, [int(symbol_id) for symbol_id in params['ids'].split(',')])
+
+    if path == '/latest':
+        return 200, {'amount': 1.0, 'base': params['from'], 'date': pd.Timestamp.today().strftime('%Y-%m-%d'),
+                     'rates': {params['to']: FX_RATES[(params['from'], params['to'])]}}
+
+    if len(list_parts) == 1 and '..' in list_parts[0]:
+        start_date, end_date = list_parts[0].split('..')
+        rate = FX_RATES[(params['from'], params['to'])]
+        dates = pd.bdate_range(start_date, end_date or pd.Timestamp.today())
+        return 200, {'amount': 1.0, 'base': params['from'], 'start_date': start_date, 'end_date': end_date,
+                     'rates': {date.strftime('%Y-%m-%d'): {params['to']: rate} for date in dates}}
+
+    if list_parts[:3] == ['v8', 'finance', 'chart'] and len(list_parts) == 4:
+        return route_chart(server, list_parts[3], params)
+
+    if len(list_parts) == 2 and list_parts[0].startswith('bot'):
+        return route_bot(server, list_parts[1], {**params, **parse_body(body)})
+
+    if list_parts == ['standin', 'updates'] and method == 'POST':
+        payload = parse_body(body)
+        return 200, {'ok': True, 'result': server.push_update(payload['text'], int(payload.get('chat_id', STANDIN_CHAT_ID)))}
+
+    if list_parts == ['standin', 'quotes'] and method == 'POST':
+        payload = parse_body(body)
+        server.set_price(payload['symbol'], payload['price'])
+        return 200, {'ok': True}
+
+    if list_parts == ['standin', 'messages']:
+        with server.lock:
+            return 200, {'ok': True, 'result': list(server.list_messages)}
+
+    return 404, {'code': 404, 'message': f'No stand-in route for {method} {path}'}
+
+
+def route_accounts(list_parts, params):
+    if not list_parts:
+        return 200, {'accounts': [
+            {'type': acc_type, 'number': str(ACC_NO_START + i), 'status': 'Active', 'isPrimary': i == 0,
+             'isBilling': i == 0, 'clientAccountType': 'Individual'}
+            for i, acc_type in enumerate(LIST_ACC_TYPES)
+        ]}
+
+    acc_no, resource = list_parts[0], list_parts[1]
+    acc_type = get_acc_type(acc_no)
+
+    if resource == 'balances':
+        return 200, make_balances_json()
+
+    if resource == 'positions':
+        dict_positions = make_positions_json(N_POSITIONS, seed=int(acc_no))[acc_type]
+        if acc_type == LIST_ACC_TYPES[0]:
+            for symbol, quantity in HELD_TICKERS.items():
+                dict_positions['positions'].append({'symbol': symbol, 'openQuantity': quantity, 'currentMarketValue': quantity * 50.0})
+        return 200, dict_positions
+
+    if resource == 'activities':
+        start = pd.Timestamp(params['startTime']).tz_localize(None)
+        end = pd.Timestamp(params['endTime']).tz_localize(None)
+        n_days = max((end - start).days, 1)
+        seed = zlib.crc32(f'{acc_no}|{params["startTime"]}'.encode())
+        list_activities = make_activities_json(int(n_days * N_ACTIVITIES_PER_DAY), seed=seed, start=start.normalize(), n_days=n_days)
+        for activity in list_activities:
+            activity.pop('accountNo', None)
+            activity.pop('accountType', None)
+        return 200, {'activities': list_activities}
+
+    return 404, {'code': 404, 'message': f'Unknown account resource {resource}'}
+
+
+def route_quotes(server, list_symbol_ids):
+    now = pd.Timestamp.now(tz='America/New_York').isoformat()
+
+    list_quotes = list()
+    for symbol_id in list_symbol_ids:
+        symbol = server.dict_symbols[symbol_id]
+        dict_quote = server.get_quote(symbol)
+        list_quotes.append({
+            'symbol': symbol, 'symbolId': symbol_id, 'lastTradePrice': dict_quote['price'],
+            'openPrice': dict_quote['open'], 'highPrice': dict_quote['high'], 'lowPrice': dict_quote['low'],
+            'bidPrice': dict_quote['price'], 'askPrice': dict_quote['price'], 'lastTradeTime': now,
+            'isHalted': False, 'delay': 0,
+        })
+
+    return 200, {'quotes': list_quotes}
+
+
+def route_bot(server, bot_method, payload):
+    if bot_method == 'getMe':
+        return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Stand-in', 'username': 'standin_bot',
+                                            'can_join_groups': False, 'can_read_all_group_messages': False,
+                                            'supports_inline_queries': False}}
+
+    if bot_method in ['deleteWebhook', 'setMyCommands', 'close', 'logOut']:
+        return 200, {'ok': True, 'result': True}
+
+    if bot_method == 'getUpdates':
+        return 200, {'ok': True, 'result': server.get_updates(int(payload.get('offset') or 0), float(payload.get('timeout') or 0))}
+
+    if bot_method == 'sendMessage':
+        # Form bodies carry chat_id as a string
+        chat_id = payload.get('chat_id')
+        chat_id = int(chat_id) if str(chat_id).lstrip('-').isdigit() else chat_id
+        with server.lock:
+            server.n_messages += 1
+            dict_message = {'message_id': server.n_messages, 'date': int(time.time()),
+                            'chat': {'id': chat_id, 'type': 'private'}, 'text': payload.get('text')}
+            server.list_messages.append(dict_message)
+        return 200, {'ok': True, 'result': dict_message}
+
+    return 404, {'ok': False, 'error_code': 404, 'description': f'No stand-in Bot API method {bot_method}'}
+
+
+def route_chart(server, ticker, params):
+    df_bars = server.get_bars(ticker)
+    start = pd.to_datetime(int(params['period1']), unit='s')
+    end = pd.to_datetime(int(params['period2']), unit='s')
+    df_bars = df_bars[(df_bars.index >= start) & (df_bars.index < end)]
+
+    # Bars stamped at the 9:30 New York open, as Yahoo does
+    timestamps = (df_bars.index + pd.Timedelta(hours=9, minutes=30)).tz_localize('America/New_York').tz_convert('UTC')
+
+    return 200, {'chart': {'error': None, 'result': [{
+        'meta': {'symbol': ticker, 'currency': 'USD', 'exchangeTimezoneName': 'America/New_York'},
+        'timestamp': (timestamps.asi8 // 10 ** 9).tolist(),
+        'indicators': {
+            'quote': [{col.lower(): df_bars[col].round(6).tolist() for col in ['Open', 'High', 'Low', 'Close', 'Volume']}],
+            'adjclose': [{'adjclose': df_bars['Close'].round(6).tolist()}],
+        },
+    }]}}
+
+
+def start_standin_server(host='127.0.0.1', port=0, **kwargs):
+    '''Start a StandinServer on a background thread; point services at it with URL_STANDIN=server.url.'''
+    server = StandinServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, name='standin-server', daemon=True).start()
+
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503, help='HTTP status of injected errors; 0 drops the connection')
+    parser.add_argument('--cassettes', default=None, help='directory of recorded responses to serve first')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = StandinServer(
+        (args.host, args.port),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        path_cassettes=args.cassettes,
+        seed=args.seed,
+    )
+    print(f'Stand-in server on {server.url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
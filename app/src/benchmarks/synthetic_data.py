@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+
+from app.src.utils.qt_utils import (
+    LIST_ACC_TYPES,
+    MAP_COL_TRADES,
+)
+
+
+N_BARS_PER_YEAR = 252
+
+# Mix of plain US tickers, TSX listings and the raw Questrade codes MAP_REPLACE_SYMBOL rewrites
+SYMBOLS = ['TQQQ', 'SQQQ', 'QQQ', 'AAPL', 'MSFT', 'NVDA', 'VFV', '.NVDA', 'G036320', 'XEQT.TO', 'ZSP.TO', 'CNQ.TO']
+ACTIVITY_TYPES = ['Trades', 'Dividends', 'Deposits', 'Other']
+ACTIVITY_TYPE_WEIGHTS = [0.6, 0.2, 0.15, 0.05]
+
+
+def make_ohlcv(n_bars, seed=0, start='1995-01-02', price=100.0, drift=0.0004, vol=0.015):
+    '''Daily business-day bars from a geometric random walk, shaped like get_ohlcv output.'''
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(start, periods=n_bars, name='Date')
+
+    close = price * np.exp(np.cumsum(rng.normal(drift, vol, n_bars)))
+    open_price = close * (1 + rng.normal(0, vol / 3, n_bars))
+    high = np.maximum(open_price, close) * (1 + np.abs(rng.normal(0, vol / 2, n_bars)))
+    low = np.minimum(open_price, close) * (1 - np.abs(rng.normal(0, vol / 2, n_bars)))
+    volume = rng.integers(1_000_000, 50_000_000, n_bars).astype(float)
+
+    return pd.DataFrame({'Open': open_price, 'High': high, 'Low': low, 'Close': close, 'Volume': volume}, index=index)
+
+
+def make_pair_bars(n_bars, tickers=('QQQ', 'TQQQ', 'SQQQ'), seed=0, start='1995-01-02'):
+    '''{ticker: bars} for an underlying and its 3x bull/bear ETFs, moving with the underlying.'''
+    underlying, bull, bear = tickers
+    df_underlying = make_ohlcv(n_bars, seed=seed, start=start)
+    returns = df_underlying['Close'].pct_change().fillna(0).to_numpy()
+
+    dict_bars = {underlying: df_underlying}
+    for ticker, leverage in [(bull, 3), (bear, -3)]:
+        close = 50 * np.cumprod(np.maximum(1 + leverage * returns, 0.01))
+        dict_bars[ticker] = pd.DataFrame({
+            'Open': close, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close, 'Volume': df_underlying['Volume'],
+        }, index=df_underlying.index)
+
+    return dict_bars
+
+
+def make_trade_columns(n_rows, seed=0, start='2010-01-01', n_days=15 * 365):
+    rng = np.random.default_rng(seed)
+
+    settlement = pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.integers(0, max(n_days, 1), n_rows)), unit='D')
+    activity_type = rng.choice(ACTIVITY_TYPES, n_rows, p=ACTIVITY_TYPE_WEIGHTS)
+    is_trade = activity_type == 'Trades'
+    is_buy = rng.random(n_rows) < 0.6
+
+    quantity = np.where(is_trade, np.where(is_buy, 1, -1) * rng.integers(1, 200, n_rows), 0).astype(float)
+    price = np.where(is_trade, rng.uniform(5, 500, n_rows).round(2), 0.0)
+    gross_amount = -quantity * price
+    net_amount = np.where(is_trade, gross_amount - 4.95, rng.uniform(1, 1000, n_rows).round(2))
+
+    acc_idx = rng.integers(0, len(LIST_ACC_TYPES), n_rows)
+    symbol = np.where(activity_type == 'Deposits', '', rng.choice(SYMBOLS, n_rows))
+
+    return {
+        'transaction_date': settlement - pd.Timedelta(days=2),
+        'settlement_date': settlement,
+        'action': np.where(is_trade, np.where(is_buy, 'Buy', 'Sell'), ''),
+        'symbol': symbol,
+        'description': np.char.add('SYNTHETIC ', symbol.astype(str)),
+        'currency': np.where(np.char.endswith(symbol.astype(str), '.TO'), 'CAD', 'USD'),
+        'quantity': quantity,
+        'price': price,
+        'gross_amount': gross_amount,
+        'net_amount': net_amount,
+        'activity_type': activity_type,
+        'account_type': np.char.add('Individual ', np.array(LIST_ACC_TYPES)[acc_idx]),
+        'account_no': 51000000 + acc_idx,
+    }
+
+
+def make_trades_csv_frame(n_rows, seed=0, start='2010-01-01'):
+    '''A trade history in the Questrade CSV export layout read by read_trades_csv.'''
+    dict_cols = make_trade_columns(n_rows, seed=seed, start=start)
+    for col in ['transaction_date', 'settlement_date']:
+        dict_cols[col] = dict_cols[col].strftime('%Y-%m-%d %I:%M:%S %p')
+
+    df_trades = pd.DataFrame(dict_cols)
+    df_trades.columns = list(MAP_COL_TRADES.keys())
+    df_trades = df_trades.replace('', np.nan)
+
+    return df_trades
+
+
+def make_activities_json(n_rows, seed=0, start='2025-01-01', n_days=15 * 365):
+    '''Tagged activity dicts as returned by get_activities, ready for preprocess_activities.'''
+    dict_cols = make_trade_columns(n_rows, seed=seed, start=start, n_days=n_days)
+    for col in ['transaction_date', 'settlement_date']:
+        dict_cols[col] = dict_cols[col].strftime('%Y-%m-%dT00:00:00.000000-05:00')
+
+    df_activities = pd.DataFrame(dict_cols).rename(columns={
+        'transaction_date': 'transactionDate',
+        'settlement_date': 'settlementDate',
+        'gross_amount': 'grossAmount',
+        'net_amount': 'netAmount',
+        'activity_type': 'type',
+        'account_type': 'accountType',
+        'account_no': 'accountNo',
+    })
+    df_activities['tradeDate'] = df_activities['transactionDate']
+    df_activities['commission'] = np.where(df_activities['type'] == 'Trades', -4.95, 0.0)
+    df_activities['symbolId'] = 0
+
+    return df_activities.to_dict(orient='records')
+
+
+def make_positions_json(n_positions, seed=0):
+    '''{account type: positions response} spread over LIST_ACC_TYPES, as from get_acc_positions.'''
+    rng = np.random.default_rng(seed)
+
+    dict_acc_positions = {acc_type: {'positions': list()} for acc_type in LIST_ACC_TYPES}
+    for i in range(n_positions):
+        symbol = f'SYM{i}.TO' if i % 3 == 0 else f'SYM{i}'
+        quantity = float(rng.integers(1, 500))
+        price = float(rng.uniform(5, 500))
+        dict_acc_positions[LIST_ACC_TYPES[i % len(LIST_ACC_TYPES)]]['positions'].append({
+            'symbol': symbol,
+            'symbolId': i,
+            'openQuantity': quantity,
+            'closedQuantity': 0,
+            'currentMarketValue': quantity * price,
+            'currentPrice': price,
+            'averageEntryPrice': price * float(rng.uniform(0.7, 1.3)),
+            'closedPnl': 0,
+            'openPnl': 0,
+            'totalCost': quantity * price,
+            'isRealTime': False,
+            'isUnderReorg': False,
+        })
+
+    return dict_acc_positions
+
+
+def make_balances_json(cash_usd=10000.0, cash_cad=500.0):
+    return {'perCurrencyBalances': [
+        {'currency': 'CAD', 'cash': cash_cad, 'marketValue': 0, 'totalEquity': cash_cad, 'buyingPower': cash_cad},
+        {'currency': 'USD', 'cash': cash_usd, 'marketValue': 0, 'totalEquity': cash_usd, 'buyingPower': cash_usd},
+    ]}
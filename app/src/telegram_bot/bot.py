@@ -0,0 +1,304 @@
+'''
+Long-running Telegram bot: the daily calls on a schedule plus on-demand commands.
+
+    python bot.py                                       # from app/src/telegram_bot
+    URL_STANDIN=http://127.0.0.1:8765 python bot.py     # against the local stand-in
+
+Auth, bars, indicator state and the trade index stay warm in the process, so commands only
+fetch what changed. Blocking work runs in threads; the event loop only talks to Telegram.
+
+    /signal          today's call for the current portfolio
+    /positions       open positions across accounts
+    /trades SYMBOL   trade history for a symbol
+
+Commands are answered only in TELEGRAM_CHAT_ID, which must be set.
+
+With STREAM_ENABLED=1 the intraday stop and signal alerts of stream.py run in the same process.
+'''
+import os
+import asyncio
+import threading
+
+from datetime import datetime, timedelta
+
+import sys
+from pathlib import Path
+
+
+ROOT_DIR = str(Path.cwd().parent.parent.parent)
+
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+import pytz
+
+from telegram.ext import ApplicationBuilder, CommandHandler, filters
+
+from app.src.telegram_bot.main import (
+    TELEGRAM_API_KEY,
+    CHAT_ID,
+    URL_TELEGRAM,
+    refresh_questrade_session,
+    get_acc_nos,
+    get_current_portfolios,
+    get_daily_call_tasks,
+    get_history_range,
+    format_daily_calls,
+    split_message,
+)
+
+from app.src.utils.qt_utils import (
+    is_session_expiring,
+    get_account_data,
+    get_acc_pos_df,
+    get_trades,
+    get_trade_index,
+)
+
+from app.src.utils.strategy_utils import (
+    get_universe_signals,
+    size_universe_accounts,
+)
+
+from app.src.utils.fx_utils import get_fx_rate
+from app.src.utils.stream_utils import run_stream
+from app.src.telegram_bot.stream import get_stream_tickers
+from app.src.utils.pipeline_utils import run_pipeline
+from app.src.utils.transport_utils import get_base_url
+
+
+# Daily calls at these local times on weekdays, like the cron schedule in the workflows
+DAILY_CALL_TIMES = os.getenv('DAILY_CALL_TIMES', '06:15,20:00')
+TIMEZONE = pytz.timezone(os.getenv('BOT_TIMEZONE', 'America/Vancouver'))
+STREAM_ENABLED = os.getenv('STREAM_ENABLED', '0') == '1'
+
+N_TRADES_SHOWN = 20
+POSITION_COLS = ['account', 'symbol', 'openQuantity', 'currentPrice', 'current_market_value_CAD']
+TRADE_COLS = ['transaction_date', 'action', 'quantity', 'price', 'net_amount', 'account_type']
+
+# Warm state shared by the handlers: account numbers, account info and the signals of the day
+BOT_STATE = {
+    'acc_nos': None,
+    'dict_acc_info': None,
+    'signals': None,
+    'signals_end_date': None,
+}
+STATE_LOCK = asyncio.Lock()
+# ensure_session also runs on the streaming thread
+SESSION_LOCK = threading.Lock()
+
+
+# --- Warm state (blocking, run in threads) ---
+
+def ensure_session():
+    '''Log in again (and write the rotated token to the sheet) only when the access token is about to expire.'''
+    with SESSION_LOCK:
+        if BOT_STATE['acc_nos'] is None or is_session_expiring():
+            BOT_STATE['acc_nos'] = refresh_questrade_session()
+            BOT_STATE['dict_acc_info'] = get_account_data()
+
+    return BOT_STATE['acc_nos']
+
+
+def get_signals(end_date=None):
+    '''The universe signals, recomputed once per end date; bars and indicator state update incrementally.'''
+    start_date, end_date = get_history_range(end_date)
+    if BOT_STATE['signals_end_date'] != end_date:
+        BOT_STATE['signals'] = get_universe_signals(start_date, end_date)
+        BOT_STATE['signals_end_date'] = end_date
+
+    return BOT_STATE['signals']
+
+
+def warm_up():
+    ensure_session()
+    get_trade_index()
+    get_signals()
+
+
+def get_signal_message():
+    dict_portfolios = get_current_portfolios(ensure_session())
+    dict_results = size_universe_accounts(get_signals(), dict_portfolios)
+
+    return format_daily_calls(dict_portfolios, dict_results, get_fx_rate('USD', 'CAD'))
+
+
+def get_positions_message():
+    ensure_session()
+    df_positions = get_acc_pos_df(dict_acc_info=BOT_STATE['dict_acc_info'])
+    if df_positions.empty:
+        return 'No open positions'
+
+    df_positions = df_positions[df_positions['openQuantity'] != 0].sort_values('current_market_value_CAD', ascending=False)
+    total_cad = df_positions['current_market_value_CAD'].sum()
+
+    return f"{df_positions[POSITION_COLS].round(2).to_string(index=False)}\n\nTotal (CAD): ${total_cad:,.2f}"
+
+
+def get_trades_message(symbol):
+    df_trades = get_trades(symbol.upper())
+    if isinstance(df_trades, str):
+        return df_trades
+
+    list_cols = [col for col in TRADE_COLS if col in df_trades.columns]
+    str_trades = df_trades[list_cols].tail(N_TRADES_SHOWN).to_string(index=False)
+
+    return f'{symbol.upper()}: {len(df_trades)} activities, last {min(len(df_trades), N_TRADES_SHOWN)}\n{str_trades}'
+
+
+def get_daily_call_message():
+    '''The scheduled daily call: the main.py pipeline without its HTTP send, refreshing the warm state.'''
+    dict_tasks = get_daily_call_tasks()
+    del dict_tasks['telegram']
+    dict_results, _ = run_pipeline(dict_tasks)
+
+    BOT_STATE['acc_nos'] = get_acc_nos(dict_results['config'])
+    BOT_STATE['signals'] = dict_results['signals']
+    BOT_STATE['signals_end_date'] = get_history_range()[1]
+
+    return dict_results['message']
+
+
+# --- Handlers ---
+
+async def reply(update, fn, *args):
+    '''Run fn in a thread (one at a time, as handlers share BOT_STATE) and reply with its text or its error.'''
+    try:
+        async with STATE_LOCK:
+            message = await asyncio.to_thread(fn, *args)
+    except Exception as e:
+        message = f'Failed: {e!r}'
+
+    for chunk in split_message(message):
+        await update.message.reply_text(chunk)
+
+
+async def signal_command(update, context):
+    await reply(update, get_signal_message)
+
+
+async def positions_command(update, context):
+    await reply(update, get_positions_message)
+
+
+async def trades_command(update, context):
+    if not context.args:
+        await update.message.reply_text('Usage: /trades SYMBOL')
+        return
+
+    await reply(update, get_trades_message, context.args[0])
+
+
+# --- Schedule ---
+
+def get_next_daily_call(now=None):
+    '''The next weekday DAILY_CALL_TIMES slot after now, in TIMEZONE.'''
+    now = now or datetime.now(TIMEZONE)
+    list_times = sorted(tuple(int(part) for part in slot.split(':')) for slot in DAILY_CALL_TIMES.split(','))
+
+    day = now.date()
+    while True:
+        if day.weekday() < 5:
+            for hour, minute in list_times:
+                slot = TIMEZONE.localize(datetime(day.year, day.month, day.day, hour, minute))
+                if slot > now:
+                    return slot
+        day += timedelta(days=1)
+
+
+async def run_daily_calls(application):
+    '''Send the daily call at every scheduled slot, inside the bot's event loop.'''
+    while True:
+        slot = get_next_daily_call()
+        await asyncio.sleep((slot - datetime.now(TIMEZONE)).total_seconds())
+
+        try:
+            async with STATE_LOCK:
+                message = await asyncio.to_thread(get_daily_call_message)
+        except Exception as e:
+            message = f'Daily call failed: {e!r}'
+
+        try:
+            for chunk in split_message(message):
+                await application.bot.send_message(chat_id=CHAT_ID, text=chunk)
+        except Exception as e:
+            # Keep the schedule alive through a Telegram outage
+            print(f'Sending the daily call failed: {e!r}')
+
+
+async def post_init(application):
+    try:
+        async with STATE_LOCK:
+            await asyncio.to_thread(warm_up)
+    except Exception as e:
+        # Commands retry the failed step on demand
+        print(f'Warm-up failed: {e!r}')
+
+    application.bot_data['daily_calls'] = asyncio.create_task(run_daily_calls(application))
+    if STREAM_ENABLED:
+        start_stream(application)
+
+
+def start_stream(application):
+    '''Run the quote polling loop on a thread, sending its alerts through the bot's event loop.'''
+    loop = asyncio.get_running_loop()
+    stop_event = threading.Event()
+
+    def send_alert(text):
+        future = asyncio.run_coroutine_threadsafe(application.bot.send_message(chat_id=CHAT_ID, text=text), loop)
+        try:
+            future.result()
+        except Exception as e:
+            print(f'Sending an alert failed: {e!r}')
+
+    def stream():
+        try:
+            run_stream(get_stream_tickers(), send_alert, stop_event=stop_event, ensure_session=ensure_session)
+        except Exception as e:
+            send_alert(f'Streaming stopped: {e!r}')
+
+    application.bot_data['stream_stop'] = stop_event
+    threading.Thread(target=stream, name='stream', daemon=True).start()
+
+
+async def post_shutdown(application):
+    stop_event = application.bot_data.get('stream_stop')
+    if stop_event is not None:
+        stop_event.set()
+
+    task = application.bot_data.get('daily_calls')
+    if task is not None:
+        task.cancel()
+
+
+def build_application():
+    # Commands read the brokerage account, so they must be limited to one chat
+    if not CHAT_ID:
+        raise ValueError('TELEGRAM_CHAT_ID must be set to run the bot')
+
+    base_url = get_base_url('telegram', URL_TELEGRAM)
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_API_KEY)
+        .base_url(f'{base_url}/bot')
+        .base_file_url(f'{base_url}/file/bot')
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    chat_filter = filters.Chat(chat_id=int(CHAT_ID))
+    application.add_handler(CommandHandler('signal', signal_command, filters=chat_filter))
+    application.add_handler(CommandHandler('positions', positions_command, filters=chat_filter))
+    application.add_handler(CommandHandler('trades', trades_command, filters=chat_filter))
+
+    return application
+
+
+def run():
+    build_application().run_polling()
+
+
+if __name__ == '__main__':
+    run()
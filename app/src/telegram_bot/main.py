@@ -1,12 +1,6 @@
 import os
-import math
-import requests
 
 
-import pandas as pd
-import pandas_ta as ta
-import yfinance as yf
-
 from datetime import datetime, timedelta
 
 import sys
@@ -20,257 +14,225 @@ if ROOT_DIR not in sys.path:
 
 
 from app.src.utils.sheets_utils import (
-    get_qt_token_from_sheet,
+    get_config_cells,
     update_qt_token_in_sheet,
 )
 
 from app.src.utils.qt_utils import (
     init_server,
-    get_qqq_pos_and_bal,
+    get_pos_and_bal_many,
+)
+
+from app.src.utils.strategy_utils import (
+    UNIVERSE,
+    get_universe_deltas,
+    get_universe_signals,
+    size_universe_accounts,
+)
+
+from app.src.utils.fx_utils import get_fx_rate
+
+from app.src.utils.pipeline_utils import (
+    run_pipeline,
+    get_critical_path,
+)
+
+from app.src.utils.metrics_utils import (
+    timed,
+    get_summary_line,
+    write_metrics,
+)
+
+from app.src.utils.transport_utils import (
+    get_base_url,
+    get_session,
+    is_live_service,
 )
 
 
 TELEGRAM_API_KEY = os.getenv('TELEGRAM_TOKEN')
 CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+URL_TELEGRAM = 'https://api.telegram.org'
+MAX_MESSAGE_CHARS = 4000  # Telegram rejects messages over 4096
+# Append the metrics summary line to the daily message (needs METRICS_ENABLED=1)
+METRICS_IN_MESSAGE = os.getenv('METRICS_IN_MESSAGE', '0') == '1'
+# Print each pipeline task's start/end and the critical path after the run
+PIPELINE_TIMINGS = os.getenv('PIPELINE_TIMINGS', '0') == '1'
+N_HISTORY_DAYS = 5 * 365 + 50
 
 
-# --- 1. CONFIGURATION ---
+LEVERAGED_TICKERS = [pair[key] for pair in UNIVERSE for key in ['bull', 'bear']]
 
-RISK_PERCENTAGE_PER_TRADE = 1  # 1.0 = 100% of capital considered for risk sizing
-DAILY_PRICE_DROP_EXIT_PCT = 0.05
 
-N_PERIOD = 14
-EMA_FAST_PERIOD = 50
-EMA_SLOW_PERIOD = 250
+# -- Setup (token refresh and portfolio), run from run() rather than at import
 
-EMA_BULLISH_THRESHOLD = 1.05
-EMA_BEARISH_THRESHOLD = 0.95
+def get_acc_nos(dict_config):
+    '''The account numbers in the config cell, comma-separated for several accounts.'''
+    return [acc_no.strip() for acc_no in str(dict_config['acc_no']).split(',') if acc_no.strip()]
 
-NEUTRAL_RSI_MIN = 30
-NEUTRAL_RSI_MAX = 60
-OVERBOUGHT_RSI = 70
 
-END_DATE = datetime.now().strftime('%Y-%m-%d')
-TICKERS = ["QQQ", "TQQQ", "SQQQ"]
-TRANSACTION_COST = 0.00
+def log_in_questrade(token):
+    '''
+    Log in and write the rotated refresh token back to the sheet in the same step: Questrade
+    refresh tokens are single-use, so nothing may fail between the two. A stand-in or replayed
+    login leaves the sheet's live token alone.
+    '''
+    refresh_token = init_server(token=token)
+    if refresh_token != token and is_live_service('questrade_login'):
+        update_qt_token_in_sheet(refresh_token)
 
-## Get and update token in sheets
-token = get_qt_token_from_sheet()
-refresh_token = init_server(token=token)
-update_qt_token_in_sheet(refresh_token)
+    return refresh_token
 
-## Get account number from sheets
-acc_no = get_qt_token_from_sheet(cell='C1')
 
-## Get balances
-BAL_USD, n_sqqq, n_tqqq = get_qqq_pos_and_bal(acc_no)
+def refresh_questrade_session():
+    '''Read the token and account numbers from the sheet, log in and write the rotated token back.'''
+    dict_config = get_config_cells()
+    log_in_questrade(dict_config['refresh_token'])
 
-CURRENT_PORTFOLIO = {
-    "SQQQ_SHARES": n_sqqq,      # Current number of SQQQ shares you hold
-    "TQQQ_SHARES": n_tqqq,      # Current number of TQQQ shares you hold
-    "CASH_USD": BAL_USD         # Current buying power/cash in USD in your account
-}
+    return get_acc_nos(dict_config)
 
 
-# --- 2. INDICATOR CALCULATION ---
+def get_current_portfolios(list_acc_nos):
+    '''{acc_no: portfolio} with every account's balances and positions fetched concurrently.'''
+    return {
+        acc_no: {
+            **{f"{ticker}_SHARES": n for ticker, n in dict_shares.items()},    # Current number of shares held per leveraged ETF
+            "CASH_USD": BAL_USD         # Current buying power/cash in USD in your account
+        }
+        for acc_no, (BAL_USD, dict_shares) in get_pos_and_bal_many(list_acc_nos, LEVERAGED_TICKERS).items()
+    }
 
-def calculate_indicators(df, n=N_PERIOD):
-    if isinstance(df.columns, pd.MultiIndex):
-        df.columns = df.columns.droplevel(1)
 
-    df.ta.ema(close='Close', length=EMA_FAST_PERIOD, append=True, adjust=False)
-    df.ta.ema(close='Close', length=EMA_SLOW_PERIOD, append=True, adjust=False)
-    df.ta.rsi(close='Close', length=n, append=True)
-    df.ta.macd(close='Close', append=True)
-    df.ta.atr(append=True)
+# -- Send response to Telegram
 
-    df.rename(columns={
-        f'EMA_{EMA_FAST_PERIOD}': 'EMA_50',
-        f'EMA_{EMA_SLOW_PERIOD}': 'EMA_250',
-        f'RSI_{N_PERIOD}': 'RSI',
-        'MACD_12_26_9': 'MACD',
-        'MACDs_12_26_9': 'MACD_SIGNAL',
-        'ATRr_14': 'ATR'}, inplace=True)
+def split_message(message, max_chars=MAX_MESSAGE_CHARS):
+    '''message in chunks Telegram accepts, broken at line ends (a daily call for many accounts runs long).'''
+    list_chunks = ['']
+    for line in message.split('\n'):
+        while len(line) > max_chars:
+            list_chunks += [line[:max_chars], '']
+            line = line[max_chars:]
+        if list_chunks[-1] and len(list_chunks[-1]) + 1 + len(line) > max_chars:
+            list_chunks.append('')
+        list_chunks[-1] = f'{list_chunks[-1]}\n{line}' if list_chunks[-1] else line
 
-    return df.drop(columns=[col for col in df.columns if 'Adj Close' in str(col) or 'Volume' in str(col)], errors='ignore')
+    return [chunk for chunk in list_chunks if chunk]
 
 
-# --- 3. SIGNAL LOGIC ---
+@timed()
+def send_telegram(message):
+    '''Send message (in several parts when it is too long for one); returns the last response.'''
+    url = f"{get_base_url('telegram', URL_TELEGRAM)}/bot{TELEGRAM_API_KEY}/sendMessage"
 
-def generate_signal(row):
-    core_cols = ['EMA_50', 'EMA_250', 'RSI', 'MACD', 'MACD_SIGNAL', 'ATR', 'Close_QQQ', 'Open_QQQ']
-    if any(pd.isnull(row.get(col)) for col in core_cols):
-        return "CASH"
+    for chunk in split_message(message) or [message]:
+        payload = {"chat_id": CHAT_ID, "text": chunk}
+        response = get_session().post(url, json=payload)
 
-    close = row['Close_QQQ']
-    open_price = row['Open_QQQ']
+    return response.json()
 
-    # Stop Loss
-    if (close / open_price) <= (1 - DAILY_PRICE_DROP_EXIT_PCT):
-        return "CASH"
 
-    ema_50 = row['EMA_50']
-    ema_250 = row['EMA_250']
-    rsi_value = row['RSI']
-    macd = row['MACD']
-    macd_signal = row['MACD_SIGNAL']
+# --- Execute and Display Daily Call ---
 
-    ema_ratio = ema_50 / ema_250
-    macd_bullish = macd > macd_signal
-    macd_bearish = macd < macd_signal
-    is_neutral_zone = (NEUTRAL_RSI_MIN < rsi_value < NEUTRAL_RSI_MAX)
-    is_overbought_zone = (rsi_value > OVERBOUGHT_RSI)
+def format_daily_call(current_portfolio, result, fx_rate=None):
+    sep_dashes = "\n" + "-" * 40 + "\n"
 
-    if ema_ratio > EMA_BULLISH_THRESHOLD and is_neutral_zone and macd_bullish:
-        return "TQQQ"
-    elif ema_ratio < EMA_BEARISH_THRESHOLD and is_neutral_zone and macd_bearish:
-        return "SQQQ"
-    elif is_overbought_zone:
-        return "SQQQ"
-    else:
-        return "CASH"
+    curr_portfolio_str = "\n".join([f"{k}: {v}" for k, v in current_portfolio.items()])
+    message = f"Current portfolio: \n{curr_portfolio_str}{sep_dashes}"
+    message += f"DAILY CALL FOR: {result['date']}{sep_dashes}"
+    message += f"Total Equity (USD): ${result['equity']:.2f}"
+    if fx_rate is not None:
+        message += f" (CAD: ${result['equity'] * fx_rate:.2f})"
+    message += sep_dashes
 
+    for underlying, pair_result in result['pairs'].items():
+        message += f"{underlying} SIGNAL: {pair_result['signal']}\n"
+        message += "Latest Prices -> " + " | ".join(f"{ticker}: ${price:.2f}" for ticker, price in pair_result['prices'].items()) + "\n"
+        message += "REQUIRED TRADES (DELTA):\n"
 
-# --- 4. POSITION SIZING ---
+        for ticker, delta in pair_result['delta'].items():
+            if delta > 0:
+                message += f" [BUY]  {ticker}: {delta} shares\n"
+            elif delta < 0:
+                message += f" [SELL] {ticker}: {abs(delta)} shares\n"
+            else:
+                message += f" [HOLD] {ticker}: No Change\n"
 
-def calculate_position_size(row, capital_available, risk_pct, trade_ticker):
-    if trade_ticker == "CASH" or capital_available <= 0:
-        return 0.0
-
-    risk_amount = capital_available * risk_pct
-    atr_value = row['ATR']
-    if pd.isnull(atr_value) or atr_value == 0:
-        return 0.0
-
-    trade_price = row.get(f'Close_{trade_ticker}')
-    if pd.isnull(trade_price) or trade_price <= 0:
-        return 0.0
-
-    stop_loss_distance_per_share = 2 * atr_value
-    if stop_loss_distance_per_share <= 0:
-        return 0.0
-
-    shares_from_risk = risk_amount / stop_loss_distance_per_share
-    max_shares_from_capital = capital_available / (trade_price * (1 + TRANSACTION_COST))
-
-    position_size = math.floor(min(shares_from_risk, max_shares_from_capital)) # Use floor for whole shares
-    return position_size
-
-
-# --- 5. DATA & DELTA CALCULATION ---
-
-def get_daily_delta(tickers, start_date, end_date, current_portfolio):
-    # 1. Fetch Data
-    all_data = pd.DataFrame()
-    for ticker in tickers:
-        df = yf.download(ticker, start=start_date, end=end_date, progress=False, auto_adjust=True)
-        if not df.empty:
-            if isinstance(df.columns, pd.MultiIndex):
-                df.columns = df.columns.droplevel(1)
-            df.columns = [col.capitalize() for col in df.columns]
-            df.columns = [f'{col}_{ticker}' for col in df.columns]
-            if all_data.empty: all_data = df
-            else: all_data = all_data.join(df, how='outer')
-
-    # 2. Process QQQ Indicators
-    qqq_data = all_data.filter(like='_QQQ').copy()
-    qqq_data.columns = [col.replace('_QQQ', '') for col in qqq_data.columns]
-    qqq_data_with_indicators = calculate_indicators(qqq_data)
-
-    # 3. Create Analysis Row
-    latest_row = qqq_data_with_indicators.iloc[-1].copy()
-    latest_price_tqqq = all_data[f'Close_TQQQ'].iloc[-1]
-    latest_price_sqqq = all_data[f'Close_SQQQ'].iloc[-1]
-
-    latest_row['Close_TQQQ'] = latest_price_tqqq
-    latest_row['Close_SQQQ'] = latest_price_sqqq
-    latest_row['Close_QQQ'] = latest_row['Close']
-    latest_row['Open_QQQ'] = latest_row['Open']
-
-    # 4. Generate Signal
-    daily_signal = generate_signal(latest_row)
-
-    # 5. Calculate Total Equity (USD)
-    # Equity = Cash + (SQQQ Shares * SQQQ Price) + (TQQQ Shares * TQQQ Price)
-    equity_usd = current_portfolio["CASH_USD"] + \
-                 (current_portfolio["SQQQ_SHARES"] * latest_price_sqqq) + \
-                 (current_portfolio["TQQQ_SHARES"] * latest_price_tqqq)
-
-    # 6. Calculate Target Holdings
-    target_tqqq = 0
-    target_sqqq = 0
-
-    if daily_signal == "TQQQ":
-        target_tqqq = calculate_position_size(latest_row, equity_usd, RISK_PERCENTAGE_PER_TRADE, "TQQQ")
-    elif daily_signal == "SQQQ":
-        target_sqqq = calculate_position_size(latest_row, equity_usd, RISK_PERCENTAGE_PER_TRADE, "SQQQ")
-
-    # 7. Calculate Deltas
-    delta_tqqq = target_tqqq - current_portfolio["TQQQ_SHARES"]
-    delta_sqqq = target_sqqq - current_portfolio["SQQQ_SHARES"]
-
-    # Date Logic
-    last_data_date = latest_row.name
-    next_trading_day = last_data_date + timedelta(days=1)
-    while next_trading_day.weekday() >= 5:
-        next_trading_day += timedelta(days=1)
+        message += sep_dashes
 
-    return {
-        "date": next_trading_day.strftime('%Y-%m-%d'),
-        "signal": daily_signal,
-        "equity": equity_usd,
-        "prices": {"TQQQ": latest_price_tqqq, "SQQQ": latest_price_sqqq},
-        "target": {"TQQQ": target_tqqq, "SQQQ": target_sqqq},
-        "delta": {"TQQQ": delta_tqqq, "SQQQ": delta_sqqq}
-    }
+    return message.rstrip()
 
 
-# -- Send response to Telegram
+def format_daily_calls(dict_portfolios, dict_results, fx_rate=None):
+    '''format_daily_call per account, each under its account number when there are several.'''
+    if len(dict_portfolios) == 1:
+        acc_no = next(iter(dict_portfolios))
+        return format_daily_call(dict_portfolios[acc_no], dict_results[acc_no], fx_rate)
 
-def send_telegram(message):
-    url = f"https://api.telegram.org/bot{TELEGRAM_API_KEY}/sendMessage"
-    payload = {"chat_id": CHAT_ID, "text": message}
-    
-    response = requests.post(url, json=payload)
-    return response.json()
+    sep_equals = "\n" + "=" * 40 + "\n"
+    return sep_equals.join(
+        f"ACCOUNT {acc_no}\n{format_daily_call(portfolio, dict_results[acc_no], fx_rate)}"
+        for acc_no, portfolio in dict_portfolios.items()
+    )
 
 
-# --- Execute and Display Daily Call ---
+def get_history_range(end_date=None):
+    end_date = end_date or datetime.now().strftime('%Y-%m-%d')
+    extended_start_date = (datetime.now() - timedelta(days=N_HISTORY_DAYS)).strftime('%Y-%m-%d')
 
-def execute_and_send_daily_call():
-    extended_start_date = (datetime.now() - timedelta(days=5 * 365 + 50)).strftime('%Y-%m-%d')
+    return extended_start_date, end_date
 
-    # Run Calculation
-    result = get_daily_delta(TICKERS, extended_start_date, END_DATE, CURRENT_PORTFOLIO)
-    sep_dashes = "\n" + "-" * 40 + "\n"
 
-    curr_portfolio_str = "\n".join([f"{k}: {v}" for k, v in CURRENT_PORTFOLIO.items()])
-    message = f"Current portfolio: \n{curr_portfolio_str}{sep_dashes}"
-    message += f"DAILY CALL FOR: {result['date']}{sep_dashes}"
-    message += f"STRATEGY SIGNAL: {result['signal']}{sep_dashes}"
-    message += f"Total Equity (USD): ${result['equity']:.2f}{sep_dashes}"
-    message += f"Latest Prices -> TQQQ: ${result['prices']['TQQQ']:.2f} | SQQQ: ${result['prices']['SQQQ']:.2f}{sep_dashes}"
-    message += "REQUIRED TRADES (DELTA):\n"
-
-    # Print TQQQ Instructions
-    if result['delta']['TQQQ'] > 0:
-        message += f" [BUY]  TQQQ: {result['delta']['TQQQ']} shares\n"
-    elif result['delta']['TQQQ'] < 0:
-        message += f" [SELL] TQQQ: {abs(result['delta']['TQQQ'])} shares\n"
-    else:
-        message += f" [HOLD] TQQQ: No Change\n"
-
-    # Print SQQQ Instructions
-    if result['delta']['SQQQ'] > 0:
-        message += f" [BUY]  SQQQ: {result['delta']['SQQQ']} shares"
-    elif result['delta']['SQQQ'] < 0:
-        message += f" [SELL] SQQQ: {abs(result['delta']['SQQQ'])} shares"
-    else:
-        message += f" [HOLD] SQQQ: No Change"
-
-    return message
+@timed()
+def execute_and_send_daily_call(current_portfolio, end_date=None):
+    '''The daily call for a known portfolio, computed in sequence.'''
+    result = get_universe_deltas(*get_history_range(end_date), current_portfolio)
+    return format_daily_call(current_portfolio, result)
+
+
+def get_daily_call_tasks(end_date=None):
+    '''
+    The daily run as {task: (fn, [dependencies])}. Three branches share no inputs and run
+    concurrently: Sheets -> Questrade auth and token write-back -> positions and balances of
+    every account in C1, the batched price download with indicators and signals, and
+    the FX rate. Signals are computed once for all accounts; sizing waits for them and the
+    portfolios and sizes every account in one batch. The message also waits for FX.
+    '''
+    start_date, end_date = get_history_range(end_date)
+
+    def build_message(portfolios, deltas, fx_rate):
+        daily_call = format_daily_calls(portfolios, deltas, fx_rate)
+        summary_line = get_summary_line() if METRICS_IN_MESSAGE else ''
+        return f"{daily_call}\n{summary_line}" if summary_line else daily_call
+
+    return {
+        'config': (get_config_cells, []),
+        'refresh_token': (lambda config: log_in_questrade(config['refresh_token']), ['config']),
+        'portfolios': (lambda config, refresh_token: get_current_portfolios(get_acc_nos(config)), ['config', 'refresh_token']),
+        'signals': (lambda: get_universe_signals(start_date, end_date), []),
+        'fx_rate': (lambda: get_fx_rate('USD', 'CAD'), []),
+        'deltas': (lambda signals, portfolios: size_universe_accounts(signals, portfolios), ['signals', 'portfolios']),
+        'message': (build_message, ['portfolios', 'deltas', 'fx_rate']),
+        'telegram': (lambda message: send_telegram(message), ['message']),
+    }
+
+
+@timed('daily_run')
+def run(end_date=None):
+    '''One daily run: refresh the Questrade session, read the portfolio, compute and send the call.'''
+    dict_tasks = get_daily_call_tasks(end_date)
+    dict_results, dict_timings = run_pipeline(dict_tasks)
+
+    if PIPELINE_TIMINGS:
+        for name, (start, end) in sorted(dict_timings.items(), key=lambda item: item[1]):
+            print(f'{name:<14} {start:>7.2f}s -> {end:>7.2f}s')
+        print(f"Critical path: {' -> '.join(get_critical_path(dict_tasks, dict_timings))}")
+
+    path_metrics = write_metrics()
+    if path_metrics:
+        print(f'Metrics written to {path_metrics}')
+
+    return dict_results['telegram']
 
 
 if __name__ == '__main__':
-    daily_call = execute_and_send_daily_call()
-    send_telegram(daily_call)
+    run()
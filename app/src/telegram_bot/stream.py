@@ -0,0 +1,53 @@
+'''
+Intraday streaming mode: evaluates the stop and signal rules on every quote during market
+hours and alerts through Telegram.
+
+    python stream.py                                    # from app/src/telegram_bot
+    URL_STANDIN=http://127.0.0.1:8765 python stream.py  # quotes from the local stand-in
+
+STREAM_TICKERS (comma-separated) picks the symbols; the universe underlyings by default.
+'''
+import os
+
+import sys
+from pathlib import Path
+
+
+ROOT_DIR = str(Path.cwd().parent.parent.parent)
+
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+from app.src.telegram_bot.main import (
+    refresh_questrade_session,
+    send_telegram,
+)
+
+from app.src.utils.qt_utils import is_session_expiring
+
+from app.src.utils.strategy_utils import UNIVERSE
+from app.src.utils.stream_utils import run_stream
+
+
+def get_stream_tickers():
+    tickers = os.getenv('STREAM_TICKERS')
+    if tickers:
+        return [ticker.strip() for ticker in tickers.split(',') if ticker.strip()]
+
+    return [pair['underlying'] for pair in UNIVERSE]
+
+
+def ensure_session():
+    '''Access tokens last 30 minutes; a streaming day outlives many of them.'''
+    if is_session_expiring():
+        refresh_questrade_session()
+
+
+def run(stop_event=None):
+    refresh_questrade_session()
+    run_stream(get_stream_tickers(), send_telegram, stop_event=stop_event, ensure_session=ensure_session)
+
+
+if __name__ == '__main__':
+    run()
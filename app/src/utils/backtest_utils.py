@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+from app.src.utils.strategy_utils import (
+    STRATEGY_PARAMS,
+    SIGNAL_CASH,
+    SIGNAL_TQQQ,
+    SIGNAL_SQQQ,
+    SIGNAL_LABELS,
+    generate_signals,
+    calculate_position_sizes,
+    fetch_price_data,
+    build_strategy_frame,
+)
+
+
+INITIAL_CAPITAL_USD = 10000.0
+LEVERAGED_TICKERS = ['TQQQ', 'SQQQ']
+
+
+def simulate_equity(signals, atr_value, close_tqqq, close_sqqq, initial_capital=INITIAL_CAPITAL_USD, params=None):
+    '''
+    Walk the rebalance at each bar's close the same way get_daily_delta does once a day:
+    equity is marked at today's close, targets are sized off that equity and the book is
+    moved to the targets. Signals, ATR and prices are precomputed arrays, so the loop is
+    plain float arithmetic.
+    '''
+    params = {**STRATEGY_PARAMS, **(params or {})}
+    risk_pct = params['RISK_PERCENTAGE_PER_TRADE']
+    cost = params['TRANSACTION_COST']
+
+    n_bars = len(signals)
+    targets = np.zeros((n_bars, 2))
+    equity = np.zeros(n_bars)
+
+    # Holdings are marked at the last known close when a bar is missing for a leg
+    mark_prices = pd.DataFrame({'TQQQ': close_tqqq, 'SQQQ': close_sqqq}).ffill().fillna(0.0).to_numpy()
+
+    cash = float(initial_capital)
+    n_tqqq = 0.0
+    n_sqqq = 0.0
+
+    for i in range(n_bars):
+        price_tqqq, price_sqqq = mark_prices[i]
+        equity_usd = cash + (n_sqqq * price_sqqq) + (n_tqqq * price_tqqq)
+
+        signal = signals[i]
+        target_tqqq = 0.0
+        target_sqqq = 0.0
+        trade_price = close_tqqq[i] if signal == SIGNAL_TQQQ else close_sqqq[i]
+
+        # Mirrors calculate_position_size operation for operation so results are bit-identical
+        if (signal != SIGNAL_CASH and equity_usd > 0
+                and not np.isnan(atr_value[i]) and atr_value[i] != 0
+                and not np.isnan(trade_price) and trade_price > 0
+                and 2 * atr_value[i] > 0):
+            shares_from_risk = (equity_usd * risk_pct) / (2 * atr_value[i])
+            max_shares_from_capital = equity_usd / (trade_price * (1 + cost))
+            if signal == SIGNAL_TQQQ:
+                target_tqqq = float(np.floor(min(shares_from_risk, max_shares_from_capital)))
+            else:
+                target_sqqq = float(np.floor(min(shares_from_risk, max_shares_from_capital)))
+
+        delta_tqqq = target_tqqq - n_tqqq
+        delta_sqqq = target_sqqq - n_sqqq
+        cash -= delta_tqqq * price_tqqq + abs(delta_tqqq) * price_tqqq * cost
+        cash -= delta_sqqq * price_sqqq + abs(delta_sqqq) * price_sqqq * cost
+
+        n_tqqq, n_sqqq = target_tqqq, target_sqqq
+        targets[i] = (n_tqqq, n_sqqq)
+        equity[i] = cash + (n_sqqq * price_sqqq) + (n_tqqq * price_tqqq)
+
+    return targets, equity
+
+
+def get_trade_list(index, targets, close_tqqq, close_sqqq):
+    '''Trades implied by a target share path: one row per bar and leg where the holding changes.'''
+    deltas = np.diff(targets, axis=0, prepend=np.zeros((1, targets.shape[1])))
+    prices = np.column_stack([close_tqqq, close_sqqq])
+    idx_bar, idx_leg = np.nonzero(deltas)
+
+    df_trades = pd.DataFrame({
+        'date': np.asarray(index)[idx_bar],
+        'ticker': np.asarray(LEVERAGED_TICKERS)[idx_leg],
+        'action': np.where(deltas[idx_bar, idx_leg] > 0, 'BUY', 'SELL'),
+        'shares': np.abs(deltas[idx_bar, idx_leg]),
+        'price': prices[idx_bar, idx_leg],
+    })
+
+    return df_trades
+
+
+def run_backtest(df_strategy, initial_capital=INITIAL_CAPITAL_USD, params=None):
+    '''
+    Run the daily-call rules over every bar of a build_strategy_frame output.
+    Returns the signal series, share targets, equity curve and trade list.
+    '''
+    signals = generate_signals(df_strategy, params=params)
+    atr_value = df_strategy['ATR'].to_numpy(dtype=float)
+    close_tqqq = df_strategy['Close_TQQQ'].to_numpy(dtype=float)
+    close_sqqq = df_strategy['Close_SQQQ'].to_numpy(dtype=float)
+
+    targets, equity = simulate_equity(
+        signals, atr_value, close_tqqq, close_sqqq,
+        initial_capital=initial_capital, params=params,
+    )
+
+    return {
+        "signal": pd.Series(SIGNAL_LABELS[signals], index=df_strategy.index, name='signal'),
+        "target": pd.DataFrame(targets, index=df_strategy.index, columns=LEVERAGED_TICKERS),
+        "equity": pd.Series(equity, index=df_strategy.index, name='equity'),
+        "trades": get_trade_list(df_strategy.index, targets, close_tqqq, close_sqqq),
+    }
+
+
+def get_fixed_capital_targets(df_strategy, capital_available, params=None):
+    '''Share targets for every bar sized against a fixed (or per-bar) capital, fully vectorized.'''
+    signals = generate_signals(df_strategy, params=params)
+    position_size = calculate_position_sizes(df_strategy, capital_available, signals, params=params)
+
+    return pd.DataFrame({
+        'signal': SIGNAL_LABELS[signals],
+        'TQQQ': np.where(signals == SIGNAL_TQQQ, position_size, 0.0),
+        'SQQQ': np.where(signals == SIGNAL_SQQQ, position_size, 0.0),
+    }, index=df_strategy.index)
+
+
+def backtest_strategy(tickers, start_date, end_date, initial_capital=INITIAL_CAPITAL_USD, params=None):
+    all_data = fetch_price_data(tickers, start_date, end_date)
+    df_strategy = build_strategy_frame(all_data)
+
+    return run_backtest(df_strategy, initial_capital=initial_capital, params=params)
@@ -0,0 +1,224 @@
+import os
+import time
+import pickle
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+
+# Shared cache tier in front of the on-disk caches. With REDIS_URL set (e.g. redis://localhost:6379/0
+# for docker/docker-compose.yml) every process and host shares one warm copy; otherwise, or when
+# Redis is unreachable, values live in an in-process LRU.
+REDIS_URL = os.getenv('REDIS_URL')
+REDIS_TIMEOUT_SECONDS = 0.5
+
+# Bump to orphan every cached value after a change to what is stored under a kind
+CACHE_VERSION = 1
+CACHE_PREFIX = 'trader_bot'
+
+# Seconds each kind of value stays valid; CACHE_TTL_{KIND} overrides one
+CACHE_TTLS = {
+    'token': 25 * 60,           # Questrade access tokens last 30 minutes
+    'bars': 12 * 60 * 60,
+    'indicators': 12 * 60 * 60,
+    'fx': 4 * 60 * 60,
+    'positions': 60,
+    'balances': 60,
+}
+
+LRU_MAX_ITEMS = 512
+LOCK_TIMEOUT_SECONDS = 30
+
+BACKEND = None
+BACKEND_LOCK = threading.Lock()
+
+
+# --- Backends ---
+
+class LRUBackend:
+    '''Thread-safe in-process LRU of {key: (expires_at, payload)}.'''
+
+    def __init__(self, max_items=LRU_MAX_ITEMS):
+        self.max_items = max_items
+        self.dict_items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        dict_payloads = dict()
+
+        with self.lock:
+            for key in keys:
+                item = self.dict_items.get(key)
+                if item is None:
+                    continue
+                if item[0] < now:
+                    del self.dict_items[key]
+                    continue
+                self.dict_items.move_to_end(key)
+                dict_payloads[key] = item[1]
+
+        return dict_payloads
+
+    def set_many(self, dict_payloads, ttl):
+        expires_at = time.time() + ttl
+
+        with self.lock:
+            for key, payload in dict_payloads.items():
+                self.dict_items[key] = (expires_at, payload)
+                self.dict_items.move_to_end(key)
+            while len(self.dict_items) > self.max_items:
+                self.dict_items.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.dict_items.pop(key, None)
+
+    def lock_context(self, key, timeout):
+        # Processes sharing an LRU are the same process; the callers' own locks suffice
+        return nullcontext()
+
+
+class RedisBackend:
+    '''Redis with one round trip per batch: MGET for reads, a non-transactional pipeline of SETs for writes.'''
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=REDIS_TIMEOUT_SECONDS, socket_connect_timeout=REDIS_TIMEOUT_SECONDS)
+        self.errors = (redis.exceptions.RedisError, OSError)
+        self.client.ping()
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return dict()
+
+        return {key: payload for key, payload in zip(keys, self.client.mget(keys)) if payload is not None}
+
+    def set_many(self, dict_payloads, ttl):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, payload in dict_payloads.items():
+            pipeline.set(key, payload, ex=max(int(ttl), 1))
+        pipeline.execute()
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if keys:
+            self.client.delete(*keys)
+
+    @contextmanager
+    def lock_context(self, key, timeout):
+        lock = self.client.lock(key, timeout=timeout, blocking_timeout=timeout)
+        try:
+            is_acquired = lock.acquire()
+        except self.errors as e:
+            # Losing Redis should not stop a run; the callers' local locks still apply
+            print(f'Shared lock {key} unavailable ({e!r}), continuing without it')
+            yield
+            return
+
+        if not is_acquired:
+            raise TimeoutError(f'Timed out waiting for shared lock {key}')
+
+        try:
+            yield
+        finally:
+            try:
+                lock.release()
+            except self.errors:
+                pass
+
+
+def get_backend():
+    '''Redis when REDIS_URL is set and answers a ping, else the in-process LRU; chosen once per process.'''
+    global BACKEND
+
+    with BACKEND_LOCK:
+        if BACKEND is None:
+            BACKEND = LRUBackend()
+            if REDIS_URL:
+                try:
+                    BACKEND = RedisBackend(REDIS_URL)
+                except Exception as e:  # redis not installed or server unreachable
+                    print(f'Shared cache unavailable ({e!r}), using the in-process cache')
+
+    return BACKEND
+
+
+def fall_back_to_lru(e):
+    '''Swap a failing Redis backend for the LRU so one outage costs one timeout, not one per call.'''
+    global BACKEND
+
+    print(f'Shared cache error ({e!r}), using the in-process cache')
+    with BACKEND_LOCK:
+        BACKEND = LRUBackend()
+
+
+def reset_backend():
+    global BACKEND
+
+    with BACKEND_LOCK:
+        BACKEND = None
+
+
+# --- Keys and values ---
+
+def get_cache_key(kind, key):
+    return f'{CACHE_PREFIX}:v{CACHE_VERSION}:{kind}:{key}'
+
+
+def get_ttl(kind):
+    return float(os.getenv(f'CACHE_TTL_{kind.upper()}', CACHE_TTLS[kind]))
+
+
+def cache_get_many(kind, keys):
+    '''{key: value} for the keys of one kind that are cached, in one round trip.'''
+    dict_keys = {get_cache_key(kind, key): key for key in keys}
+    backend = get_backend()
+
+    try:
+        dict_payloads = backend.get_many(dict_keys)
+    except getattr(backend, 'errors', ()) as e:
+        fall_back_to_lru(e)
+        return dict()
+
+    return {dict_keys[cache_key]: pickle.loads(payload) for cache_key, payload in dict_payloads.items()}
+
+
+def cache_get(kind, key, default=None):
+    return cache_get_many(kind, [key]).get(key, default)
+
+
+def cache_set_many(kind, dict_values, ttl=None):
+    '''Write {key: value} of one kind in one round trip, valid for ttl seconds (default CACHE_TTLS[kind]).'''
+    if not dict_values:
+        return
+
+    dict_payloads = {get_cache_key(kind, key): pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL) for key, value in dict_values.items()}
+    backend = get_backend()
+
+    try:
+        backend.set_many(dict_payloads, get_ttl(kind) if ttl is None else ttl)
+    except getattr(backend, 'errors', ()) as e:
+        fall_back_to_lru(e)
+
+
+def cache_set(kind, key, value, ttl=None):
+    cache_set_many(kind, {key: value}, ttl)
+
+
+def cache_delete_many(kind, keys):
+    backend = get_backend()
+
+    try:
+        backend.delete_many([get_cache_key(kind, key) for key in keys])
+    except getattr(backend, 'errors', ()) as e:
+        fall_back_to_lru(e)
+
+
+def shared_lock(name, timeout=LOCK_TIMEOUT_SECONDS):
+    '''Lock held across every process sharing the cache (a Redis lock), or a no-op on the in-process LRU.'''
+    return get_backend().lock_context(get_cache_key('lock', name), timeout)
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import requests
+
+import numpy as np
+import pandas as pd
+
+from app.src.utils.transport_utils import (
+    get_base_url,
+    get_session,
+)
+from app.src.utils.cache_utils import (
+    cache_get,
+    cache_set,
+)
+
+
+URL_FX_FRANKFURTER = "https://api.frankfurter.app"
+PATH_DATA_FX = 'data/fx'
+
+# ECB reference rates are published once a day
+FX_LATEST_TTL_SECONDS = 4 * 60 * 60
+FX_RATE_FALLBACK = 1.40
+REQUEST_TIMEOUT = 20
+
+# {(curr_from, curr_to): {'rate': float, 'fetched_at': epoch seconds}}
+DICT_FX_LATEST = dict()
+# {(curr_from, curr_to): pd.Series of daily rates indexed by date}
+DICT_FX_SERIES = dict()
+# {(curr_from, curr_to): (end date last requested, epoch seconds)} so weekend/holiday
+# requests past the last published rate do not re-download within the TTL
+DICT_FX_SERIES_CHECKED = dict()
+
+
+# --- Latest rate ---
+
+def get_fx_latest_path():
+    return os.path.join(PATH_DATA_FX, 'latest.json')
+
+
+def load_fx_latest():
+    if not DICT_FX_LATEST and os.path.exists(get_fx_latest_path()):
+        try:
+            with open(get_fx_latest_path(), 'r') as file:
+                for key, value in json.load(file).items():
+                    DICT_FX_LATEST[tuple(key.split('_'))] = value
+        except (OSError, ValueError):
+            pass
+
+    return DICT_FX_LATEST
+
+
+def save_fx_latest():
+    os.makedirs(PATH_DATA_FX, exist_ok=True)
+    path = get_fx_latest_path()
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump({f'{curr_from}_{curr_to}': value for (curr_from, curr_to), value in DICT_FX_LATEST.items()}, file)
+    os.replace(f'{path}.tmp', path)
+
+
+def get_fx_rate(curr_from='USD', curr_to='CAD', ttl=FX_LATEST_TTL_SECONDS):
+    """Latest curr_from -> curr_to rate from the Frankfurter API (no key needed), cached for ttl seconds."""
+    if curr_from == curr_to:
+        return 1.0
+
+    dict_cached = load_fx_latest().get((curr_from, curr_to))
+    if dict_cached and time.time() - dict_cached['fetched_at'] < ttl:
+        return dict_cached['rate']
+
+    dict_shared = cache_get('fx', f'{curr_from}_{curr_to}')
+    if dict_shared and time.time() - dict_shared['fetched_at'] < ttl:
+        DICT_FX_LATEST[(curr_from, curr_to)] = dict_shared
+        return dict_shared['rate']
+
+    url = f"{get_base_url('frankfurter', URL_FX_FRANKFURTER)}/latest?from={curr_from}&to={curr_to}"
+
+    try:
+        response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        rate = response.json()['rates'].get(curr_to)
+        if not rate:
+            raise ValueError(f'{curr_to} rate not found in response')
+    except (requests.exceptions.RequestException, ValueError) as e:
+        if dict_cached:
+            print(f"FX request failed ({e}), using cached {curr_from}/{curr_to} rate from {time.ctime(dict_cached['fetched_at'])}")
+            return dict_cached['rate']
+
+        print(f"FX request failed ({e}) and nothing is cached, using fallback {curr_from}/{curr_to} rate {FX_RATE_FALLBACK}")
+        return FX_RATE_FALLBACK
+
+    DICT_FX_LATEST[(curr_from, curr_to)] = {'rate': rate, 'fetched_at': time.time()}
+    save_fx_latest()
+    cache_set('fx', f'{curr_from}_{curr_to}', DICT_FX_LATEST[(curr_from, curr_to)])
+
+    return rate
+
+
+# --- Historical series ---
+
+def get_fx_series_path(curr_from, curr_to):
+    return os.path.join(PATH_DATA_FX, f'{curr_from}_{curr_to}.parquet')
+
+
+def download_fx_series(start_date, end_date, curr_from='USD', curr_to='CAD'):
+    '''Daily ECB rates for [start_date, end_date] in one range request.'''
+    url = f"{get_base_url('frankfurter', URL_FX_FRANKFURTER)}/{start_date}..{end_date}?from={curr_from}&to={curr_to}"
+    response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+    dict_rates = response.json().get('rates', {})
+    series = pd.Series(
+        {pd.Timestamp(date): rates[curr_to] for date, rates in dict_rates.items() if curr_to in rates},
+        dtype=float,
+    )
+
+    return series.sort_index()
+
+
+def load_fx_series(curr_from, curr_to):
+    if (curr_from, curr_to) not in DICT_FX_SERIES:
+        path = get_fx_series_path(curr_from, curr_to)
+        if os.path.exists(path):
+            DICT_FX_SERIES[(curr_from, curr_to)] = pd.read_parquet(path)['rate']
+
+    return DICT_FX_SERIES.get((curr_from, curr_to))
+
+
+def save_fx_series(curr_from, curr_to, series):
+    DICT_FX_SERIES[(curr_from, curr_to)] = series
+    os.makedirs(PATH_DATA_FX, exist_ok=True)
+    path = get_fx_series_path(curr_from, curr_to)
+    series.rename('rate').to_frame().to_parquet(f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+
+
+def get_fx_series(start_date, end_date, curr_from='USD', curr_to='CAD'):
+    '''
+    Daily curr_from -> curr_to rates covering [start_date, end_date], forward-filled over weekends
+    and holidays. Only dates outside the cached span are downloaded.
+    '''
+    start_date = pd.Timestamp(start_date).normalize()
+    end_date = pd.Timestamp(end_date).normalize()
+    index = pd.date_range(start_date, end_date, freq='D')
+
+    if curr_from == curr_to:
+        return pd.Series(1.0, index=index)
+
+    series = load_fx_series(curr_from, curr_to)
+    list_series = [series] if series is not None else list()
+
+    if series is None or series.empty:
+        list_series.append(download_fx_series((start_date - pd.Timedelta(days=7)).date(), end_date.date(), curr_from, curr_to))
+    else:
+        # A week of lead-in so a start on a weekend/holiday still has a rate to carry forward
+        if start_date < series.index[0]:
+            list_series.append(download_fx_series(
+                (start_date - pd.Timedelta(days=7)).date(), (series.index[0] - pd.Timedelta(days=1)).date(), curr_from, curr_to,
+            ))
+
+        checked_end, checked_at = DICT_FX_SERIES_CHECKED.get((curr_from, curr_to), (None, 0))
+        is_recently_checked = checked_end is not None and checked_end >= end_date and time.time() - checked_at < FX_LATEST_TTL_SECONDS
+        if end_date > series.index[-1] and not is_recently_checked:
+            list_series.append(download_fx_series(series.index[-1].date(), end_date.date(), curr_from, curr_to))
+            DICT_FX_SERIES_CHECKED[(curr_from, curr_to)] = (end_date, time.time())
+
+    if len(list_series) > 1 or series is None:
+        series = pd.concat(list_series)
+        series = series[~series.index.duplicated(keep='last')].sort_index()
+        if not series.empty:
+            save_fx_series(curr_from, curr_to, series)
+
+    return series.reindex(series.index.union(index)).ffill().reindex(index)
+
+
+# --- Frame conversion ---
+
+def get_fx_rates_for(currencies, dates=None, curr_to='CAD'):
+    '''
+    Rate into curr_to for every row, given per-row currencies and (optionally) per-row dates.
+    Without dates the latest rate is used.
+    '''
+    currencies = pd.Series(np.asarray(currencies, dtype=object))
+    rates = np.ones(len(currencies))
+
+    if dates is not None:
+        dates = pd.to_datetime(pd.Series(np.asarray(dates))).dt.tz_localize(None).dt.normalize()
+
+    for curr_from in currencies.dropna().unique():
+        if curr_from in ('', curr_to):
+            continue
+
+        mask = (currencies == curr_from).to_numpy()
+        if dates is None:
+            rates[mask] = get_fx_rate(curr_from, curr_to)
+        else:
+            row_dates = dates[mask]
+            series = get_fx_series(row_dates.min(), row_dates.max(), curr_from, curr_to)
+            rates[mask] = series.reindex(row_dates).to_numpy()
+
+    return rates
+
+
+def convert_frame(df, amount_cols, currency_col='currency', date_col=None, curr_to='CAD'):
+    '''Adds {col}_{curr_to} for each amount column, converted at the rate of each row's date.'''
+    df = df.copy()
+    dates = df[date_col] if date_col else None
+    rates = get_fx_rates_for(df[currency_col], dates=dates, curr_to=curr_to)
+
+    for col in amount_cols:
+        df[f'{col}_{curr_to}'] = pd.to_numeric(df[col], errors='coerce').to_numpy() * rates
+
+    return df
@@ -0,0 +1,389 @@
+import os
+import copy
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+from app.src.utils.cache_utils import (
+    cache_get,
+    cache_set,
+)
+
+
+PATH_INDICATOR_STATE = 'data/indicator_state'
+
+# Indicator columns in compute_indicator_array's column order; the pandas_ta backend of
+# calculate_indicators renames its output to these
+INDICATOR_COLS = ['EMA_50', 'EMA_250', 'RSI', 'MACD', 'MACD_HIST', 'MACD_SIGNAL', 'ATR']
+
+
+# --- Recurrences ---
+# These follow pandas_ta: EMAs (and the MACD signal line) are seeded with the SMA of their
+# first `length` inputs, RSI averages are RMAs seeded with the first diff, and ATR is an RMA
+# seeded with the SMA of the first `length` true ranges.
+
+def init_ema_state(length):
+    return {'length': length, 'n': 0, 'sum': 0.0, 'value': math.nan}
+
+
+def peek_ema_state(state, value):
+    '''The EMA after one more input, leaving the state unchanged.'''
+    length = state['length']
+    n = state['n'] + 1
+
+    if n < length:
+        return state['value']
+    if n == length:
+        return (state['sum'] + value) / length
+
+    alpha = 2 / (length + 1)
+    return (1 - alpha) * state['value'] + alpha * value
+
+
+def update_ema_state(state, value):
+    state['value'] = peek_ema_state(state, value)
+    state['n'] += 1
+    if state['n'] <= state['length']:
+        state['sum'] += value
+
+    return state['value']
+
+
+def init_rsi_state(length):
+    return {'length': length, 'prev_close': math.nan, 'pos_avg': math.nan, 'neg_avg': math.nan}
+
+
+def step_rsi_state(state, close):
+    '''(pos_avg, neg_avg, RSI) after one more close, leaving the state unchanged.'''
+    prev_close = state['prev_close']
+    if math.isnan(prev_close):
+        return state['pos_avg'], state['neg_avg'], math.nan
+
+    change = close - prev_close
+    positive = max(change, 0.0)
+    negative = min(change, 0.0)
+
+    if math.isnan(state['pos_avg']):
+        pos_avg, neg_avg = positive, negative
+    else:
+        alpha = 1 / state['length']
+        pos_avg = (1 - alpha) * state['pos_avg'] + alpha * positive
+        neg_avg = (1 - alpha) * state['neg_avg'] + alpha * negative
+
+    denominator = pos_avg + abs(neg_avg)
+    if denominator == 0:
+        return pos_avg, neg_avg, math.nan
+
+    return pos_avg, neg_avg, 100 * pos_avg / denominator
+
+
+def update_rsi_state(state, close):
+    state['pos_avg'], state['neg_avg'], rsi_value = step_rsi_state(state, close)
+    state['prev_close'] = close
+
+    return rsi_value
+
+
+def init_atr_state(length):
+    return {'length': length, 'prev_close': math.nan, 'n': 0, 'sum': 0.0, 'value': math.nan}
+
+
+def step_atr_state(state, high, low, close):
+    '''(sum, ATR) after one more bar, leaving the state unchanged.'''
+    prev_close = state['prev_close']
+
+    true_range = abs(high - low)
+    if not math.isnan(prev_close):
+        true_range = max(true_range, abs(high - prev_close), abs(prev_close - low))
+
+    length = state['length']
+    n = state['n'] + 1
+
+    if n <= length:
+        total = state['sum'] + true_range
+        return total, total / length if n == length else state['value']
+
+    alpha = 1 / length
+    return state['sum'], (1 - alpha) * state['value'] + alpha * true_range
+
+
+def update_atr_state(state, high, low, close):
+    state['sum'], state['value'] = step_atr_state(state, high, low, close)
+    state['prev_close'] = close
+    state['n'] += 1
+
+    return state['value']
+
+
+# --- Fused kernel ---
+
+def indicator_kernel(high, low, close, ema_fast_len, ema_slow_len, rsi_len,
+                     macd_fast_len, macd_slow_len, macd_signal_len, atr_len, out):
+    '''
+    Single pass over the bars filling out[i] with the INDICATOR_COLS values of bar i.
+    Same recurrences as the *_state functions above, written over plain floats so it runs
+    as ordinary Python or compiled with numba.
+    '''
+    n_bars = len(close)
+    nan = math.nan
+
+    ema_lens = [ema_fast_len, ema_slow_len, macd_fast_len, macd_slow_len]
+    ema_sums = [0.0, 0.0, 0.0, 0.0]
+    ema_values = [nan, nan, nan, nan]
+
+    signal_n = 0
+    signal_sum = 0.0
+    signal_value = nan
+
+    pos_avg = 0.0
+    neg_avg = 0.0
+    atr_sum = 0.0
+    atr_value = nan
+
+    for i in range(n_bars):
+        price = close[i]
+
+        for j in range(4):
+            length = ema_lens[j]
+            if i < length:
+                ema_sums[j] += price
+                if i == length - 1:
+                    ema_values[j] = ema_sums[j] / length
+            else:
+                alpha = 2 / (length + 1)
+                ema_values[j] = (1 - alpha) * ema_values[j] + alpha * price
+
+        macd = ema_values[2] - ema_values[3]
+        if macd == macd:
+            signal_n += 1
+            if signal_n <= macd_signal_len:
+                signal_sum += macd
+                if signal_n == macd_signal_len:
+                    signal_value = signal_sum / macd_signal_len
+            else:
+                alpha = 2 / (macd_signal_len + 1)
+                signal_value = (1 - alpha) * signal_value + alpha * macd
+
+        rsi_value = nan
+        true_range = abs(high[i] - low[i])
+        if i > 0:
+            prev_close = close[i - 1]
+            change = price - prev_close
+            positive = max(change, 0.0)
+            negative = min(change, 0.0)
+            if i == 1:
+                pos_avg = positive
+                neg_avg = negative
+            else:
+                alpha = 1 / rsi_len
+                pos_avg = (1 - alpha) * pos_avg + alpha * positive
+                neg_avg = (1 - alpha) * neg_avg + alpha * negative
+
+            denominator = pos_avg + abs(neg_avg)
+            if denominator != 0:
+                rsi_value = 100 * pos_avg / denominator
+
+            true_range = max(true_range, abs(high[i] - prev_close), abs(prev_close - low[i]))
+
+        if i < atr_len:
+            atr_sum += true_range
+            if i == atr_len - 1:
+                atr_value = atr_sum / atr_len
+        else:
+            alpha = 1 / atr_len
+            atr_value = (1 - alpha) * atr_value + alpha * true_range
+
+        out[i] = (ema_values[0], ema_values[1], rsi_value, macd, macd - signal_value, signal_value, atr_value)
+
+    return out
+
+
+JIT_KERNEL = None
+
+
+def get_indicator_kernel(use_numba=False):
+    '''
+    The kernel, optionally numba-compiled. Compiling costs more than a few thousand bars take
+    to run in Python, so it is only worth it for repeated calls such as parameter sweeps.
+    '''
+    global JIT_KERNEL
+
+    if not use_numba:
+        return indicator_kernel
+
+    if JIT_KERNEL is None:
+        try:
+            from numba import njit
+            JIT_KERNEL = njit(cache=True, nogil=True)(indicator_kernel)
+        except ImportError:
+            JIT_KERNEL = indicator_kernel
+
+    return JIT_KERNEL
+
+
+def compute_indicator_array(high, low, close, periods, use_numba=False):
+    '''All INDICATOR_COLS for gap-free High/Low/Close arrays, as one preallocated (n_bars, 7) array.'''
+    high = np.ascontiguousarray(high, dtype=np.float64)
+    low = np.ascontiguousarray(low, dtype=np.float64)
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    out = np.full((close.shape[0], len(INDICATOR_COLS)), np.nan)
+
+    kernel = get_indicator_kernel(use_numba=use_numba)
+    if kernel is indicator_kernel:
+        # Indexing Python floats is several times faster than indexing numpy scalars
+        high, low, close = high.tolist(), low.tolist(), close.tolist()
+
+    return kernel(
+        high, low, close,
+        periods['EMA_FAST'], periods['EMA_SLOW'], periods['RSI'],
+        periods['MACD_FAST'], periods['MACD_SLOW'], periods['MACD_SIGNAL'], periods['ATR'],
+        out,
+    )
+
+
+# --- Per-ticker indicator state ---
+
+def init_indicator_state(periods):
+    '''
+    periods: {'EMA_FAST', 'EMA_SLOW', 'RSI', 'MACD_FAST', 'MACD_SLOW', 'MACD_SIGNAL', 'ATR'}
+    '''
+    return {
+        'periods': dict(periods),
+        'n_bars': 0,
+        'last_date': None,
+        'last_bar': None,
+        'latest': None,
+        'prev_state': None,
+        'ema_fast': init_ema_state(periods['EMA_FAST']),
+        'ema_slow': init_ema_state(periods['EMA_SLOW']),
+        'macd_fast': init_ema_state(periods['MACD_FAST']),
+        'macd_slow': init_ema_state(periods['MACD_SLOW']),
+        'macd_signal': init_ema_state(periods['MACD_SIGNAL']),
+        'rsi': init_rsi_state(periods['RSI']),
+        'atr': init_atr_state(periods['ATR']),
+    }
+
+
+def update_indicator_state(state, date, bar, keep_undo=True):
+    '''Advance the state by one bar (dict with Open/High/Low/Close) in constant time.'''
+    state['prev_state'] = None
+    if keep_undo:
+        state['prev_state'] = copy.deepcopy(state)
+
+    close = float(bar['Close'])
+    high = float(bar['High'])
+    low = float(bar['Low'])
+
+    ema_fast = update_ema_state(state['ema_fast'], close)
+    ema_slow = update_ema_state(state['ema_slow'], close)
+    rsi_value = update_rsi_state(state['rsi'], close)
+    atr_value = update_atr_state(state['atr'], high, low, close)
+
+    macd = update_ema_state(state['macd_fast'], close) - update_ema_state(state['macd_slow'], close)
+    macd_signal = math.nan
+    if not math.isnan(macd):
+        macd_signal = update_ema_state(state['macd_signal'], macd)
+
+    state['n_bars'] += 1
+    state['last_date'] = pd.Timestamp(date).strftime('%Y-%m-%d')
+    state['last_bar'] = {col: float(bar[col]) for col in ['Open', 'High', 'Low', 'Close']}
+    state['latest'] = {
+        'EMA_50': ema_fast,
+        'EMA_250': ema_slow,
+        'RSI': rsi_value,
+        'MACD': macd,
+        'MACD_HIST': macd - macd_signal,
+        'MACD_SIGNAL': macd_signal,
+        'ATR': atr_value,
+    }
+
+    return state['latest']
+
+
+def peek_indicator_state(state, bar):
+    '''
+    The indicators update_indicator_state would return for bar, without changing the state. For
+    a session still in progress: constant time and no copy, so it can run on every quote.
+    '''
+    close = float(bar['Close'])
+
+    macd = peek_ema_state(state['macd_fast'], close) - peek_ema_state(state['macd_slow'], close)
+    macd_signal = math.nan
+    if not math.isnan(macd):
+        macd_signal = peek_ema_state(state['macd_signal'], macd)
+
+    return {
+        'EMA_50': peek_ema_state(state['ema_fast'], close),
+        'EMA_250': peek_ema_state(state['ema_slow'], close),
+        'RSI': step_rsi_state(state['rsi'], close)[2],
+        'MACD': macd,
+        'MACD_HIST': macd - macd_signal,
+        'MACD_SIGNAL': macd_signal,
+        'ATR': step_atr_state(state['atr'], float(bar['High']), float(bar['Low']), close)[1],
+    }
+
+
+def seed_indicator_state(df_bars, periods):
+    '''Rebuild the state from a full Open/High/Low/Close history.'''
+    state = init_indicator_state(periods)
+    n_bars = len(df_bars)
+    for i, (date, bar) in enumerate(zip(df_bars.index, df_bars[['Open', 'High', 'Low', 'Close']].to_dict('records'))):
+        update_indicator_state(state, date, bar, keep_undo=(i == n_bars - 1))
+
+    return state
+
+
+def is_same_bar(state, df_bars):
+    date = pd.Timestamp(state['last_date'])
+    if date not in df_bars.index:
+        return False
+
+    bar = df_bars.loc[date]
+    return all(math.isclose(float(bar[col]), value, rel_tol=1e-9) for col, value in state['last_bar'].items())
+
+
+def sync_indicator_state(state, df_bars, periods):
+    '''
+    Apply only the bars newer than the state. A restated last bar (e.g. a partial session that
+    has since closed) is undone and re-applied; any deeper mismatch, such as a split/dividend
+    rescale of the history, re-seeds from df_bars.
+    '''
+    if state is None or state['periods'] != dict(periods) or state['last_date'] is None:
+        return seed_indicator_state(df_bars, periods)
+
+    if not is_same_bar(state, df_bars):
+        state = state['prev_state']
+        if state is None or state['last_date'] is None or not is_same_bar(state, df_bars):
+            return seed_indicator_state(df_bars, periods)
+
+    df_new = df_bars[df_bars.index > pd.Timestamp(state['last_date'])]
+    for date, bar in zip(df_new.index, df_new[['Open', 'High', 'Low', 'Close']].to_dict('records')):
+        update_indicator_state(state, date, bar)
+
+    return state
+
+
+def get_indicator_state_path(ticker):
+    return os.path.join(PATH_INDICATOR_STATE, f'{ticker}.json')
+
+
+def load_indicator_state(ticker):
+    '''The persisted state, or the shared cache's copy when no file exists (a fresh checkout).'''
+    path = get_indicator_state_path(ticker)
+    if not os.path.exists(path):
+        return cache_get('indicators', ticker)
+
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_indicator_state(ticker, state):
+    os.makedirs(PATH_INDICATOR_STATE, exist_ok=True)
+    path = get_indicator_state_path(ticker)
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(state, file)
+    os.replace(f'{path}.tmp', path)
+
+    cache_set('indicators', ticker, state)
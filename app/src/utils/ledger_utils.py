@@ -0,0 +1,303 @@
+import os
+import uuid
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from datetime import datetime
+
+
+PATH_DATA_LEDGER = 'data/ledger'
+
+# The ledger is one sorted Parquet file plus the parts appended since it was last merged: at this
+# bot's sizes a read is dominated by the number of files opened, so there are no partitions, and
+# month-bounded reads skip row groups by their settlement_date statistics instead
+MAX_PARTS = 4
+ROW_GROUP_SIZE = 50_000
+# The monthly partitions of earlier versions, merged on first use by upgrade_ledger_layout
+COL_PARTITION_MONTHLY = 'settlement_month'
+# A complete replacement ledger waiting to be renamed into place
+SUFFIX_REWRITE = '.rewrite'
+
+LEDGER_SCHEMA = pa.schema([
+    ('transaction_date', pa.timestamp('s')),
+    ('settlement_date', pa.timestamp('s')),
+    ('action', pa.string()),
+    ('symbol', pa.string()),
+    ('description', pa.string()),
+    ('currency', pa.string()),
+    ('quantity', pa.float64()),
+    ('price', pa.float64()),
+    ('gross_amount', pa.float64()),
+    ('net_amount', pa.float64()),
+    ('activity_type', pa.string()),
+    ('account_type', pa.string()),
+    ('account_no', pa.int64()),
+])
+
+# Same key as update_trades: every column but the transaction date
+FINGERPRINT_KEY_COLS = [name for name in LEDGER_SCHEMA.names if name != 'transaction_date']
+# Underscore-prefixed files are skipped by dataset discovery
+FILE_FINGERPRINT_HASHES = '_fingerprint_hashes.npy'
+FILE_FINGERPRINT_COUNTS = '_fingerprint_counts.npy'
+
+
+def list_month_partitions(path):
+    return sorted(name for name in os.listdir(path) if name.startswith(f'{COL_PARTITION_MONTHLY}='))
+
+
+def list_ledger_parts(path=PATH_DATA_LEDGER):
+    '''Part file names in append order, e.g. 'part-20240102030405-1a2b3c4d.parquet'.'''
+    if os.path.isdir(f'{path}{SUFFIX_REWRITE}') or (os.path.isdir(path) and list_month_partitions(path)):
+        upgrade_ledger_layout(path)
+    if not os.path.isdir(path):
+        return list()
+
+    return sorted(name for name in os.listdir(path) if name.startswith('part-') and name.endswith('.parquet'))
+
+
+def ledger_exists(path=PATH_DATA_LEDGER):
+    return bool(list_ledger_parts(path))
+
+
+def to_ledger_frame(df_trades):
+    '''Cast a trades frame (string dates, '' for missing values) to LEDGER_SCHEMA types.'''
+    df_ledger = pd.DataFrame(index=df_trades.index)
+
+    for field in LEDGER_SCHEMA:
+        col = df_trades[field.name] if field.name in df_trades.columns else pd.Series(None, index=df_trades.index)
+        col = col.replace('', None)
+
+        if pa.types.is_timestamp(field.type):
+            df_ledger[field.name] = pd.to_datetime(col, errors='coerce').astype('datetime64[s]')
+        elif pa.types.is_floating(field.type):
+            df_ledger[field.name] = pd.to_numeric(col, errors='coerce').astype('float64')
+        elif pa.types.is_integer(field.type):
+            df_ledger[field.name] = pd.to_numeric(col, errors='coerce').astype('Int64')
+        else:
+            df_ledger[field.name] = col.astype('string')
+
+    return df_ledger.reset_index(drop=True)
+
+
+def write_part(table, path_part):
+    # Dot-prefixed files are skipped by dataset discovery, so readers never see a partial part
+    path_tmp = os.path.join(os.path.dirname(path_part), f'.{os.path.basename(path_part)}.tmp')
+    pq.write_table(table, path_tmp, row_group_size=ROW_GROUP_SIZE)
+    os.replace(path_tmp, path_part)
+
+
+def get_part_name(suffix=''):
+    return f'part-{datetime.now().strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}{suffix}.parquet'
+
+
+def to_ledger_table(df_ledger):
+    '''Sorted by settlement date, so each row group covers a narrow date range.'''
+    return pa.Table.from_pandas(df_ledger, schema=LEDGER_SCHEMA, preserve_index=False).sort_by('settlement_date')
+
+
+def append_trades(df_trades, path=PATH_DATA_LEDGER):
+    '''
+    Append rows to the ledger as one new part; once more than MAX_PARTS parts have piled up,
+    the ledger is merged back into a single file.
+    '''
+    if df_trades.shape[0] == 0:
+        return 0
+
+    df_ledger = to_ledger_frame(df_trades)
+    hashes, counts = load_fingerprint_index(path)
+    os.makedirs(path, exist_ok=True)
+    write_part(to_ledger_table(df_ledger), os.path.join(path, get_part_name()))
+    save_fingerprint_index(*add_fingerprints(hashes, counts, get_fingerprints(df_ledger)), path=path)
+
+    if len(list_ledger_parts(path)) > MAX_PARTS:
+        compact_ledger(path)
+
+    return df_ledger.shape[0]
+
+
+def rewrite_ledger(table, path=PATH_DATA_LEDGER):
+    '''
+    Replace the ledger's parts with table as one new part, keeping the fingerprint index. The new
+    ledger is built next to the old one and swapped in by rename, so readers see the old parts or
+    the new one, never both; list_ledger_parts finishes a swap that was interrupted.
+    '''
+    path_rewrite = f'{path}{SUFFIX_REWRITE}'
+    path_replaced = f'{path}.replaced'
+    shutil.rmtree(path_rewrite, ignore_errors=True)
+    shutil.rmtree(path_replaced, ignore_errors=True)
+
+    os.makedirs(path_rewrite)
+    for name in [FILE_FINGERPRINT_HASHES, FILE_FINGERPRINT_COUNTS]:
+        if os.path.exists(os.path.join(path, name)):
+            shutil.copy2(os.path.join(path, name), os.path.join(path_rewrite, name))
+    # A new name, so checkpoints keyed on part names (pnl_utils) see that the ledger was rewritten
+    write_part(table, os.path.join(path_rewrite, get_part_name('-compacted')))
+
+    os.rename(path, path_replaced)
+    os.rename(path_rewrite, path)
+    shutil.rmtree(path_replaced)
+
+
+def compact_ledger(path=PATH_DATA_LEDGER):
+    list_parts = list_ledger_parts(path)
+    if len(list_parts) < 2:
+        return
+
+    table = pa.concat_tables([pq.read_table(os.path.join(path, name), schema=LEDGER_SCHEMA) for name in list_parts])
+    rewrite_ledger(table.sort_by('settlement_date'), path)
+
+
+def upgrade_ledger_layout(path=PATH_DATA_LEDGER):
+    '''Finish an interrupted rewrite, and merge the monthly partitions of earlier versions into one file.'''
+    path_rewrite = f'{path}{SUFFIX_REWRITE}'
+    if os.path.isdir(path_rewrite) and not os.path.isdir(path):
+        os.rename(path_rewrite, path)
+    if not os.path.isdir(path):
+        return
+
+    list_partitions = list_month_partitions(path)
+    if not list_partitions:
+        return
+
+    list_files = [
+        os.path.join(path, name_partition, name)
+        for name_partition in list_partitions
+        for name in sorted(os.listdir(os.path.join(path, name_partition))) if name.endswith('.parquet')
+    ]
+    table = ds.dataset(list_files, format='parquet', schema=LEDGER_SCHEMA).to_table()
+    rewrite_ledger(table.sort_by('settlement_date'), path)
+    print(f'Merged {table.num_rows} ledger rows from {len(list_partitions)} monthly partitions into one file')
+
+
+def get_ledger_dataset(path=PATH_DATA_LEDGER):
+    return ds.dataset([os.path.join(path, name) for name in list_ledger_parts(path)], format='parquet', schema=LEDGER_SCHEMA)
+
+
+def read_ledger(columns=None, start_month=None, end_month=None, filters=None, path=PATH_DATA_LEDGER):
+    '''
+    Read the ledger, loading only the requested columns and the row groups that can match.
+    start_month/end_month are inclusive 'YYYY-MM' bounds on the settlement month;
+    filters is a pyarrow expression or a list of (column, op, value) tuples.
+    '''
+    list_expressions = list()
+    if start_month:
+        list_expressions.append(ds.field('settlement_date') >= pd.Timestamp(start_month).to_datetime64().astype('datetime64[s]'))
+    if end_month:
+        month_after = pd.Timestamp(end_month) + pd.offsets.MonthBegin(1)
+        list_expressions.append(ds.field('settlement_date') < month_after.to_datetime64().astype('datetime64[s]'))
+    if filters is not None:
+        if not isinstance(filters, ds.Expression):
+            filters = pq.filters_to_expression(filters)
+        list_expressions.append(filters)
+
+    expression = None
+    for bound in list_expressions:
+        expression = bound if expression is None else expression & bound
+
+    columns = list(columns) if columns else [field.name for field in LEDGER_SCHEMA]
+    table = get_ledger_dataset(path).to_table(columns=columns, filter=expression)
+
+    return table.to_pandas()
+
+
+def read_ledger_parts(list_parts, columns=None, path=PATH_DATA_LEDGER):
+    columns = list(columns) if columns else [field.name for field in LEDGER_SCHEMA]
+    if not list_parts:
+        return LEDGER_SCHEMA.empty_table().select(columns).to_pandas()
+
+    dataset = ds.dataset([os.path.join(path, name) for name in list_parts], format='parquet', schema=LEDGER_SCHEMA)
+    return dataset.to_table(columns=columns).to_pandas()
+
+
+def count_ledger_rows(path=PATH_DATA_LEDGER):
+    if not ledger_exists(path):
+        return 0
+
+    return get_ledger_dataset(path).count_rows()
+
+
+# --- Fingerprint index ---
+# A sorted array of row hashes over FINGERPRINT_KEY_COLS with the number of ledger rows
+# carrying each hash. Identical fills are legitimate, so membership is a multiset count.
+
+def get_fingerprints(df_trades):
+    df_keys = to_ledger_frame(df_trades)[FINGERPRINT_KEY_COLS]
+    return pd.util.hash_pandas_object(df_keys, index=False).to_numpy(dtype=np.uint64)
+
+
+def count_fingerprints(fingerprints):
+    return np.unique(fingerprints, return_counts=True)
+
+
+def add_fingerprints(hashes, counts, fingerprints):
+    new_hashes, new_counts = count_fingerprints(fingerprints)
+    all_hashes = np.concatenate([hashes, new_hashes])
+    all_counts = np.concatenate([counts, new_counts])
+
+    merged_hashes, inverse = np.unique(all_hashes, return_inverse=True)
+    merged_counts = np.zeros(len(merged_hashes), dtype=np.int64)
+    np.add.at(merged_counts, inverse, all_counts)
+
+    return merged_hashes, merged_counts
+
+
+def lookup_fingerprint_counts(hashes, counts, fingerprints):
+    if len(hashes) == 0:
+        return np.zeros(len(fingerprints), dtype=np.int64)
+
+    positions = np.minimum(np.searchsorted(hashes, fingerprints), len(hashes) - 1)
+    return np.where(hashes[positions] == fingerprints, counts[positions], 0)
+
+
+def save_fingerprint_index(hashes, counts, path=PATH_DATA_LEDGER):
+    os.makedirs(path, exist_ok=True)
+    for file_name, values in [(FILE_FINGERPRINT_HASHES, hashes), (FILE_FINGERPRINT_COUNTS, counts)]:
+        path_file = os.path.join(path, file_name)
+        with open(f'{path_file}.tmp', 'wb') as file:
+            np.save(file, values)
+        os.replace(f'{path_file}.tmp', path_file)
+
+
+def rebuild_fingerprint_index(path=PATH_DATA_LEDGER):
+    df_keys = read_ledger(columns=FINGERPRINT_KEY_COLS, path=path)
+    hashes, counts = count_fingerprints(get_fingerprints(df_keys))
+    save_fingerprint_index(hashes, counts, path=path)
+
+    return hashes, counts
+
+
+def load_fingerprint_index(path=PATH_DATA_LEDGER):
+    '''(hashes, counts), memory-mapped; built from the ledger on first use.'''
+    path_hashes = os.path.join(path, FILE_FINGERPRINT_HASHES)
+    path_counts = os.path.join(path, FILE_FINGERPRINT_COUNTS)
+
+    if os.path.exists(path_hashes) and os.path.exists(path_counts):
+        return np.load(path_hashes, mmap_mode='r'), np.load(path_counts, mmap_mode='r')
+
+    if ledger_exists(path):
+        return rebuild_fingerprint_index(path)
+
+    return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+
+
+def filter_new_trades(df_batch, path=PATH_DATA_LEDGER):
+    '''
+    Rows of df_batch not yet in the ledger. A key seen k times in the ledger and m times in the
+    batch contributes its last max(m - k, 0) batch rows. Costs O(batch) plus a binary search
+    per row, independent of ledger size.
+    '''
+    if df_batch.shape[0] == 0:
+        return df_batch
+
+    fingerprints = get_fingerprints(df_batch)
+    hashes, counts = load_fingerprint_index(path)
+
+    n_in_ledger = lookup_fingerprint_counts(hashes, counts, fingerprints)
+    n_seen_in_batch = pd.Series(fingerprints).groupby(fingerprints).cumcount().to_numpy()
+
+    return df_batch[n_seen_in_batch >= n_in_ledger]
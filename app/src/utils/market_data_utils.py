@@ -0,0 +1,294 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor
+
+from app.src.utils.transport_utils import (
+    get_base_url,
+    get_session,
+)
+from app.src.utils.cache_utils import (
+    cache_get_many,
+    cache_set_many,
+)
+
+
+PATH_DATA_BARS = 'data/bars'
+
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Bars re-downloaded on each incremental fetch. They replace the cached copies (the newest
+# cached bar may have been a partial session) and are compared against the cache to catch
+# dividend/split adjustments, which rescale the whole auto_adjust=True history.
+N_OVERLAP_BARS = 5
+ADJUSTMENT_RTOL = 1e-6
+# A cache starting within this many days after the requested start still covers it: the
+# start date may be a weekend or holiday with no bar
+MAX_START_GAP_DAYS = 5
+
+# Yahoo chart API, used instead of yfinance when URL_YAHOO (or URL_STANDIN) is set so price
+# requests go through the record/replay transport
+URL_YAHOO_CHART = 'v8/finance/chart'
+MAX_PRICE_REQUESTS = 4
+REQUEST_TIMEOUT = 20
+
+
+def get_bars_path(ticker):
+    return os.path.join(PATH_DATA_BARS, f'{ticker}.parquet')
+
+
+def format_ohlcv(df):
+    if df.empty:
+        return df
+
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.droplevel(1)
+    df.columns = [col.capitalize() for col in df.columns]
+    df.index = pd.to_datetime(df.index).tz_localize(None)
+    df.index.name = 'Date'
+
+    return df[[col for col in BAR_COLUMNS if col in df.columns]]
+
+
+def download_ohlcv_http(ticker, start_date, end_date):
+    '''Auto-adjusted daily bars for [start_date, end_date) from a Yahoo chart API endpoint.'''
+    params = {
+        'period1': int(pd.Timestamp(start_date).timestamp()),
+        'period2': int(pd.Timestamp(end_date).timestamp()),
+        'interval': '1d',
+    }
+    response = get_session().get(f"{get_base_url('yahoo')}/{URL_YAHOO_CHART}/{ticker}", params=params, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+    list_results = response.json()['chart']['result'] or []
+    if not list_results or not list_results[0].get('timestamp'):
+        return pd.DataFrame(columns=BAR_COLUMNS, index=pd.DatetimeIndex([], name='Date'))
+
+    result = list_results[0]
+    quote = result['indicators']['quote'][0]
+    df = pd.DataFrame({col: quote[col.lower()] for col in BAR_COLUMNS}, dtype=float)
+
+    # auto_adjust=True: scale OHLC by adjclose / close
+    if result['indicators'].get('adjclose'):
+        factor = np.asarray(result['indicators']['adjclose'][0]['adjclose'], dtype=float) / df['Close'].to_numpy()
+        for col in ['Open', 'High', 'Low', 'Close']:
+            df[col] = df[col] * factor
+
+    timezone = result.get('meta', {}).get('exchangeTimezoneName', 'America/New_York')
+    df.index = pd.to_datetime(result['timestamp'], unit='s', utc=True).tz_convert(timezone).normalize().tz_localize(None)
+    df.index.name = 'Date'
+
+    df = df.dropna(subset=['Close'])
+    return df[(df.index >= pd.Timestamp(start_date)) & (df.index < pd.Timestamp(end_date))]
+
+
+def download_ohlcv(ticker, start_date, end_date):
+    if get_base_url('yahoo'):
+        return download_ohlcv_http(ticker, start_date, end_date)
+
+    import yfinance as yf
+
+    df = yf.download(ticker, start=start_date, end=end_date, progress=False, auto_adjust=True)
+    return format_ohlcv(df)
+
+
+def download_ohlcv_batch(tickers, start_date, end_date):
+    '''{ticker: bars} from a single yf.download call for all tickers.'''
+    if get_base_url('yahoo'):
+        with ThreadPoolExecutor(max_workers=MAX_PRICE_REQUESTS) as executor:
+            list_bars = list(executor.map(lambda ticker: download_ohlcv_http(ticker, start_date, end_date), tickers))
+        return dict(zip(tickers, list_bars))
+
+    import yfinance as yf
+
+    df = yf.download(list(tickers), start=start_date, end=end_date, progress=False, auto_adjust=True, group_by='ticker')
+
+    dict_bars = dict()
+    for ticker in tickers:
+        if df.empty or (isinstance(df.columns, pd.MultiIndex) and ticker not in df.columns.get_level_values(0)):
+            dict_bars[ticker] = pd.DataFrame(columns=BAR_COLUMNS, index=pd.DatetimeIndex([], name='Date'))
+            continue
+
+        df_ticker = df[ticker].copy() if isinstance(df.columns, pd.MultiIndex) else df.copy()
+        dict_bars[ticker] = format_ohlcv(df_ticker.dropna(how='all'))
+
+    return dict_bars
+
+
+def load_cached_ohlcv(ticker):
+    path = get_bars_path(ticker)
+    if not os.path.exists(path):
+        return None
+
+    return pd.read_parquet(path)
+
+
+def save_cached_ohlcv(ticker, df):
+    os.makedirs(PATH_DATA_BARS, exist_ok=True)
+    path = get_bars_path(ticker)
+    path_tmp = f'{path}.tmp'
+    df.to_parquet(path_tmp)
+    os.replace(path_tmp, path)
+
+
+def is_adjustment_changed(df_cached, df_fresh):
+    '''True when re-downloaded bars disagree with the cache, i.e. the adjusted history was rescaled.'''
+    # The newest cached bar may have been taken mid-session, so it is not evidence of an adjustment
+    overlap = df_cached.index[:-1].intersection(df_fresh.index)
+    if len(overlap) == 0:
+        return False
+
+    cached_close = df_cached.loc[overlap, 'Close'].to_numpy(dtype=float)
+    fresh_close = df_fresh.loc[overlap, 'Close'].to_numpy(dtype=float)
+
+    return not np.allclose(cached_close, fresh_close, rtol=ADJUSTMENT_RTOL, atol=0, equal_nan=True)
+
+
+def get_fetch_start(df_cached, start_date):
+    '''First date to download for an incremental update, or None when the cache must be built from start_date.'''
+    if df_cached is None or df_cached.empty or df_cached.index[0] > pd.Timestamp(start_date) + pd.Timedelta(days=MAX_START_GAP_DAYS):
+        return None
+
+    return df_cached.index[-min(N_OVERLAP_BARS, len(df_cached))]
+
+
+def merge_fresh_ohlcv(ticker, df_cached, df_fresh, end_date):
+    if df_fresh.empty:
+        return df_cached
+
+    if is_adjustment_changed(df_cached, df_fresh):
+        print(f'Adjusted prices changed for {ticker}, rebuilding its bar cache')
+        return download_ohlcv(ticker, df_cached.index[0].strftime('%Y-%m-%d'), end_date)
+
+    return pd.concat([df_cached[df_cached.index < df_fresh.index[0]], df_fresh])
+
+
+def load_shared_ohlcv(tickers, start_date, end_date):
+    '''
+    ({ticker: bars another process already brought up to end_date}, {ticker: newest of the
+    on-disk and shared bars}) for the rest. Shared bars are written back to disk when newer.
+    '''
+    dict_shared = cache_get_many('bars', tickers)
+    dict_ready = dict()
+    dict_cached = dict()
+
+    for ticker in tickers:
+        df_disk = load_cached_ohlcv(ticker)
+        dict_entry = dict_shared.get(ticker)
+        df_shared = dict_entry['bars'] if dict_entry else None
+
+        is_shared_newer = df_shared is not None and not df_shared.empty and (
+            df_disk is None or df_disk.empty or df_shared.index[-1] > df_disk.index[-1]
+        )
+        if is_shared_newer:
+            save_cached_ohlcv(ticker, df_shared)
+
+        if dict_entry and dict_entry['end_date'] == end_date and get_fetch_start(df_shared, start_date) is not None:
+            dict_ready[ticker] = df_shared
+        else:
+            dict_cached[ticker] = df_shared if is_shared_newer else df_disk
+
+    return dict_ready, dict_cached
+
+
+def share_ohlcv(dict_bars, end_date):
+    '''Publish bars brought up to end_date to the shared cache in one batch.'''
+    cache_set_many('bars', {
+        ticker: {'bars': df_bars, 'end_date': end_date} for ticker, df_bars in dict_bars.items() if not df_bars.empty
+    })
+
+
+def update_cached_ohlcv(ticker, start_date, end_date):
+    '''Bring the cached bars for a ticker up to end_date, downloading only what is missing.'''
+    dict_ready, dict_cached = load_shared_ohlcv([ticker], start_date, end_date)
+    if ticker in dict_ready:
+        return dict_ready[ticker]
+
+    df_cached = dict_cached[ticker]
+    fetch_start = get_fetch_start(df_cached, start_date)
+
+    if fetch_start is None:
+        print(f'Building bar cache for {ticker} from {start_date}')
+        df_bars = download_ohlcv(ticker, start_date, end_date)
+    else:
+        df_fresh = download_ohlcv(ticker, fetch_start.strftime('%Y-%m-%d'), end_date)
+        if df_fresh.empty:
+            share_ohlcv({ticker: df_cached}, end_date)
+            return df_cached
+        df_bars = merge_fresh_ohlcv(ticker, df_cached, df_fresh, end_date)
+
+    if not df_bars.empty:
+        save_cached_ohlcv(ticker, df_bars)
+    share_ohlcv({ticker: df_bars}, end_date)
+
+    return df_bars
+
+
+def update_cached_ohlcv_batch(tickers, start_date, end_date):
+    '''
+    update_cached_ohlcv for many tickers with at most two downloads: one for tickers whose cache
+    must be built and one, from the earliest overlap start, for the incremental updates. Tickers
+    another process has already brought up to end_date are taken from the shared cache.
+    '''
+    dict_ready, dict_cached = load_shared_ohlcv(tickers, start_date, end_date)
+    dict_fetch_start = {ticker: get_fetch_start(df_cached, start_date) for ticker, df_cached in dict_cached.items()}
+
+    list_build = [ticker for ticker, fetch_start in dict_fetch_start.items() if fetch_start is None]
+    list_update = [ticker for ticker, fetch_start in dict_fetch_start.items() if fetch_start is not None]
+
+    dict_bars = dict()
+    list_changed = list()
+    if list_build:
+        print(f'Building bar cache for {", ".join(list_build)} from {start_date}')
+        dict_bars.update(download_ohlcv_batch(list_build, start_date, end_date))
+        list_changed.extend(list_build)
+
+    if list_update:
+        fetch_start = min(dict_fetch_start[ticker] for ticker in list_update)
+        dict_fresh = download_ohlcv_batch(list_update, fetch_start.strftime('%Y-%m-%d'), end_date)
+
+        for ticker in list_update:
+            df_fresh = dict_fresh[ticker]
+            if not df_fresh.empty:
+                df_fresh = df_fresh[df_fresh.index >= dict_fetch_start[ticker]]
+            dict_bars[ticker] = merge_fresh_ohlcv(ticker, dict_cached[ticker], df_fresh, end_date)
+            if not df_fresh.empty:
+                list_changed.append(ticker)
+
+    for ticker in list_changed:
+        if not dict_bars[ticker].empty:
+            save_cached_ohlcv(ticker, dict_bars[ticker])
+    share_ohlcv(dict_bars, end_date)
+
+    dict_bars.update(dict_ready)
+    return {ticker: dict_bars[ticker] for ticker in tickers}
+
+
+def get_ohlcv(ticker, start_date, end_date, use_cache=True):
+    '''Daily auto-adjusted bars for [start_date, end_date), same convention as yf.download.'''
+    if not use_cache:
+        return download_ohlcv(ticker, start_date, end_date)
+
+    df_bars = update_cached_ohlcv(ticker, start_date, end_date)
+    if df_bars.empty:
+        return df_bars
+
+    mask = (df_bars.index >= pd.Timestamp(start_date)) & (df_bars.index < pd.Timestamp(end_date))
+    return df_bars[mask]
+
+
+def get_ohlcv_batch(tickers, start_date, end_date, use_cache=True):
+    '''{ticker: get_ohlcv(ticker, start_date, end_date)} with the downloads batched across tickers.'''
+    if not use_cache:
+        return download_ohlcv_batch(tickers, start_date, end_date)
+
+    dict_bars = update_cached_ohlcv_batch(tickers, start_date, end_date)
+
+    for ticker, df_bars in dict_bars.items():
+        if not df_bars.empty:
+            mask = (df_bars.index >= pd.Timestamp(start_date)) & (df_bars.index < pd.Timestamp(end_date))
+            dict_bars[ticker] = df_bars[mask]
+
+    return dict_bars
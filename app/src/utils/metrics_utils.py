@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import functools
+import threading
+
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+import requests
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+PATH_METRICS = 'data/metrics'
+
+# Spans are recorded only when enabled (METRICS_ENABLED=1 or enable_metrics()); otherwise span()
+# returns a shared no-op context and @timed calls straight through.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+
+LIST_SPANS = list()
+DICT_HTTP = {'calls': 0, 'bytes_sent': 0, 'bytes_received': 0}
+HTTP_LOCK = threading.Lock()
+SPAN_STACK = threading.local()
+NULL_SPAN = nullcontext()
+
+SESSION_SEND = requests.Session.send
+
+
+# --- HTTP accounting ---
+
+def send_counted(session, request, **kwargs):
+    '''requests.Session.send that adds every call to DICT_HTTP (all sessions, including gspread's).'''
+    response = SESSION_SEND(session, request, **kwargs)
+
+    body = request.body or b''
+    n_received = len(response.content) if not kwargs.get('stream') else int(response.headers.get('Content-Length') or 0)
+    with HTTP_LOCK:
+        DICT_HTTP['calls'] += 1
+        DICT_HTTP['bytes_sent'] += len(body.encode() if isinstance(body, str) else body)
+        DICT_HTTP['bytes_received'] += n_received
+
+    return response
+
+
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+
+    # ru_maxrss is KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def enable_metrics():
+    global METRICS_ENABLED
+
+    METRICS_ENABLED = True
+    requests.Session.send = send_counted
+
+
+def disable_metrics():
+    global METRICS_ENABLED
+
+    METRICS_ENABLED = False
+    requests.Session.send = SESSION_SEND
+
+
+def reset_metrics():
+    LIST_SPANS.clear()
+    with HTTP_LOCK:
+        DICT_HTTP.update({'calls': 0, 'bytes_sent': 0, 'bytes_received': 0})
+
+
+# --- Spans ---
+
+@contextmanager
+def record_span(name):
+    stack = SPAN_STACK.__dict__.setdefault('names', list())
+    parent = stack[-1] if stack else None
+    stack.append(name)
+
+    with HTTP_LOCK:
+        dict_http_start = dict(DICT_HTTP)
+    started_at = time.time()
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        wall_seconds = time.perf_counter() - start
+        stack.pop()
+        with HTTP_LOCK:
+            dict_http_end = dict(DICT_HTTP)
+
+        LIST_SPANS.append({
+            'name': name,
+            'parent': parent,
+            'started_at': datetime.fromtimestamp(started_at).isoformat(timespec='milliseconds'),
+            'wall_seconds': wall_seconds,
+            'http_calls': dict_http_end['calls'] - dict_http_start['calls'],
+            'bytes_sent': dict_http_end['bytes_sent'] - dict_http_start['bytes_sent'],
+            'bytes_received': dict_http_end['bytes_received'] - dict_http_start['bytes_received'],
+            'peak_rss_mb': get_peak_rss_mb(),
+        })
+
+
+def span(name):
+    '''
+    Context manager timing a stage: wall time, HTTP calls and bytes made while it is open (from
+    any thread, so overlapping spans share counts) and the process peak RSS at its end.
+    '''
+    if not METRICS_ENABLED:
+        return NULL_SPAN
+
+    return record_span(name)
+
+
+def timed(name=None):
+    '''Decorator form of span(), named after the function by default.'''
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return fn(*args, **kwargs)
+
+            with record_span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# --- Output ---
+
+def get_metrics():
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'peak_rss_mb': get_peak_rss_mb(),
+        'http': dict(DICT_HTTP),
+        'spans': list(LIST_SPANS),
+    }
+
+
+def write_metrics(run_name='daily_call', path=PATH_METRICS):
+    '''Write the recorded spans to {path}/{run_name}_{timestamp}.json and return the file path.'''
+    if not METRICS_ENABLED:
+        return None
+
+    os.makedirs(path, exist_ok=True)
+    path_file = os.path.join(path, f'{run_name}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json')
+    with open(path_file, 'w') as file:
+        json.dump(get_metrics(), file, indent=2)
+
+    return path_file
+
+
+def get_summary_line():
+    '''One line for the Telegram message: top-level stage times, HTTP totals and peak RSS.'''
+    if not METRICS_ENABLED:
+        return ''
+
+    list_top = [dict_span for dict_span in LIST_SPANS if dict_span['parent'] is None]
+    str_stages = ' | '.join(f"{dict_span['name']} {dict_span['wall_seconds']:.1f}s" for dict_span in list_top)
+    str_http = f"{DICT_HTTP['calls']} HTTP, {(DICT_HTTP['bytes_sent'] + DICT_HTTP['bytes_received']) / 2 ** 20:.2f} MB"
+    peak_rss_mb = get_peak_rss_mb()
+    str_rss = f' | RSS {peak_rss_mb:.0f} MB' if peak_rss_mb is not None else ''
+
+    return f'Timing: {str_stages} | {str_http}{str_rss}'
+
+
+if METRICS_ENABLED:
+    enable_metrics()
@@ -0,0 +1,228 @@
+import os
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from app.src.utils.strategy_utils import (
+    N_PERIOD,
+    EMA_FAST_PERIOD,
+    EMA_SLOW_PERIOD,
+    INDICATOR_PERIODS,
+    STRATEGY_PARAMS,
+    generate_signals,
+    fetch_price_data,
+)
+from app.src.utils.indicator_utils import INDICATOR_COLS, compute_indicator_array
+from app.src.utils.backtest_utils import INITIAL_CAPITAL_USD, simulate_equity
+
+
+SWEEP_PRICE_COLS = ['Open_QQQ', 'High_QQQ', 'Low_QQQ', 'Close_QQQ', 'Close_TQQQ', 'Close_SQQQ']
+
+# Sweepable parameters: the strategy thresholds plus the indicator periods
+SWEEP_DEFAULTS = {
+    **STRATEGY_PARAMS,
+    'EMA_FAST_PERIOD': EMA_FAST_PERIOD,
+    'EMA_SLOW_PERIOD': EMA_SLOW_PERIOD,
+    'N_PERIOD': N_PERIOD,
+}
+
+SWEEP_METRICS = ['cagr', 'sharpe', 'max_drawdown']
+N_BARS_PER_YEAR = 252
+
+TRAIN_BARS = 3 * N_BARS_PER_YEAR
+TEST_BARS = N_BARS_PER_YEAR
+
+# Per-worker handles, set by init_sweep_worker
+WORKER_SHM = None
+WORKER_PRICES = None
+WORKER_INDICATORS = dict()
+
+
+def expand_param_grid(param_grid):
+    '''{'NAME': [values, ...]} -> list of parameter dicts, one per combination.'''
+    unknown = set(param_grid) - set(SWEEP_DEFAULTS)
+    if unknown:
+        raise ValueError(f'Unknown sweep parameters: {sorted(unknown)}')
+
+    names = list(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(param_grid[name] for name in names))]
+
+
+def get_performance(equity):
+    '''CAGR, annualized Sharpe (zero risk-free rate) and max drawdown (negative fraction) of an equity curve.'''
+    equity = np.asarray(equity, dtype=float)
+    if len(equity) < 2 or equity[0] <= 0:
+        return {'cagr': np.nan, 'sharpe': np.nan, 'max_drawdown': np.nan}
+
+    returns = np.diff(equity) / equity[:-1]
+    n_years = (len(equity) - 1) / N_BARS_PER_YEAR
+    std = returns.std(ddof=1)
+
+    return {
+        'cagr': (equity[-1] / equity[0]) ** (1 / n_years) - 1 if equity[-1] > 0 else -1.0,
+        'sharpe': returns.mean() / std * np.sqrt(N_BARS_PER_YEAR) if std > 0 else 0.0,
+        'max_drawdown': (equity / np.maximum.accumulate(equity) - 1).min(),
+    }
+
+
+def rank_results(df_results, metrics=SWEEP_METRICS):
+    '''Average of the per-metric ranks (higher CAGR/Sharpe and shallower drawdown rank first).'''
+    df_results = df_results.copy()
+    df_results['rank'] = df_results[list(metrics)].rank(ascending=False, na_option='bottom').mean(axis=1)
+    return df_results.sort_values('rank').reset_index(drop=True)
+
+
+# --- Shared price arrays ---
+
+def get_sweep_prices(all_data):
+    '''Gap-free QQQ/TQQQ/SQQQ price matrix (n_bars, len(SWEEP_PRICE_COLS)) from fetch_price_data output.'''
+    df_prices = all_data[SWEEP_PRICE_COLS].dropna(subset=['Close_QQQ'])
+    return df_prices.index, np.ascontiguousarray(df_prices.to_numpy(dtype=np.float64))
+
+
+def share_prices(prices):
+    shm = shared_memory.SharedMemory(create=True, size=prices.nbytes)
+    np.ndarray(prices.shape, dtype=prices.dtype, buffer=shm.buf)[:] = prices
+    return shm
+
+
+def init_sweep_worker(shm_name, shape):
+    global WORKER_SHM, WORKER_PRICES, WORKER_INDICATORS
+
+    # Pool workers share the parent's resource tracker, so attaching does not take ownership;
+    # the parent unlinks the block once the pool is done
+    WORKER_SHM = shared_memory.SharedMemory(name=shm_name)
+
+    WORKER_PRICES = np.ndarray(shape, dtype=np.float64, buffer=WORKER_SHM.buf)
+    WORKER_INDICATORS = dict()
+
+
+def get_worker_indicators(params):
+    periods = {
+        **INDICATOR_PERIODS,
+        'EMA_FAST': params['EMA_FAST_PERIOD'],
+        'EMA_SLOW': params['EMA_SLOW_PERIOD'],
+        'RSI': params['N_PERIOD'],
+    }
+    key = tuple(sorted(periods.items()))
+
+    if key not in WORKER_INDICATORS:
+        high, low, close = (WORKER_PRICES[:, SWEEP_PRICE_COLS.index(col)] for col in ['High_QQQ', 'Low_QQQ', 'Close_QQQ'])
+        WORKER_INDICATORS[key] = compute_indicator_array(high, low, close, periods, use_numba=True)
+
+    return WORKER_INDICATORS[key]
+
+
+def evaluate_params(params, start=0, stop=None, initial_capital=INITIAL_CAPITAL_USD):
+    '''
+    Backtest one parameter set over bars [start, stop) of the shared prices. Indicators run over
+    the full history so the window starts warmed up, as the live strategy would be.
+    '''
+    params = {**SWEEP_DEFAULTS, **params}
+    indicators = get_worker_indicators(params)
+
+    columns = {col: indicators[:, i] for i, col in enumerate(INDICATOR_COLS)}
+    columns.update({col: WORKER_PRICES[:, i] for i, col in enumerate(SWEEP_PRICE_COLS)})
+
+    window = slice(start, stop)
+    signals = generate_signals(columns, params=params)[window]
+    _, equity = simulate_equity(
+        signals, columns['ATR'][window], columns['Close_TQQQ'][window], columns['Close_SQQQ'][window],
+        initial_capital=initial_capital, params=params,
+    )
+
+    return get_performance(equity)
+
+
+def evaluate_task(task):
+    params, start, stop, initial_capital = task
+    return evaluate_params(params, start=start, stop=stop, initial_capital=initial_capital)
+
+
+def run_tasks(prices, tasks, n_workers=None):
+    shm = share_prices(prices)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_workers or os.cpu_count(),
+            initializer=init_sweep_worker,
+            initargs=(shm.name, prices.shape),
+        ) as executor:
+            chunksize = max(1, len(tasks) // (4 * (n_workers or os.cpu_count())))
+            return list(executor.map(evaluate_task, tasks, chunksize=chunksize))
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+# --- Sweep & walk-forward ---
+
+def run_param_sweep(all_data, param_grid, initial_capital=INITIAL_CAPITAL_USD, n_workers=None):
+    '''Evaluate every combination of param_grid over the full history, ranked by SWEEP_METRICS.'''
+    _, prices = get_sweep_prices(all_data)
+    list_params = expand_param_grid(param_grid)
+
+    tasks = [(params, 0, None, initial_capital) for params in list_params]
+    list_metrics = run_tasks(prices, tasks, n_workers=n_workers)
+
+    df_results = pd.DataFrame([{**params, **metrics} for params, metrics in zip(list_params, list_metrics)])
+    return rank_results(df_results)
+
+
+def get_walk_forward_windows(n_bars, train_bars=TRAIN_BARS, test_bars=TEST_BARS):
+    '''Rolling (train_start, train_stop, test_stop) bar offsets; each test window follows its train window.'''
+    windows = list()
+    for train_start in range(0, n_bars - train_bars - test_bars + 1, test_bars):
+        train_stop = train_start + train_bars
+        windows.append((train_start, train_stop, train_stop + test_bars))
+
+    return windows
+
+
+def run_walk_forward(all_data, param_grid, train_bars=TRAIN_BARS, test_bars=TEST_BARS,
+                     initial_capital=INITIAL_CAPITAL_USD, n_workers=None):
+    '''
+    For each window, pick the best-ranked parameters on the train bars and report how they did
+    on the following test bars. Every window's train sweep runs in a single pool pass.
+    '''
+    index, prices = get_sweep_prices(all_data)
+    list_params = expand_param_grid(param_grid)
+    windows = get_walk_forward_windows(len(index), train_bars=train_bars, test_bars=test_bars)
+    if not windows:
+        raise ValueError(f'Need at least {train_bars + test_bars} bars, got {len(index)}')
+
+    tasks = [(params, start, stop, initial_capital) for start, stop, _ in windows for params in list_params]
+    list_metrics = run_tasks(prices, tasks, n_workers=n_workers)
+
+    list_best = list()
+    for i_window in range(len(windows)):
+        window_metrics = list_metrics[i_window * len(list_params):(i_window + 1) * len(list_params)]
+        df_train = rank_results(pd.DataFrame([{'i_params': i, **metrics} for i, metrics in enumerate(window_metrics)]))
+        list_best.append((list_params[df_train['i_params'].iloc[0]], df_train.iloc[0]))
+
+    test_tasks = [
+        (params, train_stop, test_stop, initial_capital)
+        for (params, _), (_, train_stop, test_stop) in zip(list_best, windows)
+    ]
+    list_test_metrics = run_tasks(prices, test_tasks, n_workers=n_workers)
+
+    list_rows = list()
+    for (train_start, train_stop, test_stop), (params, best), test_metrics in zip(windows, list_best, list_test_metrics):
+        list_rows.append({
+            'train_start': index[train_start],
+            'test_start': index[train_stop],
+            'test_end': index[test_stop - 1],
+            **params,
+            **{f'train_{metric}': best[metric] for metric in SWEEP_METRICS},
+            **{f'test_{metric}': test_metrics[metric] for metric in SWEEP_METRICS},
+        })
+
+    return pd.DataFrame(list_rows)
+
+
+def sweep_strategy(tickers, start_date, end_date, param_grid, **kwargs):
+    all_data = fetch_price_data(tickers, start_date, end_date)
+    return run_param_sweep(all_data, param_grid, **kwargs)
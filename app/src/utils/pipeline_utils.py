@@ -0,0 +1,89 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from app.src.utils.metrics_utils import span
+
+
+MAX_PIPELINE_WORKERS = 8
+
+
+def get_task_order(dict_tasks):
+    '''Task names in an order where every task comes after its dependencies; raises on cycles or unknown names.'''
+    list_order = list()
+    set_done = set()
+    set_visiting = set()
+
+    def visit(name, path):
+        if name in set_done:
+            return
+        if name not in dict_tasks:
+            raise KeyError(f'Unknown task {name!r} (required by {path[-1] if path else None})')
+        if name in set_visiting:
+            raise ValueError(f'Dependency cycle: {" -> ".join(path + [name])}')
+
+        set_visiting.add(name)
+        for dep in dict_tasks[name][1]:
+            visit(dep, path + [name])
+        set_visiting.discard(name)
+
+        set_done.add(name)
+        list_order.append(name)
+
+    for name in dict_tasks:
+        visit(name, [])
+
+    return list_order
+
+
+def run_pipeline(dict_tasks, max_workers=MAX_PIPELINE_WORKERS):
+    '''
+    Run {name: (fn, [dependency names])} on a thread pool, starting each task as soon as its
+    dependencies are done. fn is called with the dependency results as keyword arguments.
+    Returns ({name: result}, {name: (start, end) seconds from the pipeline start}). The first
+    failure cancels tasks not yet started and is raised once running ones finish.
+    '''
+    list_order = get_task_order(dict_tasks)
+    dict_results = dict()
+    dict_timings = dict()
+    dict_running = dict()
+    set_submitted = set()
+    pipeline_start = time.perf_counter()
+
+    def run_task(name):
+        fn, list_deps = dict_tasks[name]
+        start = time.perf_counter() - pipeline_start
+        with span(name):
+            result = fn(**{dep: dict_results[dep] for dep in list_deps})
+        dict_timings[name] = (start, time.perf_counter() - pipeline_start)
+
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pipeline') as executor:
+        try:
+            while len(dict_results) < len(dict_tasks):
+                for name in list_order:
+                    if name not in set_submitted and all(dep in dict_results for dep in dict_tasks[name][1]):
+                        dict_running[executor.submit(run_task, name)] = name
+                        set_submitted.add(name)
+
+                set_done, _ = wait(dict_running, return_when=FIRST_COMPLETED)
+                for future in set_done:
+                    dict_results[dict_running.pop(future)] = future.result()
+        finally:
+            for future in dict_running:
+                future.cancel()
+
+    return dict_results, dict_timings
+
+
+def get_critical_path(dict_tasks, dict_timings):
+    '''The chain of tasks, each the last-finishing dependency of the next, that set the total run time.'''
+    name = max(dict_timings, key=lambda task: dict_timings[task][1])
+    list_path = [name]
+
+    while dict_tasks[name][1]:
+        name = max(dict_tasks[name][1], key=lambda dep: dict_timings[dep][1])
+        list_path.append(name)
+
+    return list_path[::-1]
@@ -0,0 +1,215 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from app.src.utils.ledger_utils import (
+    ledger_exists,
+    list_ledger_parts,
+    read_ledger_parts,
+)
+from app.src.utils.qt_utils import (
+    MAP_REPLACE_SYMBOL,
+    load_trades,
+    get_acc_pos_df,
+)
+
+
+PATH_PNL_CHECKPOINT = 'data/pnl_checkpoint.json'
+
+PNL_GROUP_COLS = ['account_type', 'symbol']
+PNL_TRADE_COLS = ['transaction_date', 'settlement_date', 'symbol', 'currency', 'quantity', 'net_amount', 'activity_type', 'account_type']
+PNL_STATE_COLS = PNL_GROUP_COLS + ['currency', 'shares', 'acb', 'realized_pnl']
+
+
+def prepare_pnl_trades(df_trades):
+    '''
+    Trade rows only, with symbols normalized like load_trades, account types matching the
+    position frame ('Individual TFSA' -> 'TFSA') and a deterministic order: by group, then
+    transaction date, buys before sells on the same day.
+    '''
+    df_pnl = df_trades[df_trades['activity_type'] == 'Trades'][PNL_TRADE_COLS].copy()
+
+    df_pnl['symbol'] = df_pnl['symbol'].astype('object').replace(MAP_REPLACE_SYMBOL)
+    df_pnl['account_type'] = df_pnl['account_type'].astype('object').str.replace('Individual ', '', regex=False).replace({'cash': 'Cash'})
+    df_pnl['currency'] = df_pnl['currency'].astype('object')
+    df_pnl['transaction_date'] = pd.to_datetime(df_pnl['transaction_date'])
+    df_pnl['quantity'] = pd.to_numeric(df_pnl['quantity']).astype('float64')
+    df_pnl['net_amount'] = pd.to_numeric(df_pnl['net_amount']).astype('float64')
+    df_pnl['is_opening'] = False
+
+    df_pnl = df_pnl[(df_pnl['quantity'] != 0) & df_pnl['symbol'].notna() & (df_pnl['symbol'] != '')]
+
+    return df_pnl.sort_values(PNL_GROUP_COLS + ['transaction_date', 'quantity'], ascending=[True, True, True, False], kind='stable')
+
+
+def get_opening_rows(df_state):
+    '''One synthetic buy per carried-over group so a checkpointed position seeds the recurrence.'''
+    df_opening = df_state[PNL_GROUP_COLS + ['currency']].copy()
+    df_opening['transaction_date'] = pd.NaT
+    df_opening['quantity'] = df_state['shares'].astype('float64')
+    df_opening['net_amount'] = -df_state['acb'].astype('float64')
+    df_opening['is_opening'] = True
+
+    return df_opening
+
+
+def compute_acb(df_pnl, df_state=None):
+    '''
+    Average-cost ACB per (account_type, symbol) without a row loop. The position's cost is the
+    linear recurrence T_k = r_k * T_{k-1} + c_k: a buy adds its cost (r=1, c=-net_amount), a sell
+    keeps the unsold fraction (r=shares_after/shares_before, c=0) and a full exit resets it (r=0).
+    Splitting at the resets, T_k = P_k * cumsum(c / P)_k with P the running product of r, which
+    is two grouped cumulative ops. Short positions carry no cost basis. df_state, from
+    summarize_pnl, seeds each group with its checkpointed shares, ACB and realized P&L.
+    '''
+    if df_state is not None and df_state.shape[0] > 0:
+        df_pnl = pd.concat([get_opening_rows(df_state), df_pnl], ignore_index=True)
+        df_pnl = df_pnl.sort_values(PNL_GROUP_COLS + ['is_opening'], ascending=[True, True, False], kind='stable')
+
+    df_pnl = df_pnl.reset_index(drop=True)
+    group = df_pnl.groupby(PNL_GROUP_COLS, sort=False).ngroup().to_numpy()
+    is_group_start = np.r_[True, group[1:] != group[:-1]]
+
+    quantity = df_pnl['quantity'].to_numpy()
+    net_amount = df_pnl['net_amount'].to_numpy()
+
+    shares_after = pd.Series(quantity).groupby(group).cumsum().to_numpy()
+    shares_before = shares_after - quantity
+    long_before = np.maximum(shares_before, 0)
+    long_after = np.maximum(shares_after, 0)
+
+    is_buy = quantity > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.select(
+            [is_group_start | (long_before == 0), is_buy],
+            [0.0, 1.0],
+            default=long_after / long_before,
+        )
+        cost = np.where(is_buy, -net_amount * (long_after - long_before) / quantity, 0.0)
+
+    segment = np.cumsum(ratio == 0)
+    ratio_segment = np.where(ratio == 0, 1.0, ratio)
+
+    product = pd.Series(ratio_segment).groupby(segment).cumprod().to_numpy()
+    acb = product * pd.Series(cost / product).groupby(segment).cumsum().to_numpy()
+    acb = np.where(long_after > 0, acb, 0.0)
+
+    acb_before = np.where(is_group_start, 0.0, np.r_[0.0, acb[:-1]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction_closed = np.where(is_buy, 0.0, (long_before - long_after) / -quantity)
+        avg_cost = np.where(long_after > 0, acb / long_after, np.nan)
+    realized = np.where(is_buy, 0.0, net_amount * fraction_closed - (acb_before - acb))
+
+    df_pnl['shares'] = shares_after
+    df_pnl['acb'] = acb
+    df_pnl['avg_cost'] = avg_cost
+    df_pnl['realized_pnl'] = realized
+
+    if df_state is not None and df_state.shape[0] > 0:
+        df_carry = df_pnl.loc[df_pnl['is_opening'], PNL_GROUP_COLS].merge(df_state[PNL_GROUP_COLS + ['realized_pnl']], on=PNL_GROUP_COLS, how='left')
+        df_pnl.loc[df_pnl['is_opening'], 'realized_pnl'] = df_carry['realized_pnl'].to_numpy()
+
+    return df_pnl
+
+
+def summarize_pnl(df_acb):
+    '''Per-group state after the last trade: shares held, ACB and cumulative realized P&L.'''
+    df_groups = df_acb.groupby(PNL_GROUP_COLS, sort=True)
+    df_state = df_groups[['currency', 'shares', 'acb']].last()
+    df_state['realized_pnl'] = df_groups['realized_pnl'].sum()
+
+    return df_state.reset_index()[PNL_STATE_COLS]
+
+
+def mark_to_market(df_state, df_positions):
+    '''Unrealized P&L against the position frame from get_acc_pos_df, in each security's currency.'''
+    df_market = df_positions[['account', 'symbol', 'openQuantity', 'currentMarketValue']].rename(
+        columns={'account': 'account_type', 'openQuantity': 'open_quantity', 'currentMarketValue': 'market_value'},
+    )
+    df_market = df_market.groupby(PNL_GROUP_COLS, as_index=False)[['open_quantity', 'market_value']].sum()
+
+    df_pnl = df_state.merge(df_market, on=PNL_GROUP_COLS, how='outer')
+    df_pnl['unrealized_pnl'] = np.where(df_pnl['shares'] > 0, df_pnl['market_value'] - df_pnl['acb'], np.nan)
+
+    return df_pnl
+
+
+def load_pnl_checkpoint():
+    if not os.path.exists(PATH_PNL_CHECKPOINT):
+        return None
+
+    with open(PATH_PNL_CHECKPOINT, 'r') as file:
+        dict_checkpoint = json.load(file)
+
+    dict_checkpoint['state'] = pd.DataFrame(dict_checkpoint['state'], columns=PNL_STATE_COLS)
+    dict_checkpoint['last_transaction_date'] = pd.Timestamp(dict_checkpoint['last_transaction_date'])
+
+    return dict_checkpoint
+
+
+def save_pnl_checkpoint(df_state, list_parts, last_transaction_date):
+    dict_checkpoint = {
+        'parts': list_parts,
+        'last_transaction_date': last_transaction_date.isoformat(),
+        'state': df_state[PNL_STATE_COLS].to_dict(orient='records'),
+    }
+
+    os.makedirs(os.path.dirname(PATH_PNL_CHECKPOINT), exist_ok=True)
+    with open(f'{PATH_PNL_CHECKPOINT}.tmp', 'w') as file:
+        json.dump(dict_checkpoint, file)
+    os.replace(f'{PATH_PNL_CHECKPOINT}.tmp', PATH_PNL_CHECKPOINT)
+
+
+def get_incremental_state():
+    '''
+    Group state up to date with the ledger, reading only part files added since the checkpoint.
+    Falls back to a full pass when there is no checkpoint, when parts were rewritten (compaction)
+    or when new trades are dated on or before the checkpoint, since they would reorder history.
+    '''
+    list_parts = list_ledger_parts()
+    dict_checkpoint = load_pnl_checkpoint()
+
+    if dict_checkpoint and set(dict_checkpoint['parts']) <= set(list_parts):
+        set_done = set(dict_checkpoint['parts'])
+        df_new = prepare_pnl_trades(read_ledger_parts([name for name in list_parts if name not in set_done], columns=PNL_TRADE_COLS))
+
+        if df_new.shape[0] == 0:
+            save_pnl_checkpoint(dict_checkpoint['state'], list_parts, dict_checkpoint['last_transaction_date'])
+            return dict_checkpoint['state']
+
+        if df_new['transaction_date'].min() > dict_checkpoint['last_transaction_date']:
+            print(f'Updating P&L with {df_new.shape[0]} new trades')
+            df_state = summarize_pnl(compute_acb(df_new, dict_checkpoint['state']))
+            save_pnl_checkpoint(df_state, list_parts, df_new['transaction_date'].max())
+            return df_state
+
+    print('Recomputing P&L over the full ledger')
+    df_pnl = prepare_pnl_trades(read_ledger_parts(list_parts, columns=PNL_TRADE_COLS))
+    df_state = summarize_pnl(compute_acb(df_pnl))
+    save_pnl_checkpoint(df_state, list_parts, df_pnl['transaction_date'].max())
+
+    return df_state
+
+
+def get_pnl(df_trades=None, df_positions=None, incremental=True):
+    '''
+    Per (account_type, symbol): shares, ACB, average cost, realized and unrealized P&L, in the
+    trade currency. With the Parquet ledger and incremental=True only newly appended trades are
+    processed; otherwise df_trades (default: load_trades) is recomputed in full.
+    '''
+    if df_trades is None and incremental and ledger_exists():
+        df_state = get_incremental_state()
+    else:
+        if df_trades is None:
+            df_trades, _ = load_trades(columns=PNL_TRADE_COLS, typed=True)
+        df_state = summarize_pnl(compute_acb(prepare_pnl_trades(df_trades)))
+
+    if df_positions is None:
+        df_positions = get_acc_pos_df()
+
+    df_pnl = mark_to_market(df_state, df_positions)
+    df_pnl['avg_cost'] = np.where(df_pnl['shares'] > 0, df_pnl['acb'] / df_pnl['shares'], np.nan)
+
+    return df_pnl
@@ -1,3 +1,7 @@
+import os
+import time
+import threading
+import shutil
 import pytz
 import json
 import requests
@@ -10,14 +14,45 @@ import pandas as pd
 
 from pprint import pprint
 from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pandas.tseries.offsets import BDay
+from app.src.utils.fx_utils import get_fx_rate
+from app.src.utils.metrics_utils import timed
+from app.src.utils.cache_utils import (
+    cache_get,
+    cache_get_many,
+    cache_set,
+    cache_set_many,
+    shared_lock,
+)
+from app.src.utils.transport_utils import (
+    get_base_url,
+    get_session,
+    mount_transport,
+    is_live_service,
+)
+from app.src.utils.ledger_utils import (
+    PATH_DATA_LEDGER,
+    ledger_exists,
+    list_ledger_parts,
+    append_trades,
+    read_ledger,
+    filter_new_trades,
+)
+from app.src.utils.trade_index_utils import TradeIndex
 
 
 PATH_REFRESH_TOKEN_FILE = '../../configs/questrade_refresh_token.txt'
+PATH_TOKEN_CACHE = '../../configs/questrade_token_cache.json'
+# Tokens from a stand-in or cassettes, kept apart so a live run never picks them up
+PATH_TOKEN_CACHE_OFFLINE = '../../configs/questrade_token_cache.offline.json'
 PATH_DATA_TRADES = 'data/questrade_trade_data.csv'
-URL_FX_FRANKFURTER = "https://api.frankfurter.app/latest"
-URL_ACCESS_TOKEN = 'https://login.questrade.com/oauth2/token?grant_type=refresh_token&refresh_token='
+PATH_BACKFILL_CHECKPOINT = 'data/activity_backfill.json'
+URL_QUESTRADE_LOGIN = 'https://login.questrade.com'
+URL_ACCESS_TOKEN = 'oauth2/token?grant_type=refresh_token&refresh_token='
 URL_ACCOUNTS = 'v1/accounts'
+URL_SYMBOL_SEARCH = 'v1/symbols/search'
+URL_QUOTES = 'v1/markets/quotes'
 
 LIST_ACC_TYPES = ['TFSA', 'FHSA', 'RRSP', 'Cash']
 
@@ -74,47 +109,117 @@ MAP_REPLACE_SYMBOL = {
 }
 
 LIST_DATE_COLS = ['transaction_date', 'settlement_date']
+LIST_CATEGORY_COLS = ['symbol', 'action', 'currency', 'account_type', 'activity_type']
+LIST_NUMERIC_COLS = ['quantity', 'price', 'gross_amount', 'net_amount']
 LIST_SORT_COLS = ['settlement_date', 'account_type', 'activity_type', 'symbol', 'net_amount']
 LIST_SORT_ORDERS = [True, True, False, True, False]
 
 local_tz = pytz.timezone("America/Toronto")
 FORMAT_DATE = '%Y-%m-%d'
 
+MAX_IN_FLIGHT_REQUESTS = 8
+REQUEST_TIMEOUT = 20
 
+# The activities endpoint rejects ranges longer than 31 days
+MAX_ACTIVITY_WINDOW_DAYS = 30
+
+TOKEN_REFRESH_MARGIN_SECONDS = 120
+TOKEN_LOCK_TIMEOUT_SECONDS = 60
+
+CLIENT = None
+CLIENT_LOCK = threading.Lock()
+TRADE_INDEX = None
+STORED_TRADE_INDEX = None
+STORED_TRADE_INDEX_VERSION = None
+# The token CLIENT is logged in with, so hot loops can check its expiry without the token file
+SESSION_TOKEN = None
+# An access token the API rejected (401) before it expired; never reused from the token cache
+REJECTED_ACCESS_TOKEN = None
+
+
+class QuestradeClient:
+    '''
+    Questrade REST client on one keep-alive session. Per-account calls are fanned out on a
+    thread pool sized to max_in_flight, which also caps the open connections. A re-login swaps
+    the token in place (set_token), so calls in flight on other threads are never cut off.
+    '''
+
+    def __init__(self, api_server, access_token, max_in_flight=MAX_IN_FLIGHT_REQUESTS):
+        self.set_token(api_server, access_token)
+        self.session = requests.Session()
+
+        mount_transport(self.session, pool_maxsize=max_in_flight)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='questrade')
+
+    def set_token(self, api_server, access_token):
+        # One tuple, replaced in a single assignment, so a request never pairs a server with another login's token
+        self.auth = (api_server, {'Authorization': f'Bearer {access_token}'})
+
+    @property
+    def api_server(self):
+        return self.auth[0]
+
+    def get(self, path, params=None):
+        api_server, dict_headers = self.auth
+        response = self.session.get(f'{api_server}{path}', params=params, headers=dict_headers, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def get_account_data(self):
+        return self.get(URL_ACCOUNTS)
+
+    def get_balance(self, acc_no):
+        return self.get(f'{URL_ACCOUNTS}/{acc_no}/balances')
+
+    def get_positions(self, acc_no):
+        return self.get(f'{URL_ACCOUNTS}/{acc_no}/positions')
+
+    def get_account_activities(self, acc_no, start_time, end_time):
+        return self.get(f'{URL_ACCOUNTS}/{acc_no}/activities', params={"startTime": start_time, "endTime": end_time})
+
+    def fan_out(self, fn, dict_args):
+        '''Run fn(*args) for every key of {key: args} concurrently; results keep the input order.'''
+        dict_futures = {key: self.executor.submit(fn, *args) for key, args in dict_args.items()}
+        return {key: future.result() for key, future in dict_futures.items()}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+@timed()
 def init_server(token):
-    global API_SERVER, headers
-    # Step 1: Get access token and API server
-    dict_token_data = get_access_token(refresh_token=token)
+    global API_SERVER, headers, CLIENT, SESSION_TOKEN
+    # Step 1: Get access token and API server (reused from the token cache while valid)
+    dict_token_data = get_token_data(refresh_token=token)
     API_SERVER = dict_token_data['api_server']
     access_token = dict_token_data['access_token']
     refresh_token = dict_token_data['refresh_token']
     
     headers = {'Authorization': f'Bearer {access_token}'}
 
+    with CLIENT_LOCK:
+        if CLIENT is None:
+            CLIENT = QuestradeClient(API_SERVER, access_token)
+        else:
+            CLIENT.set_token(API_SERVER, access_token)
+        SESSION_TOKEN = dict_token_data
+
     return refresh_token
 
 
-def get_fx_rate(curr_from='USD', curr_to='CAD'):
-    """Fetches the latest USD to CAD exchange rate using the Frankfurter API (no key needed)."""
-    
-    url = f"{URL_FX_FRANKFURTER}?from={curr_from}&to={curr_to}"
-    
-    try:
-        response = requests.get(url)
-        response.raise_for_status() 
-        data = response.json()
-        
-        cad_rate = data['rates'].get('CAD')
-        
-        if cad_rate:
-            return cad_rate
-        else:
-            print("Error: CAD rate not found in response.")
-            return 1.40
+def is_session_expiring(margin=TOKEN_REFRESH_MARGIN_SECONDS):
+    '''Whether CLIENT's token is missing or within margin of expiry; reads neither the token file nor any lock.'''
+    return not is_token_valid(SESSION_TOKEN, margin)
+
 
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred during the API request: {e}")
-        return 1.40
+def reject_session_token():
+    '''After a 401: the next login must redeem the refresh token rather than reuse the cached access token.'''
+    global SESSION_TOKEN, REJECTED_ACCESS_TOKEN
+    if SESSION_TOKEN is not None:
+        REJECTED_ACCESS_TOKEN = SESSION_TOKEN['access_token']
+    SESSION_TOKEN = None
 
 
 def get_access_token(refresh_token=None):
@@ -124,13 +229,13 @@ def get_access_token(refresh_token=None):
         with open(PATH_REFRESH_TOKEN_FILE, 'r') as file:
             refresh_token = file.read()
 
-    url = f'{URL_ACCESS_TOKEN}{refresh_token}'
+    url = f"{get_base_url('questrade_login', URL_QUESTRADE_LOGIN)}/{URL_ACCESS_TOKEN}{refresh_token}"
 
     headers_access = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
     }
 
-    response = requests.get(
+    response = get_session().get(
         url,
         # headers=headers_access,
         timeout=20,
@@ -150,40 +255,173 @@ def get_access_token(refresh_token=None):
     return dict_token_data  # Contains access_token, api_server, token_type, expires_in, refresh_token
 
 
-def get_account_data():
-    '''Fetch account information.'''
+def get_token_cache():
+    '''(file path, shared cache key) of the token cache for the Questrade login in use.'''
+    if is_live_service('questrade_login'):
+        return PATH_TOKEN_CACHE, 'questrade'
 
-    url = f'{API_SERVER}{URL_ACCOUNTS}'
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    response = response.json()
+    return PATH_TOKEN_CACHE_OFFLINE, 'questrade_offline'
 
-    return response
+
+def load_cached_token():
+    '''The token cache file, or the shared cache's copy when it is newer (another host refreshed).'''
+    path_token_cache, cache_key = get_token_cache()
+    dict_token_data = None
+    if os.path.exists(path_token_cache):
+        try:
+            with open(path_token_cache, 'r') as file:
+                dict_token_data = json.load(file)
+        except (OSError, ValueError):
+            pass
+
+    if is_token_valid(dict_token_data):
+        return dict_token_data
+
+    dict_shared = cache_get('token', cache_key)
+    if dict_shared and dict_shared.get('expires_at', 0) > (dict_token_data or {}).get('expires_at', 0):
+        return dict_shared
+
+    return dict_token_data
+
+
+def save_cached_token(dict_token_data):
+    path_token_cache, cache_key = get_token_cache()
+    os.makedirs(os.path.dirname(path_token_cache), exist_ok=True)
+    path_tmp = f'{path_token_cache}.{os.getpid()}.tmp'
+
+    fd = os.open(path_tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as file:
+        json.dump(dict_token_data, file)
+    os.replace(path_tmp, path_token_cache)
+
+    ttl = dict_token_data.get('expires_at', 0) - time.time()
+    if ttl > 0:
+        cache_set('token', cache_key, dict_token_data, ttl=ttl)
+
+
+def is_token_valid(dict_token_data, margin=TOKEN_REFRESH_MARGIN_SECONDS):
+    return (
+        bool(dict_token_data)
+        and dict_token_data.get('access_token') != REJECTED_ACCESS_TOKEN
+        and time.time() < dict_token_data.get('expires_at', 0) - margin
+    )
+
+
+class TokenLock:
+    '''
+    Cross-process lock around token refresh: an O_EXCL lock file next to the cache. Questrade
+    refresh tokens are single use, so two processes must never redeem the same one.
+    '''
+
+    def __init__(self, path=None, timeout=TOKEN_LOCK_TIMEOUT_SECONDS):
+        self.path = path or f'{get_token_cache()[0]}.lock'
+        self.timeout = timeout
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        deadline = time.time() + self.timeout
+
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+                return self
+            except FileExistsError:
+                # A holder that died mid-refresh leaves the file behind
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.timeout:
+                        os.remove(self.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+
+                if time.time() > deadline:
+                    raise TimeoutError(f'Timed out waiting for token lock {self.path}')
+                time.sleep(0.1)
+
+    def __exit__(self, *exc_info):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def get_token_data(refresh_token=None):
+    '''
+    Access token, API server and refresh token, refreshed only within
+    TOKEN_REFRESH_MARGIN_SECONDS of expiry.
+    '''
+    global REJECTED_ACCESS_TOKEN
+    dict_token_data = load_cached_token()
+    if is_token_valid(dict_token_data):
+        return dict_token_data
+
+    # The shared lock extends the lock file to processes on other hosts using the same cache
+    with TokenLock(), shared_lock(f'{get_token_cache()[1]}_token'):
+        # Another process may have refreshed while we waited for the lock
+        dict_cached = load_cached_token()
+        if is_token_valid(dict_cached):
+            return dict_cached
+
+        # The caller's token (from Sheets) is normally the newest; the cached one covers a run
+        # that rotated the token but died before writing it back
+        list_refresh_tokens = [token for token in [refresh_token, (dict_cached or {}).get('refresh_token')] if token]
+        if not list_refresh_tokens:
+            list_refresh_tokens = [None]
+
+        for i, token in enumerate(list_refresh_tokens):
+            try:
+                dict_token_data = get_access_token(refresh_token=token)
+                break
+            except requests.exceptions.HTTPError:
+                if i == len(list_refresh_tokens) - 1:
+                    raise
+
+        dict_token_data['expires_at'] = time.time() + float(dict_token_data.get('expires_in', 0))
+        save_cached_token(dict_token_data)
+        # A token just issued supersedes any rejection
+        REJECTED_ACCESS_TOKEN = None
+
+    return dict_token_data
+
+
+def get_account_data():
+    '''Fetch account information.'''
+    return CLIENT.get_account_data()
 
 
 def get_balance(acc_no):
     '''Fetch account balance.'''
-    url = f'{API_SERVER}{URL_ACCOUNTS}/{acc_no}/balances'
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return CLIENT.get_balance(acc_no)
 
 
 def get_positions(acc_no):
     '''Fetch account positions.'''
-    url = f'{API_SERVER}{URL_ACCOUNTS}/{acc_no}/positions'
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    return CLIENT.get_positions(acc_no)
 
 
 def search_symbol(symbol):
     '''Search for a symbol.'''
-    url = f'{API_SERVER}v1/symbols/search?prefix={symbol}'
-    print(url)
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    print(f'{API_SERVER}v1/symbols/search?prefix={symbol}')
+    return CLIENT.get('v1/symbols/search', params={'prefix': symbol})
+
+
+def get_symbol_ids(symbols):
+    '''{symbol: Questrade symbolId} for exact matches, searched concurrently.'''
+    dict_results = CLIENT.fan_out(lambda symbol: CLIENT.get(URL_SYMBOL_SEARCH, params={'prefix': symbol}), {symbol: (symbol,) for symbol in symbols})
+
+    dict_symbol_ids = dict()
+    for symbol, response in dict_results.items():
+        list_matches = [match for match in response['symbols'] if match['symbol'] == symbol]
+        if not list_matches:
+            raise KeyError(f'Symbol not found on Questrade: {symbol}')
+        dict_symbol_ids[symbol] = list_matches[0]['symbolId']
+
+    return dict_symbol_ids
+
+
+def get_quotes(list_symbol_ids):
+    '''Level 1 quotes for many symbols in one request.'''
+    return CLIENT.get(URL_QUOTES, params={'ids': ','.join(str(symbol_id) for symbol_id in list_symbol_ids)})['quotes']
 
 
 def get_acc_nos(dict_acc_info, list_type_accs=LIST_ACC_TYPES):
@@ -197,39 +435,56 @@ def get_acc_nos(dict_acc_info, list_type_accs=LIST_ACC_TYPES):
     return dict_acc_no
     
 
-def get_acc_balances(dict_acc_info=None, list_type_accs=LIST_ACC_TYPES, list_acc_nos=None):
-
-    dict_acc_balances = dict()
-
+def get_acc_keys(dict_acc_info=None, list_type_accs=LIST_ACC_TYPES, list_acc_nos=None):
+    '''{result key: (acc_no,)} keyed by account type when account info is given, else by account number.'''
     if dict_acc_info and list_type_accs:
-        dict_acc_nos = get_acc_nos(dict_acc_info, list_type_accs)
-    
-        for acc_type, acc_no in dict_acc_nos.items():
-            balances = get_balance(acc_no)
-            dict_acc_balances[acc_type] = balances
+        return {acc_type: (acc_no,) for acc_type, acc_no in get_acc_nos(dict_acc_info, list_type_accs).items()}
     elif list_acc_nos:
-        for acc_no in list_acc_nos:
-            balances = get_balance(acc_no)
-            dict_acc_balances[acc_no] = balances
+        return {acc_no: (acc_no,) for acc_no in list_acc_nos}
+
+    return dict()
+
+
+def fan_out_cached(kind, fn, dict_acc_keys):
+    '''CLIENT.fan_out for per-account responses, answering accounts fetched within the kind's TTL from the cache.'''
+    dict_cached = cache_get_many(kind, [args[0] for args in dict_acc_keys.values()])
+    dict_missing = {key: args for key, args in dict_acc_keys.items() if args[0] not in dict_cached}
+
+    dict_fetched = CLIENT.fan_out(fn, dict_missing)
+    cache_set_many(kind, {dict_acc_keys[key][0]: response for key, response in dict_fetched.items()})
+
+    return {key: dict_fetched[key] if key in dict_fetched else dict_cached[args[0]] for key, args in dict_acc_keys.items()}
 
-    return dict_acc_balances
+
+def get_acc_balances(dict_acc_info=None, list_type_accs=LIST_ACC_TYPES, list_acc_nos=None):
+    dict_acc_keys = get_acc_keys(dict_acc_info, list_type_accs, list_acc_nos)
+    return fan_out_cached('balances', CLIENT.get_balance, dict_acc_keys)
 
 
 def get_acc_positions(dict_acc_info=None, list_type_accs=LIST_ACC_TYPES, list_acc_nos=None):
-    dict_acc_positions = dict()
+    dict_acc_keys = get_acc_keys(dict_acc_info, list_type_accs, list_acc_nos)
+    return fan_out_cached('positions', CLIENT.get_positions, dict_acc_keys)
 
-    if dict_acc_info and list_type_accs:
-        dict_acc_nos = get_acc_nos(dict_acc_info, list_type_accs)
-    
-        for acc_type, acc_no in dict_acc_nos.items():
-            positions = get_positions(acc_no)
-            dict_acc_positions[acc_type] = positions
-    elif list_acc_nos:
-        for acc_no in list_acc_nos:
-            positions = get_positions(acc_no)
-            dict_acc_positions[acc_no] = positions
 
-    return dict_acc_positions
+def get_activity_windows(from_time, to_time, max_days=MAX_ACTIVITY_WINDOW_DAYS):
+    '''Consecutive, non-overlapping (start, end) ranges covering [from_time, to_time] that the API accepts.'''
+    list_windows = list()
+    start = from_time
+
+    while start < to_time:
+        end = min(start + timedelta(days=max_days), to_time)
+        list_windows.append((start, end))
+        start = end + timedelta(seconds=1)
+
+    return list_windows
+
+
+def tag_activities(response, acc_type, acc_no):
+    for act in response['activities']:
+        act['accountNo'] = acc_no
+        act['accountType'] = f'Individual {acc_type}'
+
+    return response
 
 
 def get_activities(list_tickers, dict_acc_info=None, dict_acc_no=None, from_time=None, last_n_days=30):
@@ -246,30 +501,113 @@ def get_activities(list_tickers, dict_acc_info=None, dict_acc_no=None, from_time
 
     print(f'Fetching data from {from_time} to {now}')
 
-    start_time = from_time.isoformat()
-    end_time = now.isoformat()
+    # Long catch-ups are split into windows the endpoint accepts, fetched concurrently
+    list_windows = get_activity_windows(from_time, now)
 
-    params = {
-        "startTime": start_time,
-        "endTime": end_time
-    }
+    dict_window_act = CLIENT.fan_out(
+        CLIENT.get_account_activities,
+        {
+            (acc_type, i): (acc_no, start.isoformat(), end.isoformat())
+            for acc_type, acc_no in dict_acc_no.items()
+            for i, (start, end) in enumerate(list_windows)
+        },
+    )
 
     dict_acc_act = dict()
 
     for acc_type, acc_no in dict_acc_no.items():
-        url = f'{API_SERVER}{URL_ACCOUNTS}/{acc_no}/activities'
+        list_act = [act for i in range(len(list_windows)) for act in dict_window_act[(acc_type, i)]['activities']]
+        dict_acc_act[acc_type] = tag_activities({'activities': list_act}, acc_type, acc_no)
 
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        response = response.json()
+    return dict_acc_act
 
-        for act in response['activities']:
-            act['accountNo'] = acc_no
-            act['accountType'] = f'Individual {acc_type}'
 
-        dict_acc_act[acc_type] = response
+def load_backfill_checkpoint(from_time):
+    '''
+    {"acc_no|window start": window end fetched} from a previous run starting at from_time. Window
+    starts only depend on from_time, so the keys still line up when to_time has moved on.
+    '''
+    if not os.path.exists(PATH_BACKFILL_CHECKPOINT):
+        return dict()
 
-    return dict_acc_act
+    with open(PATH_BACKFILL_CHECKPOINT, 'r') as file:
+        dict_checkpoint = json.load(file)
+
+    if dict_checkpoint.get('from') != from_time.isoformat():
+        return dict()
+
+    dict_done = dict_checkpoint['done']
+    if isinstance(dict_done, list):
+        # Checkpoints written before window ends were saved covered the range up to 'to'
+        dict_done = {key: dict_checkpoint['to'] for key in dict_done}
+
+    return {key: datetime.fromisoformat(end) for key, end in dict_done.items()}
+
+
+def save_backfill_checkpoint(from_time, dict_done):
+    os.makedirs(os.path.dirname(PATH_BACKFILL_CHECKPOINT), exist_ok=True)
+    with open(f'{PATH_BACKFILL_CHECKPOINT}.tmp', 'w') as file:
+        json.dump({'from': from_time.isoformat(), 'done': {key: end.isoformat() for key, end in sorted(dict_done.items())}}, file)
+    os.replace(f'{PATH_BACKFILL_CHECKPOINT}.tmp', PATH_BACKFILL_CHECKPOINT)
+
+
+def backfill_activities(from_time, to_time=None, dict_acc_no=None):
+    '''
+    Fetch activities for every account over [from_time, to_time] in API-sized windows on the
+    client's bounded pool. Each window is deduplicated and appended to the ledger as soon as it
+    arrives, then checkpointed; re-running with the same from_time after a failure skips the
+    windows already written up to their current end. With to_time omitted (now), only the last
+    window is fetched again; the dedupe drops the rows it already had. from_time/to_time are
+    naive local times.
+    '''
+    if not ledger_exists() and os.path.exists(PATH_DATA_TRADES):
+        raise RuntimeError(f'Run migrate_trades_to_ledger() before backfilling into {PATH_DATA_LEDGER}')
+
+    if not dict_acc_no:
+        dict_acc_no = get_acc_nos(get_account_data())
+
+    from_time = local_tz.localize(from_time)
+    to_time = local_tz.localize(to_time) if to_time else datetime.now(local_tz).replace(microsecond=0)
+
+    dict_done = load_backfill_checkpoint(from_time)
+    dict_tasks = {
+        f'{acc_no}|{start.isoformat()}': (acc_type, acc_no, start, end)
+        for start, end in get_activity_windows(from_time, to_time)
+        for acc_type, acc_no in dict_acc_no.items()
+    }
+    n_windows = len(dict_tasks)
+    dict_tasks = {key: task for key, task in dict_tasks.items() if key not in dict_done or dict_done[key] < task[3]}
+    print(f'Backfilling {len(dict_tasks)} account windows from {from_time} to {to_time} ({n_windows - len(dict_tasks)} already done)')
+
+    dict_futures = {
+        CLIENT.executor.submit(CLIENT.get_account_activities, acc_no, start.isoformat(), end.isoformat()): key
+        for key, (acc_type, acc_no, start, end) in dict_tasks.items()
+    }
+
+    n_rows = 0
+    try:
+        # Ledger writes stay on this thread, in completion order
+        for future in as_completed(dict_futures):
+            key = dict_futures[future]
+            acc_type, acc_no, _, end = dict_tasks[key]
+
+            response = tag_activities(future.result(), acc_type, acc_no)
+            if response['activities']:
+                df_activities = preprocess_activities(response['activities'])
+                if ledger_exists():
+                    df_activities = get_new_trades(None, df_activities)
+                n_rows += append_trades(df_activities)
+
+            dict_done[key] = end
+            save_backfill_checkpoint(from_time, dict_done)
+    finally:
+        for future in dict_futures:
+            future.cancel()
+
+    global STORED_TRADE_INDEX
+    STORED_TRADE_INDEX = None
+
+    return n_rows
 
 
 def format_activities(dict_acc_act):
@@ -283,41 +621,106 @@ def format_activities(dict_acc_act):
     return dict_act_tickers
 
 
-def load_trades():
-    df_trades = pd.read_csv(PATH_DATA_TRADES)
+def read_trades_csv(path_csv=PATH_DATA_TRADES):
+    df_trades = pd.read_csv(path_csv)
     df_trades = df_trades[list(MAP_COL_TRADES.keys())]
     df_trades.rename(columns=MAP_COL_TRADES, inplace=True)
+
+    for col in LIST_DATE_COLS:
+        df_trades[col] = pd.to_datetime(df_trades[col], format='%Y-%m-%d %I:%M:%S %p')
+
+    return df_trades
+
+
+def apply_trade_schema(df_trades):
+    '''
+    Typed trades frame: datetime64 dates, categorical labels, float amounts and Int64 account
+    numbers, with missing values as NA rather than ''.
+    '''
+    df_trades = df_trades.replace('', None)
+
+    for col in df_trades.columns:
+        if col in LIST_DATE_COLS:
+            df_trades[col] = pd.to_datetime(df_trades[col], errors='coerce')
+        elif col in LIST_CATEGORY_COLS:
+            df_trades[col] = df_trades[col].astype('category')
+        elif col in LIST_NUMERIC_COLS:
+            df_trades[col] = pd.to_numeric(df_trades[col], errors='coerce').astype('float64')
+        elif col == 'account_no':
+            df_trades[col] = pd.to_numeric(df_trades[col], errors='coerce').astype('Int64')
+        elif col == 'description':
+            df_trades[col] = df_trades[col].astype('string')
+
+    return df_trades
+
+
+def load_trades(columns=None, start_month=None, end_month=None, filters=None, typed=False):
+    '''
+    Trades from the Parquet ledger when it has been migrated, else from the CSV. With the ledger,
+    columns, start_month/end_month ('YYYY-MM', inclusive) and filters are pushed down to the read.
+    typed=True returns the apply_trade_schema frame instead of string dates and '' fills.
+    '''
+    if ledger_exists():
+        df_trades = read_ledger(columns=columns, start_month=start_month, end_month=end_month, filters=filters)
+    else:
+        df_trades = read_trades_csv()
+        if columns:
+            df_trades = df_trades[list(columns)]
+
     df_trades.replace(MAP_REPLACE_SYMBOL, inplace=True)
     df_trades.replace({'Individual cash': 'Individual Cash'}, inplace=True)
-    df_trades.sort_values(
-        by=LIST_SORT_COLS,
-        ascending=LIST_SORT_ORDERS,
-        inplace=True,
-    )
+
+    list_sort_cols = [(col, order) for col, order in zip(LIST_SORT_COLS, LIST_SORT_ORDERS) if col in df_trades.columns]
+    if list_sort_cols:
+        df_trades.sort_values(
+            by=[col for col, _ in list_sort_cols],
+            ascending=[order for _, order in list_sort_cols],
+            inplace=True,
+        )
     df_trades.reset_index(inplace=True, drop=True)
-    df_trades.fillna('', inplace=True)
-    
+
+    latest_date = None
+    if 'settlement_date' in df_trades.columns:
+        latest_date = df_trades['settlement_date'].max().normalize() - BDay(1)
+
+    if typed:
+        return apply_trade_schema(df_trades), latest_date
+
     for col in LIST_DATE_COLS:
-        df_trades[col] = pd.to_datetime(df_trades[col], format='%Y-%m-%d %I:%M:%S %p').dt.strftime(FORMAT_DATE)
+        if col in df_trades.columns:
+            df_trades[col] = df_trades[col].dt.strftime(FORMAT_DATE)
 
-    latest_date = pd.to_datetime(df_trades['settlement_date'], format=FORMAT_DATE).max() - BDay(1)
+    df_trades.fillna('', inplace=True)
 
     return df_trades, latest_date
 
 
-def fetch_recent_activities(latest_date):
-    dict_acc_info = get_account_data()
-    dict_acc_no = get_acc_nos(dict_acc_info)
-    # dict_acc_balances = get_acc_balances(dict_acc_info)
-    dict_acc_act = get_activities(list_tickers=[], dict_acc_no=dict_acc_no, from_time=latest_date)
+def migrate_trades_to_ledger(path_csv=PATH_DATA_TRADES, overwrite=False):
+    '''One-shot conversion of the MAP_COL_TRADES CSV into the Parquet ledger.'''
+    if ledger_exists():
+        if not overwrite:
+            raise FileExistsError(f'Ledger already exists at {PATH_DATA_LEDGER}')
+        shutil.rmtree(PATH_DATA_LEDGER)
 
-    list_df_act = list()
-    
-    for acc_type in LIST_ACC_TYPES:
-        list_df_act.append(pd.DataFrame(dict_acc_act[acc_type]['activities']))
-    
-    df_activities = pd.concat(list_df_act)
-    df_activities = df_activities[list(MAP_COLS_ACTIVITIES.keys())]
+    df_trades = read_trades_csv(path_csv)
+    df_trades.replace(MAP_REPLACE_SYMBOL, inplace=True)
+    df_trades.replace({'Individual cash': 'Individual Cash'}, inplace=True)
+
+    n_rows = append_trades(df_trades)
+    print(f'Migrated {n_rows} trades from {path_csv} to {PATH_DATA_LEDGER}')
+
+    return n_rows
+
+
+def to_wall_time(series):
+    '''Parse Questrade ISO timestamps keeping their local wall time and dropping the offset.'''
+    series = series.astype('string').str.replace(r'(Z|[+-]\d{2}:?\d{2})$', '', regex=True)
+    return pd.to_datetime(series, format='%Y-%m-%dT%H:%M:%S.%f')
+
+
+def preprocess_activities(list_activities, typed=False):
+    '''Raw activity dicts (tagged with accountNo/accountType) -> MAP_COLS_ACTIVITIES trades frame.'''
+    df_activities = pd.DataFrame(list_activities, columns=list(MAP_COLS_ACTIVITIES.keys()))
     df_activities.rename(columns=MAP_COLS_ACTIVITIES, inplace=True)
     df_activities['account_no'] = df_activities['account_no'].astype('int')
     df_activities['description'] = df_activities['description'].str.replace(r'\s+', ' ', regex=True).str.strip()
@@ -328,52 +731,186 @@ def fetch_recent_activities(latest_date):
         inplace=True,
     )
     df_activities.reset_index(inplace=True, drop=True)
+
+    for col in LIST_DATE_COLS:
+        df_activities[col] = to_wall_time(df_activities[col])
+
+    if typed:
+        for col in LIST_DATE_COLS:
+            df_activities[col] = df_activities[col].dt.normalize()
+        return apply_trade_schema(df_activities)
+
     df_activities.fillna('', inplace=True)
-    
+
     for col in LIST_DATE_COLS:
-        df_activities[col] = pd.to_datetime(df_activities[col], format='%Y-%m-%dT%H:%M:%S.%f%z')
-        df_activities[col] = df_activities[col].apply(lambda x: x.replace(tzinfo=None) if pd.notnull(x) else x)
         df_activities[col] = df_activities[col].dt.strftime("%Y-%m-%d")
 
     return df_activities
 
 
-def update_trades(df_trades, df_activities):
+def fetch_recent_activities(latest_date, typed=False):
+    dict_acc_info = get_account_data()
+    dict_acc_no = get_acc_nos(dict_acc_info)
+    # dict_acc_balances = get_acc_balances(dict_acc_info)
+    dict_acc_act = get_activities(list_tickers=[], dict_acc_no=dict_acc_no, from_time=latest_date)
+
+    list_activities = list()
+
+    for acc_type in LIST_ACC_TYPES:
+        list_activities.extend(dict_acc_act[acc_type]['activities'])
+
+    return preprocess_activities(list_activities, typed=typed)
+
+
+def get_new_trades(df_trades, df_activities):
+    if ledger_exists():
+        # Deduplicate against the ledger's fingerprint index instead of merging with every row.
+        # Symbols are normalized first so fetched rows hash like the ledger's stored rows.
+        df_activities = df_activities.replace(MAP_REPLACE_SYMBOL).replace({'Individual cash': 'Individual Cash'})
+        return filter_new_trades(df_activities)
+
     key_cols = list(set(df_trades.columns) - {'transaction_date'})
 
     rows_to_add = df_activities.merge(df_trades[key_cols], on=key_cols, how="left", indicator=True)
     rows_to_add = rows_to_add[rows_to_add["_merge"] == "left_only"].drop(columns=["_merge"])
 
+    return rows_to_add
+
+
+def update_trades(df_trades, df_activities):
+    rows_to_add = get_new_trades(df_trades, df_activities)
+
     df_trades_updated = pd.concat([df_trades, rows_to_add], ignore_index=True)
     return df_trades_updated
 
 
-def get_trades(symbol, df_trades=None, account_type='', activity_type='', symbol_exact_match=False):
+def get_stored_trades_version():
+    '''Changes whenever the stored trades do: ledger parts are never rewritten, only added or compacted.'''
+    if ledger_exists():
+        return tuple(list_ledger_parts())
+    if os.path.exists(PATH_DATA_TRADES):
+        stat = os.stat(PATH_DATA_TRADES)
+        return stat.st_mtime_ns, stat.st_size
+
+    return None
+
+
+def get_trade_index(df_trades=None):
+    '''
+    The TradeIndex for df_trades, or for the stored trades when none is given. The last index is
+    kept, so repeated lookups on the same frame (or unchanged stored trades, e.g. updated by
+    another process) skip the reload and rebuild.
+    '''
+    global TRADE_INDEX, STORED_TRADE_INDEX, STORED_TRADE_INDEX_VERSION
+
     if df_trades is None or df_trades.shape[0] == 0:
-        df_trades, _ = load_trades()
+        version = get_stored_trades_version()
+        if STORED_TRADE_INDEX is None or version != STORED_TRADE_INDEX_VERSION:
+            df_trades, _ = load_trades()
+            STORED_TRADE_INDEX = TradeIndex(df_trades)
+            STORED_TRADE_INDEX_VERSION = version
+        return STORED_TRADE_INDEX
 
-    if symbol_exact_match:
-        df_filtered = df_trades[df_trades['symbol'] == symbol]
-    else:
-        df_filtered = df_trades[df_trades['symbol'].str.contains(symbol, case=False, na=False)]
+    if TRADE_INDEX is None or TRADE_INDEX.df_source is not df_trades:
+        TRADE_INDEX = TradeIndex(df_trades)
+
+    return TRADE_INDEX
 
-    if account_type:
-        df_filtered = df_filtered[df_filtered['account_type'].str.contains(account_type, case=False, na=False)]
 
-    if activity_type:
-        df_filtered = df_filtered[df_filtered['activity_type'].str.contains(activity_type, case=False, na=False)]
+def get_trades(symbol, df_trades=None, account_type='', activity_type='', symbol_exact_match=False):
+    trade_index = get_trade_index(df_trades)
+
+    positions = trade_index.query(
+        symbol,
+        account_type=account_type,
+        activity_type=activity_type,
+        symbol_exact_match=symbol_exact_match,
+    )
 
-    if df_filtered.shape[0] == 0:
+    if len(positions) == 0:
         msg = f'No activities found for symbol: {symbol}'
         if account_type:
             msg = f'{msg} in account: {account_type}'
 
         return msg
 
-    return df_filtered.reset_index(drop=True)
+    return trade_index.get_rows(positions)
 
 
-def save_updated_trades(df_trades_updated):
+def compare_trade_schemas(df_trades=None, n_repeat=5):
+    '''
+    Memory and best-of-n_repeat timings of common ledger operations on the legacy frame
+    (string dates, '' fills) against the apply_trade_schema frame.
+    '''
+    if df_trades is None:
+        df_trades, _ = load_trades()
+    df_typed = apply_trade_schema(df_trades)
+
+    key_cols = list(set(df_trades.columns) - {'transaction_date'})
+    symbol = df_trades['symbol'].mode().iloc[0]
+    cutoff = df_typed['settlement_date'].quantile(0.9)
+
+    dict_ops = {
+        'sort': (
+            lambda df: df.sort_values(by=LIST_SORT_COLS, ascending=LIST_SORT_ORDERS),
+            lambda df: df.sort_values(by=LIST_SORT_COLS, ascending=LIST_SORT_ORDERS),
+        ),
+        'merge_dedupe': (
+            lambda df: df.tail(1000).merge(df[key_cols], on=key_cols, how='left', indicator=True),
+            lambda df: df.tail(1000).merge(df[key_cols], on=key_cols, how='left', indicator=True),
+        ),
+        'filter_symbol': (
+            lambda df: df[df['symbol'] == symbol],
+            lambda df: df[df['symbol'] == symbol],
+        ),
+        'filter_recent': (
+            lambda df: df[pd.to_datetime(df['settlement_date'], format=FORMAT_DATE) >= cutoff],
+            lambda df: df[df['settlement_date'] >= cutoff],
+        ),
+        'net_by_symbol': (
+            lambda df: pd.to_numeric(df['net_amount'], errors='coerce').groupby(df['symbol']).sum(),
+            lambda df: df.groupby('symbol', observed=True)['net_amount'].sum(),
+        ),
+    }
+
+    def best_time(fn, df):
+        list_times = list()
+        for _ in range(n_repeat):
+            start = time.perf_counter()
+            fn(df)
+            list_times.append(time.perf_counter() - start)
+        return min(list_times)
+
+    list_rows = [{
+        'metric': 'memory_mb',
+        'legacy': df_trades.memory_usage(deep=True).sum() / 2 ** 20,
+        'typed': df_typed.memory_usage(deep=True).sum() / 2 ** 20,
+    }]
+    for name, (fn_legacy, fn_typed) in dict_ops.items():
+        list_rows.append({'metric': f'{name}_ms', 'legacy': best_time(fn_legacy, df_trades) * 1e3, 'typed': best_time(fn_typed, df_typed) * 1e3})
+
+    df_comparison = pd.DataFrame(list_rows)
+    df_comparison['legacy_over_typed'] = df_comparison['legacy'] / df_comparison['typed']
+
+    return df_comparison
+
+
+def save_updated_trades(df_trades_updated, df_rows_to_add=None):
+    '''
+    With the ledger, only the new rows are appended (found against the ledger when
+    df_rows_to_add is not given). Without it, a dated copy of the CSV is written.
+    '''
+    global STORED_TRADE_INDEX
+    STORED_TRADE_INDEX = None
+
+    if ledger_exists():
+        if df_rows_to_add is None:
+            df_trades, _ = load_trades()
+            df_rows_to_add = get_new_trades(df_trades, df_trades_updated)
+
+        append_trades(df_rows_to_add)
+        return
+
     cur_date = datetime.now().strftime("%Y%m%d")
     path_cur_date = f'{PATH_DATA_TRADES}_{cur_date}.csv'
     df_trades_updated.to_csv(path_cur_date)
@@ -407,16 +944,16 @@ def preprocess_acc_positions(dict_acc_positions, combine_accounts):
     return df_positions
 
 
-def get_acc_pos_df(combine_accounts=False):
-    dict_acc_info = get_account_data()
+def get_acc_pos_df(combine_accounts=False, dict_acc_info=None):
+    dict_acc_info = dict_acc_info or get_account_data()
     dict_acc_positions = get_acc_positions(dict_acc_info)
     df_positions = preprocess_acc_positions(dict_acc_positions, combine_accounts=combine_accounts)
 
     return df_positions
 
 
+@timed()
 def get_qqq_pos_and_bal(acc_no):
-    dict_acc_info = get_account_data()
     dict_acc_balances = get_acc_balances(list_acc_nos=[acc_no])
     dict_acc_positions = get_acc_positions(list_acc_nos=[acc_no])
     df_positions = preprocess_acc_positions(dict_acc_positions, combine_accounts=False)
@@ -431,3 +968,29 @@ def get_qqq_pos_and_bal(acc_no):
     n_tqqq = float(df_tqqq['openQuantity'].iloc[0] if len(df_tqqq) > 0 else 0)
 
     return BAL_USD, n_sqqq, n_tqqq
+
+
+@timed()
+def get_pos_and_bal_many(list_acc_nos, tickers):
+    '''{acc_no: (USD cash, {ticker: open quantity})}; each request type goes to every account concurrently.'''
+    dict_acc_balances = get_acc_balances(list_acc_nos=list_acc_nos)
+    dict_acc_positions = get_acc_positions(list_acc_nos=list_acc_nos)
+
+    dict_pos_and_bal = dict()
+    for acc_no in list_acc_nos:
+        df_acc_balances = pd.DataFrame(dict_acc_balances[acc_no]['perCurrencyBalances'])
+        BAL_USD = float(df_acc_balances[df_acc_balances['currency'] == 'USD']['cash'].iloc[0])
+
+        dict_shares = {ticker: 0.0 for ticker in tickers}
+        for position in dict_acc_positions[acc_no]['positions']:
+            if position['symbol'] in dict_shares:
+                dict_shares[position['symbol']] = float(position['openQuantity'])
+
+        dict_pos_and_bal[acc_no] = (BAL_USD, dict_shares)
+
+    return dict_pos_and_bal
+
+
+def get_pos_and_bal(acc_no, tickers):
+    '''USD cash and {ticker: open quantity} for the given tickers in one account.'''
+    return get_pos_and_bal_many([acc_no], tickers)[acc_no]
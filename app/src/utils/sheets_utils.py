@@ -1,7 +1,7 @@
 import os
 import json
-import gspread
-from google.oauth2.service_account import Credentials
+
+from app.src.utils.metrics_utils import timed
 
 # PATH_SERVICE_ACCOUNT_FILE = '../../configs/creds_gcp_qt.json'
 # PATH_CONFIG = '../../configs/api_keys.json'
@@ -18,13 +18,29 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive',
 ]
 
+PATH_SHEET_CACHE = 'data/sheet_cache.json'
+
+# Cells in the holdings sheet holding bot configuration
+CONFIG_CELLS = {
+    'refresh_token': 'B1',
+    'acc_no': 'C1',
+}
+
 SHEET_HOLDINGS = None
 WORKBOOK = None
 
+# {cache key: grid} as last written to the sheet
+DICT_LAST_GRID = None
+
 
+@timed('sheets_auth')
 def init_workbook():
     global SHEET_HOLDINGS
 
+    # gspread and google-auth take ~0.1s to import, so they load on first use
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     info = json.loads(os.getenv('SERVICE_ACCOUNT_JSON'))
     creds = Credentials.from_service_account_info(
         info, 
@@ -39,14 +55,21 @@ def init_workbook():
     SHEET_HOLDINGS = WORKBOOK.worksheet('holdings')
 
 
-def get_qt_token_from_sheet(cell='B1'):
+@timed('sheets_read')
+def get_config_cells(cells=CONFIG_CELLS):
+    '''{name: value} for every cell in cells, read in one batch get.'''
     if not SHEET_HOLDINGS:
         init_workbook()
 
-    qt_token = SHEET_HOLDINGS.acell(cell).value
-    return qt_token
+    list_ranges = SHEET_HOLDINGS.batch_get(list(cells.values()))
+    return {name: (values[0][0] if values and values[0] else None) for name, values in zip(cells, list_ranges)}
+
+
+def get_qt_token_from_sheet(cell='B1'):
+    return get_config_cells({cell: cell})[cell]
 
 
+@timed('sheets_write')
 def update_qt_token_in_sheet(refresh_token, cell='B1'):
     if not SHEET_HOLDINGS:
         init_workbook()
@@ -54,14 +77,99 @@ def update_qt_token_in_sheet(refresh_token, cell='B1'):
     SHEET_HOLDINGS.update_acell(cell, refresh_token)
 
 
-def update_sheets_with_data(df_positions, cell='A3'):
+def to_grid(df):
+    '''Header plus rows as JSON-safe Python values, with missing values as blank cells.'''
+    df_values = df.astype(object).where(df.notna(), '')
+    return [[str(col) for col in df.columns]] + df_values.values.tolist()
+
+
+def get_changed_ranges(old_grid, new_grid, cell='A3'):
+    '''
+    A1 ranges and values covering every cell that differs between two grids anchored at cell,
+    one range per run of adjacent changed cells in a row. Cells the new grid no longer covers
+    are blanked.
+    '''
+    from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+    row_0, col_0 = a1_to_rowcol(cell)
+    n_rows = max(len(old_grid), len(new_grid))
+    n_cols = max([len(row) for row in old_grid + new_grid] or [0])
+
+    list_ranges = list()
+    for i in range(n_rows):
+        old_row = old_grid[i] if i < len(old_grid) else []
+        new_row = new_grid[i] if i < len(new_grid) else []
+        old_row = old_row + [''] * (n_cols - len(old_row))
+        new_row = new_row + [''] * (n_cols - len(new_row))
+
+        j = 0
+        while j < n_cols:
+            if old_row[j] == new_row[j]:
+                j += 1
+                continue
+
+            j_start = j
+            while j < n_cols and old_row[j] != new_row[j]:
+                j += 1
+
+            list_ranges.append({
+                'range': f'{rowcol_to_a1(row_0 + i, col_0 + j_start)}:{rowcol_to_a1(row_0 + i, col_0 + j - 1)}',
+                'values': [new_row[j_start:j]],
+            })
+
+    return list_ranges
+
+
+def get_grid_cache_key(cell):
+    return f'{WORKBOOK_ID}|{SHEET_HOLDINGS.title}|{cell}'
+
+
+def load_last_grids():
+    global DICT_LAST_GRID
+
+    if DICT_LAST_GRID is None:
+        DICT_LAST_GRID = dict()
+        if os.path.exists(PATH_SHEET_CACHE):
+            with open(PATH_SHEET_CACHE, 'r') as file:
+                DICT_LAST_GRID = json.load(file)
+
+    return DICT_LAST_GRID
+
+
+def save_last_grid(key, grid):
+    dict_last_grid = load_last_grids()
+    dict_last_grid[key] = grid
+
+    os.makedirs(os.path.dirname(PATH_SHEET_CACHE), exist_ok=True)
+    with open(f'{PATH_SHEET_CACHE}.tmp', 'w') as file:
+        json.dump(dict_last_grid, file)
+    os.replace(f'{PATH_SHEET_CACHE}.tmp', PATH_SHEET_CACHE)
+
 
+@timed('sheets_write')
+def update_sheets_with_data(df_positions, cell='A3', force=False):
+    '''
+    Write df_positions at cell, sending only the cells that changed since the last write from
+    this machine, in a single batch update. The first write, or force=True (e.g. after manual
+    edits to the sheet), rewrites the whole grid.
+    '''
     if not SHEET_HOLDINGS:
         init_workbook()
 
     try:
-        output_data = [df_positions.columns.values.tolist()] + df_positions.values.tolist()
-        SHEET_HOLDINGS.update(cell, output_data)
+        output_data = to_grid(df_positions)
+        key = get_grid_cache_key(cell)
+        last_grid = None if force else load_last_grids().get(key)
+
+        if last_grid is None:
+            SHEET_HOLDINGS.update(cell, output_data)
+        else:
+            list_ranges = get_changed_ranges(last_grid, output_data, cell)
+            if not list_ranges:
+                return "Success: Sheet unchanged", 200
+            SHEET_HOLDINGS.batch_update(list_ranges)
+
+        save_last_grid(key, output_data)
         return "Success: Sheet updated!", 200
     except Exception as e:
         return f"Sheets Error: {str(e)}", 500
@@ -0,0 +1,519 @@
+import os
+import math
+
+import numpy as np
+import pandas as pd
+
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from app.src.utils.market_data_utils import get_ohlcv_batch
+from app.src.utils.metrics_utils import timed
+from app.src.utils.indicator_utils import (
+    INDICATOR_COLS,
+    compute_indicator_array,
+    load_indicator_state,
+    save_indicator_state,
+    sync_indicator_state,
+)
+
+
+# --- 1. CONFIGURATION ---
+
+RISK_PERCENTAGE_PER_TRADE = 1  # 1.0 = 100% of capital considered for risk sizing
+DAILY_PRICE_DROP_EXIT_PCT = 0.05
+
+N_PERIOD = 14
+EMA_FAST_PERIOD = 50
+EMA_SLOW_PERIOD = 250
+
+EMA_BULLISH_THRESHOLD = 1.05
+EMA_BEARISH_THRESHOLD = 0.95
+
+NEUTRAL_RSI_MIN = 30
+NEUTRAL_RSI_MAX = 60
+OVERBOUGHT_RSI = 70
+
+TICKERS = ["QQQ", "TQQQ", "SQQQ"]
+TRANSACTION_COST = 0.00
+
+# Leveraged pairs traded off their underlying's signal. Equity is split by 'weight'
+# (default: equally across the universe).
+BASE_PAIR = {'underlying': 'QQQ', 'bull': 'TQQQ', 'bear': 'SQQQ'}
+EXTRA_PAIRS = {
+    'SPY': {'underlying': 'SPY', 'bull': 'UPRO', 'bear': 'SPXU'},
+    'SOXX': {'underlying': 'SOXX', 'bull': 'SOXL', 'bear': 'SOXS'},
+}
+
+
+def get_universe(extra_pairs=None):
+    '''
+    The QQQ pair plus the opt-in pairs named in extra_pairs (default: the UNIVERSE_EXTRA_PAIRS
+    env var), comma-separated, each a key of EXTRA_PAIRS or UNDERLYING:BULL:BEAR.
+    '''
+    extra_pairs = os.getenv('UNIVERSE_EXTRA_PAIRS', '') if extra_pairs is None else extra_pairs
+
+    universe = [BASE_PAIR]
+    for name in (name.strip() for name in extra_pairs.split(',')):
+        if not name:
+            continue
+        if name in EXTRA_PAIRS:
+            universe.append(EXTRA_PAIRS[name])
+        elif name.count(':') == 2:
+            underlying, bull, bear = name.split(':')
+            universe.append({'underlying': underlying, 'bull': bull, 'bear': bear})
+        else:
+            raise ValueError(f'Unknown pair {name!r} in UNIVERSE_EXTRA_PAIRS, expected one of {list(EXTRA_PAIRS)} or UNDERLYING:BULL:BEAR')
+
+    return universe
+
+
+UNIVERSE = get_universe()
+
+INDICATOR_PERIODS = {
+    'EMA_FAST': EMA_FAST_PERIOD,
+    'EMA_SLOW': EMA_SLOW_PERIOD,
+    'RSI': N_PERIOD,
+    'MACD_FAST': 12,
+    'MACD_SLOW': 26,
+    'MACD_SIGNAL': 9,
+    'ATR': 14,
+}
+
+STRATEGY_PARAMS = {
+    'RISK_PERCENTAGE_PER_TRADE': RISK_PERCENTAGE_PER_TRADE,
+    'DAILY_PRICE_DROP_EXIT_PCT': DAILY_PRICE_DROP_EXIT_PCT,
+    'EMA_BULLISH_THRESHOLD': EMA_BULLISH_THRESHOLD,
+    'EMA_BEARISH_THRESHOLD': EMA_BEARISH_THRESHOLD,
+    'NEUTRAL_RSI_MIN': NEUTRAL_RSI_MIN,
+    'NEUTRAL_RSI_MAX': NEUTRAL_RSI_MAX,
+    'OVERBOUGHT_RSI': OVERBOUGHT_RSI,
+    'TRANSACTION_COST': TRANSACTION_COST,
+}
+
+CORE_COLS = ['EMA_50', 'EMA_250', 'RSI', 'MACD', 'MACD_SIGNAL', 'ATR', 'Close_QQQ', 'Open_QQQ']
+
+SIGNAL_CASH = 0
+SIGNAL_TQQQ = 1
+SIGNAL_SQQQ = 2
+SIGNAL_LABELS = np.array(["CASH", "TQQQ", "SQQQ"])
+
+
+# --- 2. INDICATOR CALCULATION ---
+
+INDICATOR_BACKEND = 'numpy'  # 'numpy' (fused kernel) or 'pandas_ta' (reference)
+
+
+def calculate_indicators(df, n=N_PERIOD, backend=None):
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.droplevel(1)
+
+    if (backend or INDICATOR_BACKEND) == 'pandas_ta':
+        return calculate_indicators_pandas_ta(df, n=n)
+
+    df = df.drop(columns=[col for col in df.columns if 'Adj Close' in str(col) or 'Volume' in str(col)], errors='ignore')
+
+    # The kernel expects gap-free bars; rows without a close (outer-join holes) stay NaN
+    has_close = df['Close'].notna().to_numpy()
+    periods = {**INDICATOR_PERIODS, 'RSI': n}
+    values = np.full((len(df), len(INDICATOR_COLS)), np.nan)
+    values[has_close] = compute_indicator_array(
+        df['High'].to_numpy()[has_close], df['Low'].to_numpy()[has_close], df['Close'].to_numpy()[has_close], periods,
+    )
+
+    return pd.concat([df, pd.DataFrame(values, index=df.index, columns=INDICATOR_COLS)], axis=1)
+
+
+def calculate_indicators_pandas_ta(df, n=N_PERIOD):
+    '''Reference implementation on pandas_ta, imported lazily as it is slow to load.'''
+    import pandas_ta as ta
+
+    df.ta.ema(close='Close', length=EMA_FAST_PERIOD, append=True, adjust=False)
+    df.ta.ema(close='Close', length=EMA_SLOW_PERIOD, append=True, adjust=False)
+    df.ta.rsi(close='Close', length=n, append=True)
+    df.ta.macd(close='Close', append=True)
+    df.ta.atr(append=True)
+
+    df.rename(columns={
+        f'EMA_{EMA_FAST_PERIOD}': 'EMA_50',
+        f'EMA_{EMA_SLOW_PERIOD}': 'EMA_250',
+        f'RSI_{N_PERIOD}': 'RSI',
+        'MACD_12_26_9': 'MACD',
+        'MACDh_12_26_9': 'MACD_HIST',
+        'MACDs_12_26_9': 'MACD_SIGNAL',
+        'ATRr_14': 'ATR'}, inplace=True)
+
+    return df.drop(columns=[col for col in df.columns if 'Adj Close' in str(col) or 'Volume' in str(col)], errors='ignore')
+
+
+def check_indicator_parity(df, atol=1e-8):
+    '''Max absolute difference per indicator column between the numpy and pandas_ta backends.'''
+    df_numpy = calculate_indicators(df.copy(), backend='numpy')
+    df_reference = calculate_indicators(df.copy(), backend='pandas_ta')
+
+    max_abs_diff = (df_numpy[INDICATOR_COLS] - df_reference[INDICATOR_COLS]).abs().max()
+    mismatched_nans = (df_numpy[INDICATOR_COLS].isna() != df_reference[INDICATOR_COLS].isna()).sum()
+
+    if (max_abs_diff > atol).any() or mismatched_nans.any():
+        raise AssertionError(f'Indicator backends disagree:\n{max_abs_diff}\n{mismatched_nans}')
+
+    return max_abs_diff
+
+
+def get_latest_indicators(ticker, df_bars):
+    '''Indicators for the newest bar from the persisted streaming state, touching only unseen bars.'''
+    state = load_indicator_state(ticker)
+    state = sync_indicator_state(state, df_bars, INDICATOR_PERIODS)
+    save_indicator_state(ticker, state)
+
+    return state['latest']
+
+
+# --- 3. SIGNAL LOGIC ---
+
+def generate_signal(row):
+    if any(pd.isnull(row.get(col)) for col in CORE_COLS):
+        return "CASH"
+
+    close = row['Close_QQQ']
+    open_price = row['Open_QQQ']
+
+    # Stop Loss
+    if (close / open_price) <= (1 - DAILY_PRICE_DROP_EXIT_PCT):
+        return "CASH"
+
+    ema_50 = row['EMA_50']
+    ema_250 = row['EMA_250']
+    rsi_value = row['RSI']
+    macd = row['MACD']
+    macd_signal = row['MACD_SIGNAL']
+
+    ema_ratio = ema_50 / ema_250
+    macd_bullish = macd > macd_signal
+    macd_bearish = macd < macd_signal
+    is_neutral_zone = (NEUTRAL_RSI_MIN < rsi_value < NEUTRAL_RSI_MAX)
+    is_overbought_zone = (rsi_value > OVERBOUGHT_RSI)
+
+    if ema_ratio > EMA_BULLISH_THRESHOLD and is_neutral_zone and macd_bullish:
+        return "TQQQ"
+    elif ema_ratio < EMA_BEARISH_THRESHOLD and is_neutral_zone and macd_bearish:
+        return "SQQQ"
+    elif is_overbought_zone:
+        return "SQQQ"
+    else:
+        return "CASH"
+
+
+def generate_signals(df, params=None):
+    '''Vectorized generate_signal over every bar. Returns an array of SIGNAL_* codes.'''
+    params = {**STRATEGY_PARAMS, **(params or {})}
+
+    core = np.column_stack([np.asarray(df[col], dtype=float) for col in CORE_COLS])
+    ema_50, ema_250, rsi_value, macd, macd_signal, _, close, open_price = core.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stop_loss = (close / open_price) <= (1 - params['DAILY_PRICE_DROP_EXIT_PCT'])
+        ema_ratio = ema_50 / ema_250
+
+    is_neutral_zone = (params['NEUTRAL_RSI_MIN'] < rsi_value) & (rsi_value < params['NEUTRAL_RSI_MAX'])
+    is_overbought_zone = rsi_value > params['OVERBOUGHT_RSI']
+
+    is_bullish = (ema_ratio > params['EMA_BULLISH_THRESHOLD']) & is_neutral_zone & (macd > macd_signal)
+    is_bearish = (ema_ratio < params['EMA_BEARISH_THRESHOLD']) & is_neutral_zone & (macd < macd_signal)
+
+    return np.select(
+        [np.isnan(core).any(axis=1) | stop_loss, is_bullish, is_bearish | is_overbought_zone],
+        [SIGNAL_CASH, SIGNAL_TQQQ, SIGNAL_SQQQ],
+        default=SIGNAL_CASH,
+    )
+
+
+# --- 4. POSITION SIZING ---
+
+def calculate_position_size(row, capital_available, risk_pct, trade_ticker):
+    if trade_ticker == "CASH" or capital_available <= 0:
+        return 0.0
+
+    risk_amount = capital_available * risk_pct
+    atr_value = row['ATR']
+    if pd.isnull(atr_value) or atr_value == 0:
+        return 0.0
+
+    trade_price = row.get(f'Close_{trade_ticker}')
+    if pd.isnull(trade_price) or trade_price <= 0:
+        return 0.0
+
+    stop_loss_distance_per_share = 2 * atr_value
+    if stop_loss_distance_per_share <= 0:
+        return 0.0
+
+    shares_from_risk = risk_amount / stop_loss_distance_per_share
+    max_shares_from_capital = capital_available / (trade_price * (1 + TRANSACTION_COST))
+
+    position_size = math.floor(min(shares_from_risk, max_shares_from_capital)) # Use floor for whole shares
+    return position_size
+
+
+def calculate_position_sizes(df, capital_available, signals, params=None):
+    '''Vectorized calculate_position_size. capital_available is a scalar or one value per bar.'''
+    params = {**STRATEGY_PARAMS, **(params or {})}
+
+    signals = np.asarray(signals)
+    atr_value = np.asarray(df['ATR'], dtype=float)
+    capital_available = np.broadcast_to(np.asarray(capital_available, dtype=float), atr_value.shape)
+    trade_price = np.where(
+        signals == SIGNAL_TQQQ,
+        np.asarray(df['Close_TQQQ'], dtype=float),
+        np.asarray(df['Close_SQQQ'], dtype=float),
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        risk_amount = capital_available * params['RISK_PERCENTAGE_PER_TRADE']
+        stop_loss_distance_per_share = 2 * atr_value
+        shares_from_risk = risk_amount / stop_loss_distance_per_share
+        max_shares_from_capital = capital_available / (trade_price * (1 + params['TRANSACTION_COST']))
+        position_size = np.floor(np.minimum(shares_from_risk, max_shares_from_capital))
+
+    is_sized = (
+        (signals != SIGNAL_CASH)
+        & (capital_available > 0)
+        & ~np.isnan(atr_value) & (atr_value != 0)
+        & ~np.isnan(trade_price) & (trade_price > 0)
+        & (stop_loss_distance_per_share > 0)
+    )
+
+    return np.where(is_sized, position_size, 0.0)
+
+
+# --- 5. DATA & DELTA CALCULATION ---
+
+@timed()
+def fetch_price_data(tickers, start_date, end_date):
+    all_data = pd.DataFrame()
+    for ticker, df in get_ohlcv_batch(tickers, start_date, end_date).items():
+        if not df.empty:
+            df.columns = [f'{col}_{ticker}' for col in df.columns]
+            if all_data.empty: all_data = df
+            else: all_data = all_data.join(df, how='outer')
+
+    return all_data
+
+
+def build_strategy_frame(all_data):
+    '''QQQ indicators joined with the QQQ/TQQQ/SQQQ prices the signal and sizing rules read, one row per bar.'''
+    qqq_data = all_data.filter(like='_QQQ').copy()
+    qqq_data.columns = [col.replace('_QQQ', '') for col in qqq_data.columns]
+    df_strategy = calculate_indicators(qqq_data)
+
+    df_strategy['Close_TQQQ'] = all_data['Close_TQQQ']
+    df_strategy['Close_SQQQ'] = all_data['Close_SQQQ']
+    df_strategy['Close_QQQ'] = df_strategy['Close']
+    df_strategy['Open_QQQ'] = df_strategy['Open']
+
+    return df_strategy
+
+
+@timed('indicators')
+def build_latest_row(all_data, state_ticker='QQQ'):
+    '''
+    Last row of build_strategy_frame, with the QQQ indicators advanced incrementally. state_ticker
+    names the persisted indicator state when all_data is another pair in QQQ layout.
+    '''
+    qqq_data = all_data.filter(like='_QQQ').dropna(how='all')
+    qqq_data.columns = [col.replace('_QQQ', '') for col in qqq_data.columns]
+
+    latest_row = all_data.iloc[-1][['Close_TQQQ', 'Close_SQQQ']].copy()
+    if qqq_data.index[-1] == all_data.index[-1]:
+        for col in ['Open', 'High', 'Low', 'Close']:
+            latest_row[col] = qqq_data[col].iloc[-1]
+        for col, value in get_latest_indicators(state_ticker, qqq_data).items():
+            latest_row[col] = value
+        latest_row['Close_QQQ'] = latest_row['Close']
+        latest_row['Open_QQQ'] = latest_row['Open']
+
+    return latest_row
+
+
+def get_next_trading_day(last_data_date):
+    next_trading_day = last_data_date + timedelta(days=1)
+    while next_trading_day.weekday() >= 5:
+        next_trading_day += timedelta(days=1)
+
+    return next_trading_day
+
+
+@timed()
+def get_daily_delta(tickers, start_date, end_date, current_portfolio):
+    # 1. Fetch Data
+    all_data = fetch_price_data(tickers, start_date, end_date)
+
+    # 2. Process QQQ Indicators & 3. Create Analysis Row
+    latest_row = build_latest_row(all_data)
+    latest_price_tqqq = latest_row['Close_TQQQ']
+    latest_price_sqqq = latest_row['Close_SQQQ']
+
+    # 4. Generate Signal
+    daily_signal = generate_signal(latest_row)
+
+    # 5. Calculate Total Equity (USD)
+    # Equity = Cash + (SQQQ Shares * SQQQ Price) + (TQQQ Shares * TQQQ Price)
+    equity_usd = current_portfolio["CASH_USD"] + \
+                 (current_portfolio["SQQQ_SHARES"] * latest_price_sqqq) + \
+                 (current_portfolio["TQQQ_SHARES"] * latest_price_tqqq)
+
+    # 6. Calculate Target Holdings
+    target_tqqq = 0
+    target_sqqq = 0
+
+    if daily_signal == "TQQQ":
+        target_tqqq = calculate_position_size(latest_row, equity_usd, RISK_PERCENTAGE_PER_TRADE, "TQQQ")
+    elif daily_signal == "SQQQ":
+        target_sqqq = calculate_position_size(latest_row, equity_usd, RISK_PERCENTAGE_PER_TRADE, "SQQQ")
+
+    # 7. Calculate Deltas
+    delta_tqqq = target_tqqq - current_portfolio["TQQQ_SHARES"]
+    delta_sqqq = target_sqqq - current_portfolio["SQQQ_SHARES"]
+
+    # Date Logic
+    next_trading_day = get_next_trading_day(latest_row.name)
+
+    return {
+        "date": next_trading_day.strftime('%Y-%m-%d'),
+        "signal": daily_signal,
+        "equity": equity_usd,
+        "prices": {"TQQQ": latest_price_tqqq, "SQQQ": latest_price_sqqq},
+        "target": {"TQQQ": target_tqqq, "SQQQ": target_sqqq},
+        "delta": {"TQQQ": delta_tqqq, "SQQQ": delta_sqqq}
+    }
+
+
+# --- 6. MULTI-PAIR UNIVERSE ---
+
+def get_universe_tickers(universe=UNIVERSE):
+    return list(dict.fromkeys(pair[key] for pair in universe for key in ['underlying', 'bull', 'bear']))
+
+
+def to_pair_frame(all_data, pair):
+    '''A pair's columns from all_data renamed to the QQQ/TQQQ/SQQQ layout the signal and sizing rules read.'''
+    map_layout = {pair['underlying']: 'QQQ', pair['bull']: 'TQQQ', pair['bear']: 'SQQQ'}
+
+    list_cols = [col for col in all_data.columns if col.rsplit('_', 1)[-1] in map_layout]
+    df_pair = all_data[list_cols].dropna(how='all')
+    df_pair.columns = [f'{col.rsplit("_", 1)[0]}_{map_layout[col.rsplit("_", 1)[-1]]}' for col in list_cols]
+
+    return df_pair
+
+
+def get_pair_latest_row(pair, df_pair):
+    '''Latest strategy row for one pair, advancing its underlying's indicator state.'''
+    return build_latest_row(df_pair, state_ticker=pair['underlying'])
+
+
+@timed('indicators')
+def get_universe_latest_rows(all_data, universe=UNIVERSE, n_workers=None):
+    '''
+    {underlying: latest row in QQQ layout}, one pair per thread. With synced indicator state each
+    pair is O(1), so threads (which also share the cache tier) beat forking worker processes.
+    '''
+    list_pair_frames = [to_pair_frame(all_data, pair) for pair in universe]
+
+    with ThreadPoolExecutor(max_workers=n_workers or len(universe), thread_name_prefix='indicators') as executor:
+        list_rows = list(executor.map(get_pair_latest_row, universe, list_pair_frames))
+
+    return {pair['underlying']: row for pair, row in zip(universe, list_rows)}
+
+
+@timed()
+def get_universe_signals(start_date, end_date, universe=UNIVERSE, n_workers=None):
+    '''
+    The market half of get_universe_deltas, which needs no account data: one batched price
+    download, indicators on a thread pool and the signal per pair.
+    '''
+    all_data = fetch_price_data(get_universe_tickers(universe), start_date, end_date)
+    dict_rows = get_universe_latest_rows(all_data, universe, n_workers)
+    list_rows = [dict_rows[pair['underlying']] for pair in universe]
+
+    df_latest = pd.DataFrame({col: [row.get(col, np.nan) for row in list_rows] for col in CORE_COLS + ['Close_TQQQ', 'Close_SQQQ']})
+    signals = generate_signals(df_latest)
+
+    dict_prices = dict()
+    for pair, row in zip(universe, list_rows):
+        dict_prices[pair['bull']] = row['Close_TQQQ']
+        dict_prices[pair['bear']] = row['Close_SQQQ']
+
+    return {
+        "df_latest": df_latest,
+        "signals": signals,
+        "prices": dict_prices,
+        "last_data_date": max(row.name for row in list_rows),
+    }
+
+
+def get_equity(current_portfolio, dict_prices):
+    return current_portfolio["CASH_USD"] + sum(
+        current_portfolio.get(f'{ticker}_SHARES', 0) * price for ticker, price in dict_prices.items()
+    )
+
+
+@timed('sizing')
+def size_universe_accounts(dict_signals, dict_portfolios, universe=UNIVERSE):
+    '''
+    size_universe for {account: current_portfolio}: the signals are shared, so every account's
+    targets come from one calculate_position_sizes call over (account, pair) rows.
+    '''
+    signals, dict_prices = dict_signals['signals'], dict_signals['prices']
+    list_accounts = list(dict_portfolios)
+    n_pairs = len(universe)
+
+    equities = np.array([get_equity(dict_portfolios[account], dict_prices) for account in list_accounts])
+    weights = np.array([pair.get('weight', 1 / n_pairs) for pair in universe])
+    df_rows = dict_signals['df_latest'].iloc[np.tile(np.arange(n_pairs), len(list_accounts))]
+    targets = calculate_position_sizes(df_rows, np.outer(equities, weights).ravel(), np.tile(signals, len(list_accounts)))
+    targets = targets.reshape(len(list_accounts), n_pairs)
+
+    date = get_next_trading_day(dict_signals['last_data_date']).strftime('%Y-%m-%d')
+    dict_results = dict()
+    for account, equity_usd, account_targets in zip(list_accounts, equities, targets):
+        current_portfolio = dict_portfolios[account]
+
+        dict_pairs = dict()
+        for pair, signal, target in zip(universe, signals, account_targets):
+            bull, bear = pair['bull'], pair['bear']
+            dict_target = {
+                bull: int(target) if signal == SIGNAL_TQQQ else 0,
+                bear: int(target) if signal == SIGNAL_SQQQ else 0,
+            }
+            dict_pairs[pair['underlying']] = {
+                "signal": {SIGNAL_TQQQ: bull, SIGNAL_SQQQ: bear}.get(signal, "CASH"),
+                "prices": {bull: dict_prices[bull], bear: dict_prices[bear]},
+                "target": dict_target,
+                "delta": {ticker: n - current_portfolio.get(f'{ticker}_SHARES', 0) for ticker, n in dict_target.items()},
+            }
+
+        dict_results[account] = {
+            "date": date,
+            "equity": float(equity_usd),
+            "pairs": dict_pairs,
+        }
+
+    return dict_results
+
+
+def size_universe(dict_signals, current_portfolio, universe=UNIVERSE):
+    '''
+    The account half of get_universe_deltas: a single allocation of the shared equity over the
+    output of get_universe_signals.
+    '''
+    return size_universe_accounts(dict_signals, {None: current_portfolio}, universe)[None]
+
+
+@timed()
+def get_universe_deltas(start_date, end_date, current_portfolio, universe=UNIVERSE, n_workers=None):
+    '''
+    get_daily_delta over every pair in the universe: one batched price download, indicators on
+    a thread pool, then a single allocation of the shared equity. current_portfolio holds
+    CASH_USD and a {ticker}_SHARES entry per held leveraged ETF. Each pair sizes against its
+    weight of the total equity, so targets never exceed it in sum.
+    '''
+    dict_signals = get_universe_signals(start_date, end_date, universe, n_workers)
+    return size_universe(dict_signals, current_portfolio, universe)
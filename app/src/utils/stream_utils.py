@@ -0,0 +1,245 @@
+import os
+import time
+import threading
+
+import pandas as pd
+import pytz
+import requests
+
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from app.src.utils.market_data_utils import get_ohlcv_batch
+from app.src.utils.indicator_utils import (
+    load_indicator_state,
+    save_indicator_state,
+    sync_indicator_state,
+    peek_indicator_state,
+)
+from app.src.utils.strategy_utils import (
+    UNIVERSE,
+    INDICATOR_PERIODS,
+    DAILY_PRICE_DROP_EXIT_PCT,
+    generate_signal,
+)
+from app.src.utils.qt_utils import (
+    get_symbol_ids,
+    get_quotes,
+    is_session_expiring,
+    reject_session_token,
+)
+
+
+# Quotes are polled (Questrade's L1 push stream needs a WebSocket client this repo does not
+# use), one request per poll for every watched symbol
+POLL_INTERVAL_SECONDS = float(os.getenv('STREAM_POLL_SECONDS', '2'))
+MAX_ALERT_LATENCY_SECONDS = 10
+
+MARKET_TIMEZONE = pytz.timezone('America/New_York')
+MARKET_OPEN = (9, 30)
+MARKET_CLOSE = (16, 0)
+
+N_HISTORY_DAYS = 5 * 365 + 50
+
+
+# --- Watch state ---
+
+def get_pair(ticker, universe=UNIVERSE):
+    return next((pair for pair in universe if pair['underlying'] == ticker), None)
+
+
+def get_signal_label(signal, pair):
+    '''generate_signal's QQQ-layout label as the pair's ETF.'''
+    return {'TQQQ': pair['bull'], 'SQQQ': pair['bear']}.get(signal, 'CASH')
+
+
+def init_watch(ticker, state, universe=UNIVERSE):
+    '''
+    Per-symbol streaming state on top of the indicator state of the last completed session.
+    Symbols that underlie a universe pair also track the pair's signal.
+    '''
+    pair = get_pair(ticker, universe)
+    dict_watch = {
+        'ticker': ticker,
+        'pair': pair,
+        'state': state,
+        'session_date': None,
+        'bar': None,
+        'is_stopped': False,
+        'signal': None,
+        'latest': None,
+    }
+
+    if pair is not None:
+        last_bar = state['last_bar']
+        row = {**state['latest'], 'Close_QQQ': last_bar['Close'], 'Open_QQQ': last_bar['Open']}
+        dict_watch['signal'] = get_signal_label(generate_signal(row), pair)
+
+    return dict_watch
+
+
+def load_watches(tickers, session_date, universe=UNIVERSE):
+    '''{ticker: watch} with indicator states synced to the bars before session_date.'''
+    start_date = (pd.Timestamp(session_date) - timedelta(days=N_HISTORY_DAYS)).strftime('%Y-%m-%d')
+    dict_bars = get_ohlcv_batch(tickers, start_date, pd.Timestamp(session_date).strftime('%Y-%m-%d'))
+
+    dict_watches = dict()
+    for ticker, df_bars in dict_bars.items():
+        if df_bars.empty:
+            raise ValueError(f'No bars for {ticker} before {session_date}')
+
+        state = sync_indicator_state(load_indicator_state(ticker), df_bars[['Open', 'High', 'Low', 'Close']], INDICATOR_PERIODS)
+        save_indicator_state(ticker, state)
+        dict_watches[ticker] = init_watch(ticker, state, universe)
+
+    return dict_watches
+
+
+# --- Per-tick evaluation ---
+
+def update_session_bar(dict_watch, quote):
+    '''Fold a quote into the forming session bar; the quote's own open/high/low win when present.'''
+    price = quote['price']
+    bar = dict_watch['bar']
+
+    if bar is None or dict_watch['session_date'] != quote['session_date']:
+        bar = {'Open': price, 'High': price, 'Low': price, 'Close': price}
+        dict_watch['bar'] = bar
+        dict_watch['session_date'] = quote['session_date']
+        dict_watch['is_stopped'] = False
+
+    bar['Open'] = quote.get('open') or bar['Open']
+    bar['High'] = max(bar['High'], price, quote.get('high') or price)
+    bar['Low'] = min(bar['Low'], price, quote.get('low') or price)
+    bar['Close'] = price
+
+    return bar
+
+
+def evaluate_tick(dict_watch, quote):
+    '''
+    Apply one quote in constant time: update the session bar, peek the indicators it implies
+    and check the stop and signal rules. Returns the alerts it raised (each at most once per
+    session for stops, on every change for signals).
+    '''
+    bar = update_session_bar(dict_watch, quote)
+    latest = peek_indicator_state(dict_watch['state'], bar)
+    dict_watch['latest'] = latest
+
+    list_alerts = list()
+    move = bar['Close'] / bar['Open'] - 1
+    if not dict_watch['is_stopped'] and move <= -DAILY_PRICE_DROP_EXIT_PCT:
+        dict_watch['is_stopped'] = True
+        list_alerts.append({'kind': 'stop', 'ticker': dict_watch['ticker'], 'price': bar['Close'],
+                            'open': bar['Open'], 'move': move, 'received_at': quote['received_at']})
+
+    pair = dict_watch['pair']
+    if pair is not None:
+        row = {**latest, 'Close_QQQ': bar['Close'], 'Open_QQQ': bar['Open']}
+        signal = get_signal_label(generate_signal(row), pair)
+        if signal != dict_watch['signal']:
+            list_alerts.append({'kind': 'signal', 'ticker': dict_watch['ticker'], 'price': bar['Close'],
+                                'from': dict_watch['signal'], 'to': signal, 'received_at': quote['received_at']})
+            dict_watch['signal'] = signal
+
+    return list_alerts
+
+
+def format_alert(dict_alert):
+    delay = time.time() - dict_alert['received_at']
+    if dict_alert['kind'] == 'stop':
+        text = (f"STOP {dict_alert['ticker']}: {dict_alert['move']:.1%} from open "
+                f"(${dict_alert['open']:.2f} -> ${dict_alert['price']:.2f}), exit to CASH")
+    else:
+        text = f"SIGNAL {dict_alert['ticker']} @ ${dict_alert['price']:.2f}: {dict_alert['from']} -> {dict_alert['to']}"
+
+    return f'{text} [{delay:.2f}s after quote]'
+
+
+# --- Feed ---
+
+def parse_quote(dict_quote):
+    '''A Questrade L1 quote as {'symbol', 'price', 'open', 'high', 'low', 'session_date', 'received_at'}.'''
+    quote_time = pd.Timestamp(dict_quote.get('lastTradeTime') or pd.Timestamp.now(tz=MARKET_TIMEZONE))
+    if quote_time.tzinfo is None:
+        quote_time = quote_time.tz_localize(MARKET_TIMEZONE)
+
+    return {
+        'symbol': dict_quote['symbol'],
+        'price': float(dict_quote['lastTradePrice']),
+        'open': float(dict_quote.get('openPrice') or 0),
+        'high': float(dict_quote.get('highPrice') or 0),
+        'low': float(dict_quote.get('lowPrice') or 0),
+        'session_date': quote_time.tz_convert(MARKET_TIMEZONE).strftime('%Y-%m-%d'),
+        # lastTradeTime can be minutes old for a thin symbol, so latency counts from receipt
+        'received_at': time.time(),
+    }
+
+
+def poll_questrade_quotes(dict_symbol_ids):
+    return [parse_quote(dict_quote) for dict_quote in get_quotes(list(dict_symbol_ids.values()))]
+
+
+def is_market_open(now=None):
+    now = (now or datetime.now(MARKET_TIMEZONE)).astimezone(MARKET_TIMEZONE)
+    minutes = now.hour * 60 + now.minute
+    return now.weekday() < 5 and MARKET_OPEN[0] * 60 + MARKET_OPEN[1] <= minutes < MARKET_CLOSE[0] * 60 + MARKET_CLOSE[1]
+
+
+# --- Loop ---
+
+def run_stream(tickers, send_alert, poll_quotes=None, poll_interval=POLL_INTERVAL_SECONDS,
+               stop_event=None, market_hours_only=True, universe=UNIVERSE, ensure_session=None):
+    '''
+    Poll quotes for tickers until stop_event is set and send every alert through send_alert(text).
+    Alerts are sent from a separate thread so a slow Telegram call never delays the next poll;
+    the latency from quote to alert is then bounded by the poll interval plus one request.
+    ensure_session() keeps the Questrade access token fresh. It only runs when the token held in
+    memory is about to expire or a poll came back 401, so a poll costs no lock or token file read.
+    '''
+    stop_event = stop_event or threading.Event()
+    if poll_quotes is None:
+        dict_symbol_ids = get_symbol_ids(tickers)
+        poll_quotes = lambda: poll_questrade_quotes(dict_symbol_ids)
+
+    dict_watches = None
+    session_date = None
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='alerts') as alert_executor:
+        while not stop_event.is_set():
+            poll_start = time.time()
+
+            if market_hours_only and not is_market_open():
+                stop_event.wait(poll_interval)
+                continue
+
+            try:
+                if ensure_session is not None and is_session_expiring():
+                    ensure_session()
+                list_quotes = poll_quotes()
+            except requests.exceptions.RequestException as e:
+                if ensure_session is not None and getattr(e.response, 'status_code', None) == 401:
+                    reject_session_token()
+                print(f'Quote poll failed ({e!r}), retrying')
+                stop_event.wait(poll_interval)
+                continue
+
+            # A new session: fold yesterday's completed bar into the indicator states
+            today = max((quote['session_date'] for quote in list_quotes), default=session_date)
+            if today != session_date:
+                dict_watches = load_watches(tickers, today, universe)
+                session_date = today
+
+            for quote in list_quotes:
+                dict_watch = dict_watches.get(quote['symbol'])
+                if dict_watch is None:
+                    continue
+
+                for dict_alert in evaluate_tick(dict_watch, quote):
+                    if time.time() - dict_alert['received_at'] > MAX_ALERT_LATENCY_SECONDS:
+                        print(f"Alert for {dict_alert['ticker']} is late by {time.time() - dict_alert['received_at']:.1f}s")
+                    alert_executor.submit(send_alert, format_alert(dict_alert))
+
+            stop_event.wait(max(poll_interval - (time.time() - poll_start), 0))
+
+    return dict_watches
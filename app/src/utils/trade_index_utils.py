@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+
+INDEX_COLS = ['symbol', 'account_type', 'activity_type']
+
+
+class TradeIndex:
+    '''
+    Long-lived lookup structure over a trades frame. Each INDEX_COLS column is factorized into
+    categorical codes with the sorted row positions of every distinct value. Case-insensitive
+    substring patterns are evaluated once against the distinct values (tens of symbols rather
+    than every row) and memoized, so a repeated query is a few array intersections.
+    '''
+
+    def __init__(self, df_trades):
+        self.df_source = df_trades
+        self.df_trades = df_trades.reset_index(drop=True)
+        self.n_rows = self.df_trades.shape[0]
+        self.dict_codes = dict()
+        self.dict_values = dict()
+        self.dict_positions = dict()
+        self.dict_matches = dict()
+
+        for col in INDEX_COLS:
+            codes, values = pd.factorize(self.df_trades[col], use_na_sentinel=True)
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+
+            self.dict_codes[col] = codes
+            self.dict_values[col] = pd.Series(values, dtype=object)
+            self.dict_positions[col] = [order[bounds[i]:bounds[i + 1]] for i in range(len(values))]
+
+    def match_codes(self, col, pattern, exact=False):
+        '''Codes of the distinct values matching pattern: == when exact, else str.contains(case=False).'''
+        key = (col, pattern, exact)
+        if key not in self.dict_matches:
+            values = self.dict_values[col]
+            if exact:
+                is_match = (values == pattern).to_numpy()
+            else:
+                # Not in place: to_numpy can return a read-only view under copy-on-write
+                is_match = values.astype(str).str.contains(pattern, case=False, na=False).to_numpy() & values.notna().to_numpy()
+            self.dict_matches[key] = np.flatnonzero(is_match)
+
+        return self.dict_matches[key]
+
+    def get_positions(self, col, pattern, exact=False):
+        codes = self.match_codes(col, pattern, exact=exact)
+        if len(codes) == 0:
+            return np.zeros(0, dtype=np.intp)
+        if len(codes) == 1:
+            return self.dict_positions[col][codes[0]]
+
+        return np.sort(np.concatenate([self.dict_positions[col][code] for code in codes]))
+
+    def query(self, symbol, account_type='', activity_type='', symbol_exact_match=False):
+        '''Row positions (in frame order) matching the same filters as qt_utils.get_trades.'''
+        positions = self.get_positions('symbol', symbol, exact=symbol_exact_match)
+
+        if account_type:
+            positions = np.intersect1d(positions, self.get_positions('account_type', account_type), assume_unique=True)
+
+        if activity_type:
+            positions = np.intersect1d(positions, self.get_positions('activity_type', activity_type), assume_unique=True)
+
+        return positions
+
+    def get_rows(self, positions):
+        return self.df_trades.iloc[positions].reset_index(drop=True)
@@ -0,0 +1,180 @@
+import os
+import re
+import json
+import base64
+import hashlib
+import threading
+
+import requests
+
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+# 'live' talks to the services, 'record' also saves every response, 'replay' serves saved
+# responses only and never opens a connection
+TRANSPORT_MODES = ['live', 'record', 'replay']
+PATH_CASSETTES = 'data/cassettes'
+
+# Secrets kept out of cassette keys and files
+REDACTED = 'redacted'
+REDACT_PARAMS = ['refresh_token']
+REDACT_FIELDS = ['access_token', 'refresh_token']
+PATTERN_BOT_TOKEN = re.compile(r'/bot[^/]+/')
+
+SESSION = None
+SESSION_LOCK = threading.Lock()
+
+
+# --- Configuration ---
+
+def get_transport_mode():
+    mode = os.getenv('TRANSPORT_MODE', 'live')
+    if mode not in TRANSPORT_MODES:
+        raise ValueError(f'TRANSPORT_MODE must be one of {TRANSPORT_MODES}, got {mode!r}')
+
+    return mode
+
+
+def get_path_cassettes():
+    return os.getenv('PATH_CASSETTES', PATH_CASSETTES)
+
+
+def get_base_url(service, default=''):
+    '''
+    Base URL for a service ('questrade_login', 'frankfurter', 'yahoo', 'telegram'). URL_STANDIN
+    points every service at one stand-in server; URL_{SERVICE} overrides a single one.
+    '''
+    url = os.getenv('URL_STANDIN') or os.getenv(f'URL_{service.upper()}') or default
+    return url.rstrip('/')
+
+
+def is_live_service(service):
+    '''
+    True when requests to service reach the real thing: not replayed from cassettes and not
+    pointed at a stand-in. Credentials from anything else (stand-in or redacted tokens) must
+    never be written where a live run would read them.
+    '''
+    return get_transport_mode() != 'replay' and not get_base_url(service)
+
+
+# --- Cassettes ---
+
+def get_cassette_key(method, url):
+    '''METHOD path?sorted-query, without the host (Questrade rotates API servers) or secrets.'''
+    parts = urlsplit(url)
+    path = PATTERN_BOT_TOKEN.sub(f'/bot{REDACTED}/', parts.path)
+    query = sorted((key, REDACTED if key in REDACT_PARAMS else value) for key, value in parse_qsl(parts.query, keep_blank_values=True))
+
+    return f'{method.upper()} {path}?{urlencode(query)}' if query else f'{method.upper()} {path}'
+
+
+def get_cassette_path(key, path_cassettes=None):
+    file_name = f'{hashlib.sha1(key.encode()).hexdigest()[:20]}.json'
+    return os.path.join(path_cassettes or get_path_cassettes(), file_name)
+
+
+def redact_body(content):
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return content
+
+    if isinstance(body, dict) and any(field in body for field in REDACT_FIELDS):
+        body.update({field: REDACTED for field in REDACT_FIELDS if field in body})
+        return json.dumps(body).encode()
+
+    return content
+
+
+def save_cassette(key, status_code, headers, content, path_cassettes=None):
+    path = get_cassette_path(key, path_cassettes)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    dict_cassette = {
+        'key': key,
+        'status_code': status_code,
+        'headers': {name: value for name, value in headers.items() if name.lower() == 'content-type'},
+        'body_b64': base64.b64encode(redact_body(content)).decode(),
+    }
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(dict_cassette, file, indent=1)
+    os.replace(f'{path}.tmp', path)
+
+
+def load_cassette(key, path_cassettes=None):
+    '''(status_code, headers, content) recorded for key, or None.'''
+    path = get_cassette_path(key, path_cassettes)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as file:
+        dict_cassette = json.load(file)
+
+    return dict_cassette['status_code'], dict_cassette['headers'], base64.b64decode(dict_cassette['body_b64'])
+
+
+# --- Transport ---
+
+class RecordReplayAdapter(HTTPAdapter):
+    '''HTTPAdapter that saves responses in record mode and answers from the cassettes in replay mode.'''
+
+    def __init__(self, mode, path_cassettes=None, **kwargs):
+        super().__init__(**kwargs)
+        self.mode = mode
+        self.path_cassettes = path_cassettes
+
+    def send(self, request, **kwargs):
+        key = get_cassette_key(request.method, request.url)
+
+        if self.mode == 'replay':
+            cassette = load_cassette(key, self.path_cassettes)
+            if cassette is None:
+                raise requests.exceptions.ConnectionError(f'No recorded response for {key}', request=request)
+            return build_response(request, *cassette)
+
+        response = super().send(request, **kwargs)
+        if self.mode == 'record':
+            save_cassette(key, response.status_code, response.headers, response.content, self.path_cassettes)
+
+        return response
+
+
+def build_response(request, status_code, headers, content):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = content
+    response.encoding = 'utf-8'
+    response.url = request.url
+    response.request = request
+    response.reason = 'Replayed'
+
+    return response
+
+
+def mount_transport(session, pool_maxsize=10, mode=None):
+    '''Mount the adapter for the configured TRANSPORT_MODE on both schemes of session.'''
+    mode = mode or get_transport_mode()
+
+    if mode == 'live':
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+    else:
+        adapter = RecordReplayAdapter(mode, get_path_cassettes(), pool_connections=1, pool_maxsize=pool_maxsize)
+
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+def get_session():
+    '''Shared keep-alive session for one-off calls (token refresh, FX, prices, Telegram).'''
+    global SESSION
+
+    with SESSION_LOCK:
+        if SESSION is None:
+            SESSION = mount_transport(requests.Session())
+
+    return SESSION